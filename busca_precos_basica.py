@@ -1,15 +1,27 @@
 import pandas as pd
+import numpy as np
 import requests
+from requests.adapters import HTTPAdapter
 import json
 import time
 import logging
 import os
 import re
-from typing import Dict, Any, Optional, List
-from dataclasses import dataclass
+import sys
+import math
+import hashlib
+import threading
+from array import array
+from concurrent.futures import Future
+from typing import Dict, Any, Optional, List, Tuple
+from dataclasses import asdict, dataclass, replace
 from datetime import datetime
 from dotenv import load_dotenv
 
+from perfilamento import profiler
+from prompts import SEARCH_PROMPT_VERSION, SEARCH_SYSTEM_PROMPT, estimate_tokens, search_user_prompt
+from provedores import Provider, ProviderError, ProviderRouter
+
 # Load environment variables
 load_dotenv(override=True)
 
@@ -17,16 +29,429 @@ load_dotenv(override=True)
 logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s')
 logger = logging.getLogger(__name__)
 
+# Categorical status codes (labels are what the reports show)
+STATUS_FOUND = 0
+STATUS_FILTERED = 1
+STATUS_NOT_FOUND = 2
+STATUS_NOT_PROCESSED = 3
+STATUS_LABELS = ['price_found', 'filtered_out', 'not_found', 'not_processed']
+STATUS_CODES = {label: code for code, label in enumerate(STATUS_LABELS)}
+# Labels written by older versions
+STATUS_CODES.update({'filtrado': STATUS_FILTERED, 'não encontrado': STATUS_NOT_FOUND})
+
+# API pricing in USD per 1M tokens, plus a flat fee per request
+MODEL_PRICING = {
+    'sonar': {'input': 1.0, 'output': 1.0, 'request': 0.005},
+    'sonar-pro': {'input': 3.0, 'output': 15.0, 'request': 0.006},
+    'gpt-4o-mini': {'input': 0.15, 'output': 0.60, 'request': 0.0},
+    'gpt-4o': {'input': 2.50, 'output': 10.0, 'request': 0.0},
+    'default': {'input': 2.50, 'output': 10.0, 'request': 0.0},  # unknown models: conservative
+}
+
+@dataclass
+class SearchTier:
+    """One step of the search escalation: Perplexity model, answer size and parallel calls"""
+    model: str
+    max_tokens: int
+    concurrency: int = 4
+    
+    @property
+    def label(self) -> str:
+        """Name shown in results and reports (the same model may appear with longer answers)"""
+        return f"{self.model}/{self.max_tokens}"
+
+def parse_search_tiers(spec: str) -> List[SearchTier]:
+    """Parse 'model:max_tokens[:concurrency],...' (cheapest tier first)"""
+    tiers = []
+    for part in spec.split(','):
+        fields = [field.strip() for field in part.split(':')]
+        if not fields[0]:
+            continue
+        tier = SearchTier(fields[0], int(fields[1]) if len(fields) > 1 else 500)
+        if len(fields) > 2:
+            tier.concurrency = int(fields[2])
+        tiers.append(tier)
+    if not tiers:
+        raise ValueError(f"Invalid search tiers: {spec!r}")
+    return tiers
+
+DEFAULT_SEARCH_TIERS = 'sonar:150:4,sonar-pro:500:2'
+
+# Default search backend (SEARCH_PROVIDERS adds/replaces backends, see provedores.py)
+PERPLEXITY_URL = "https://api.perplexity.ai/chat/completions"
+
+# Processing orders of a spreadsheet (see PriceDiscoverySystem.schedule)
+SCHEDULING_STRATEGIES = ('value', 'category')
+
 @dataclass
 class PriceResult:
     """Result of price search for a single item"""
     item: str
-    status: str  # 'price_found', 'filtered_out', 'not_found'
+    status: str  # 'price_found', 'filtered_out', 'not_found', 'not_processed'
     reason: str
     price: Optional[float] = None
     store: Optional[str] = None
     url: Optional[str] = None
     confidence: Optional[float] = None
+    category: Optional[str] = None
+    elapsed: Optional[float] = None  # seconds spent on this item
+    match_score: Optional[float] = None  # similarity to the item whose price was reused
+    tier: Optional[str] = None  # search tier (model/max_tokens) that produced the price
+    verification: Optional[str] = None  # URL/price check outcome (see verificacao.py)
+    provider: Optional[str] = None  # search backend that answered (see provedores.py)
+    prompt_tokens: Optional[int] = None  # tokens of the API calls made for this item
+    completion_tokens: Optional[int] = None
+    cached_tokens: Optional[int] = None  # prompt tokens served from the provider's prompt cache
+    prompt_version: Optional[str] = None  # prompt template used (see prompts.py)
+
+# Fields cleared when a result is reused for another item: it made no call of its
+# own, so the donor's tokens, tier, backend and prompt version do not apply
+REUSED = {'prompt_tokens': None, 'completion_tokens': None, 'cached_tokens': None,
+          'tier': None, 'provider': None, 'prompt_version': None}
+
+class ResultStore:
+    """
+    Compact, column-oriented storage for the PriceResults of a run.
+    Strings are interned once (items, reasons, stores, URLs, categories share
+    one table), statuses are 1-byte codes and numbers live in typed arrays,
+    so a 1M-item run does not keep 1M dataclasses around.
+    """
+    
+    def __init__(self, size: int = 0):
+        """Preallocate `size` rows marked as not processed"""
+        self._string_ids: Dict[str, int] = {}
+        self._strings: List[str] = []
+        self.item_ids = array('i', [-1]) * size
+        self.status = array('B', [STATUS_NOT_PROCESSED]) * size
+        self.reason_ids = array('i', [-1]) * size
+        self.store_ids = array('i', [-1]) * size
+        self.url_ids = array('i', [-1]) * size
+        self.category_ids = array('i', [-1]) * size
+        self.tier_ids = array('i', [-1]) * size
+        self.verification_ids = array('i', [-1]) * size
+        self.provider_ids = array('i', [-1]) * size
+        self.prompt_version_ids = array('i', [-1]) * size
+        self.prompt_tokens = array('i', [-1]) * size
+        self.completion_tokens = array('i', [-1]) * size
+        self.cached_tokens = array('i', [-1]) * size
+        self.price = array('d', [math.nan]) * size
+        self.confidence = array('d', [math.nan]) * size
+        self.elapsed = array('d', [math.nan]) * size
+        self.match_score = array('d', [math.nan]) * size
+    
+    @classmethod
+    def from_results(cls, results) -> 'ResultStore':
+        """Build a store from any iterable of PriceResults (None rows stay not processed)"""
+        results = list(results)
+        store = cls(len(results))
+        for index, result in enumerate(results):
+            if result is not None:
+                store.set(index, result)
+        return store
+    
+    def _intern(self, value: Optional[str]) -> int:
+        if value is None or (isinstance(value, float) and math.isnan(value)):
+            return -1
+        value = str(value)
+        string_id = self._string_ids.get(value)
+        if string_id is None:
+            string_id = len(self._strings)
+            self._string_ids[value] = string_id
+            self._strings.append(value)
+        return string_id
+    
+    def _string(self, string_id: int) -> Optional[str]:
+        return self._strings[string_id] if string_id >= 0 else None
+    
+    @staticmethod
+    def _number(value: float) -> Optional[float]:
+        return None if math.isnan(value) else value
+    
+    @staticmethod
+    def _count(value: int) -> Optional[int]:
+        return None if value < 0 else value
+    
+    def set(self, index: int, result: PriceResult):
+        """Store a result at a given row"""
+        self.item_ids[index] = self._intern(result.item)
+        self.status[index] = STATUS_CODES.get(result.status, STATUS_NOT_FOUND)
+        self.reason_ids[index] = self._intern(result.reason)
+        self.store_ids[index] = self._intern(result.store)
+        self.url_ids[index] = self._intern(result.url)
+        self.category_ids[index] = self._intern(result.category)
+        self.tier_ids[index] = self._intern(result.tier)
+        self.verification_ids[index] = self._intern(result.verification)
+        self.provider_ids[index] = self._intern(result.provider)
+        self.prompt_version_ids[index] = self._intern(result.prompt_version)
+        self.prompt_tokens[index] = -1 if result.prompt_tokens is None else int(result.prompt_tokens)
+        self.completion_tokens[index] = -1 if result.completion_tokens is None else int(result.completion_tokens)
+        self.cached_tokens[index] = -1 if result.cached_tokens is None else int(result.cached_tokens)
+        self.price[index] = math.nan if result.price is None else float(result.price)
+        self.confidence[index] = math.nan if result.confidence is None else float(result.confidence)
+        self.elapsed[index] = math.nan if result.elapsed is None else float(result.elapsed)
+        self.match_score[index] = math.nan if result.match_score is None else float(result.match_score)
+    
+    def __len__(self) -> int:
+        return len(self.status)
+    
+    def __getitem__(self, index: int) -> PriceResult:
+        """Materialize one row as a PriceResult"""
+        return PriceResult(
+            item=self._string(self.item_ids[index]),
+            status=STATUS_LABELS[self.status[index]],
+            reason=self._string(self.reason_ids[index]),
+            price=self._number(self.price[index]),
+            store=self._string(self.store_ids[index]),
+            url=self._string(self.url_ids[index]),
+            confidence=self._number(self.confidence[index]),
+            category=self._string(self.category_ids[index]),
+            elapsed=self._number(self.elapsed[index]),
+            match_score=self._number(self.match_score[index]),
+            tier=self._string(self.tier_ids[index]),
+            verification=self._string(self.verification_ids[index]),
+            provider=self._string(self.provider_ids[index]),
+            prompt_tokens=self._count(self.prompt_tokens[index]),
+            completion_tokens=self._count(self.completion_tokens[index]),
+            cached_tokens=self._count(self.cached_tokens[index]),
+            prompt_version=self._string(self.prompt_version_ids[index])
+        )
+    
+    def __iter__(self):
+        return (self[index] for index in range(len(self)))
+    
+    def count(self, status_code: int) -> int:
+        """Number of rows with a status code"""
+        return self.status.count(status_code)
+    
+    def to_dataframe(self) -> pd.DataFrame:
+        """Results table (same columns as the saved Excel) built straight from the columns"""
+        strings = pd.Index(self._strings, dtype=object)
+        
+        def categorical(ids: array) -> pd.Categorical:
+            return pd.Categorical.from_codes(np.frombuffer(ids, dtype=np.intc), categories=strings)
+        
+        def numbers(values: array) -> np.ndarray:
+            return np.frombuffer(values, dtype=np.float64).copy()
+        
+        def counts(values: array) -> pd.arrays.IntegerArray:
+            data = np.frombuffer(values, dtype=np.intc).astype(np.int64)
+            return pd.arrays.IntegerArray(data, data < 0)
+        
+        return pd.DataFrame({
+            'Item': categorical(self.item_ids),
+            'Status': pd.Categorical.from_codes(
+                np.frombuffer(self.status, dtype=np.uint8).astype(np.int8), categories=STATUS_LABELS
+            ),
+            'Reason': categorical(self.reason_ids),
+            'Price': numbers(self.price),
+            'Store': categorical(self.store_ids),
+            'URL': categorical(self.url_ids),
+            'Confidence': numbers(self.confidence),
+            'Category': categorical(self.category_ids),
+            'Elapsed_s': numbers(self.elapsed),
+            'Match_Score': numbers(self.match_score),
+            'Tier': categorical(self.tier_ids),
+            'Verification': categorical(self.verification_ids),
+            'Provider': categorical(self.provider_ids),
+            'Prompt_Tokens': counts(self.prompt_tokens),
+            'Completion_Tokens': counts(self.completion_tokens),
+            'Cached_Tokens': counts(self.cached_tokens),
+            'Prompt_Version': categorical(self.prompt_version_ids)
+        })
+    
+    def memory_usage(self) -> int:
+        """Approximate bytes held by the store (arrays + interned strings)"""
+        columns = [self.item_ids, self.status, self.reason_ids, self.store_ids, self.url_ids,
+                   self.category_ids, self.tier_ids, self.verification_ids, self.provider_ids, self.prompt_version_ids,
+                   self.prompt_tokens, self.completion_tokens, self.cached_tokens, self.price, self.confidence,
+                   self.elapsed, self.match_score]
+        total = sum(column.buffer_info()[1] * column.itemsize for column in columns)
+        total += sys.getsizeof(self._string_ids) + sys.getsizeof(self._strings)
+        total += sum(sys.getsizeof(value) for value in self._strings)
+        return total
+    
+    def bytes_per_item(self) -> float:
+        """Memory per stored item"""
+        return self.memory_usage() / len(self) if len(self) else 0.0
+    
+    def __repr__(self) -> str:
+        return (f"ResultStore({len(self)} items, {self.count(STATUS_FOUND)} found, "
+                f"{len(self._strings)} unique strings, {self.bytes_per_item():.0f} bytes/item)")
+
+class ResultJournal:
+    """
+    Append-only JSONL file with one PriceResult per finished item, written as
+    soon as the item finishes, so a run that is interrupted or stopped by its
+    budget keeps what was priced and the next run resumes where it stopped.
+    """
+    
+    def __init__(self, path: str):
+        self.path = path
+        self._file = None
+        self._lock = threading.Lock()
+    
+    def read(self) -> List[PriceResult]:
+        """Results already journaled (a later line for the same item wins, e.g. its verified version)"""
+        results: Dict[str, PriceResult] = {}
+        if not os.path.exists(self.path):
+            return []
+        
+        with open(self.path, encoding='utf-8') as f:
+            for line in f:
+                try:
+                    result = PriceResult(**json.loads(line))
+                except (ValueError, TypeError):
+                    # Partial last line of an interrupted run
+                    continue
+                results.pop(result.item, None)
+                results[result.item] = result
+        return list(results.values())
+    
+    def append(self, result: PriceResult):
+        """Write one finished item (flushed right away)"""
+        with self._lock:
+            if self._file is None:
+                self._file = open(self.path, 'a', encoding='utf-8')
+            self._file.write(json.dumps(asdict(result), ensure_ascii=False) + "\n")
+            self._file.flush()
+    
+    def close(self):
+        with self._lock:
+            if self._file is not None:
+                self._file.close()
+                self._file = None
+    
+    def remove(self):
+        """Delete the journal once its results are saved for good"""
+        self.close()
+        if os.path.exists(self.path):
+            os.remove(self.path)
+
+class SingleFlight:
+    """
+    Coalesces concurrent calls with the same key: the first caller runs the
+    function, later callers wait for it and get the same result (or exception).
+    Nothing is kept once the call finishes - caching stays with the caller.
+    """
+    
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._in_flight: Dict[Any, Future] = {}
+        self.calls = 0
+        self.coalesced = 0
+    
+    def do(self, key: Any, function, *args, **kwargs):
+        """Run function(*args, **kwargs) unless a call for the same key is already in flight"""
+        return self.call(key, function, *args, **kwargs)[0]
+    
+    def call(self, key: Any, function, *args, **kwargs) -> Tuple[Any, bool]:
+        """Like do(), also telling whether this caller ran the function (False when coalesced)"""
+        with self._lock:
+            future = self._in_flight.get(key)
+            leader = future is None
+            if leader:
+                future = self._in_flight[key] = Future()
+                self.calls += 1
+            else:
+                self.coalesced += 1
+        
+        if not leader:
+            return future.result(), False
+        
+        try:
+            result = function(*args, **kwargs)
+        except BaseException as e:
+            future.set_exception(e)
+            raise
+        else:
+            future.set_result(result)
+            return result, True
+        finally:
+            with self._lock:
+                del self._in_flight[key]
+    
+    def stats(self) -> Dict[str, int]:
+        """Calls made and calls coalesced into one already in flight"""
+        with self._lock:
+            return {'calls': self.calls, 'coalesced': self.coalesced}
+
+class CostTracker:
+    """Calls, tokens and USD spent by a run, with optional hard cost and time budgets"""
+    
+    def __init__(self, budget_usd: Optional[float] = None, time_budget_s: Optional[float] = None):
+        """
+        Args:
+            budget_usd: Hard cap - calls that would exceed it are not made
+            time_budget_s: Wall-clock budget of the run - no calls are made after it
+        """
+        self.budget_usd = budget_usd
+        self.time_budget_s = time_budget_s
+        self.deadline = time.monotonic() + time_budget_s if time_budget_s else None
+        self.time_stops = 0
+        self._lock = threading.Lock()
+        self.calls: Dict[str, int] = {}
+        self.prompt_tokens = 0
+        self.completion_tokens = 0
+        self.cached_tokens = 0
+        self.spent_usd = 0.0
+        self.budget_stops = 0
+    
+    @classmethod
+    def estimate_tokens(cls, text: str) -> int:
+        """Rough token count of a prompt (no tokenizer dependency)"""
+        return estimate_tokens(text)
+    
+    @staticmethod
+    def cost(model: str, prompt_tokens: float, completion_tokens: float, calls: float = 1) -> float:
+        """USD cost of `calls` requests with the given token totals"""
+        pricing = MODEL_PRICING.get(model, MODEL_PRICING['default'])
+        return (prompt_tokens * pricing['input'] + completion_tokens * pricing['output']) / 1e6 \
+            + calls * pricing['request']
+    
+    def can_spend(self, estimate_usd: float) -> bool:
+        """Whether a call estimated at `estimate_usd` still fits the cost and time budgets"""
+        with self._lock:
+            if self.deadline is not None and time.monotonic() >= self.deadline:
+                self.time_stops += 1
+                return False
+            if self.budget_usd is None or self.spent_usd + estimate_usd <= self.budget_usd:
+                return True
+            self.budget_stops += 1
+            return False
+    
+    def record(self, model: str, prompt_tokens: int, completion_tokens: int, cached_tokens: int = 0):
+        """Account for one finished call (cached_tokens: part of the prompt served from the provider cache)"""
+        with self._lock:
+            self.calls[model] = self.calls.get(model, 0) + 1
+            self.prompt_tokens += prompt_tokens
+            self.completion_tokens += completion_tokens
+            self.cached_tokens += cached_tokens
+            self.spent_usd += self.cost(model, prompt_tokens, completion_tokens)
+    
+    @property
+    def exhausted(self) -> bool:
+        """True once a call was refused by the cost or time budget"""
+        return self.budget_stops > 0 or self.time_stops > 0
+    
+    @property
+    def out_of_time(self) -> bool:
+        """True once the time budget ran out"""
+        return self.time_stops > 0
+    
+    def summary(self) -> Dict[str, Any]:
+        """Totals for logs and reports"""
+        with self._lock:
+            return {
+                'calls': dict(self.calls),
+                'prompt_tokens': self.prompt_tokens,
+                'completion_tokens': self.completion_tokens,
+                'cached_tokens': self.cached_tokens,
+                'spent_usd': round(self.spent_usd, 4),
+                'budget_usd': self.budget_usd,
+                'budget_stops': self.budget_stops,
+                'time_budget_s': self.time_budget_s,
+                'time_stops': self.time_stops
+            }
 
 class PriceDiscoverySystem:
     """
@@ -49,34 +474,161 @@ class PriceDiscoverySystem:
         'adequação', 'regularização', 'licenciamento', 'aprovação'
     ]
     
-    SPECIFIC_INDICATORS = [
-        # Brands
+    # Specific indicators, split by kind so the scheduler can group by brand/product
+    BRAND_INDICATORS = [
         'dell', 'hp', 'samsung', 'lg', 'brastemp', 'electrolux', 'consul',
         'philips', 'panasonic', 'sony', 'apple', 'microsoft', 'logitech',
-        'daikin', 'springer', 'midea', 'gree', 'carrier', 'york',
-        # Product types
+        'daikin', 'springer', 'midea', 'gree', 'carrier', 'york'
+    ]
+    
+    PRODUCT_INDICATORS = [
         'notebook', 'laptop', 'desktop', 'monitor', 'impressora', 'scanner',
         'smartphone', 'tablet', 'iphone', 'ipad', 'galaxy', 'mouse', 'teclado',
         'geladeira', 'freezer', 'fogão', 'cooktop', 'forno', 'microondas',
         'liquidificador', 'batedeira', 'cafeteira', 'torradeira', 'sanduicheira',
         'ar condicionado', 'ventilador', 'aquecedor', 'purificador',
         'televisão', 'tv', 'soundbar', 'home theater', 'caixa de som',
-        # Measurements/specs
-        'polegadas', 'litros', 'watts', 'btus', 'rpm', 'ghz', 'gb', 'tb',
-        'full hd', '4k', 'led', 'oled', 'smart', 'inverter', 'digital',
         # Furniture
         'cadeira', 'mesa', 'armário', 'estante', 'roupeiro', 'gaveteiro',
         'balcão', 'bancada', 'prateleira', 'rack', 'painel', 'sofá'
     ]
     
-    def __init__(self, api_key: str):
-        """Initialize with Perplexity API key"""
+    SPEC_INDICATORS = [
+        'polegadas', 'litros', 'watts', 'btus', 'rpm', 'ghz', 'gb', 'tb',
+        'full hd', '4k', 'led', 'oled', 'smart', 'inverter', 'digital'
+    ]
+    
+    SPECIFIC_INDICATORS = BRAND_INDICATORS + PRODUCT_INDICATORS + SPEC_INDICATORS
+    
+    # Possible names of the category column in the input spreadsheet
+    CATEGORY_COLUMNS = ['Categoria', 'categoria', 'Category', 'category']
+    
+    # Possible names of the quantity column in the input spreadsheet
+    QUANTITY_COLUMNS = ['Quantidade', 'quantidade', 'Qtd', 'qtd', 'Qtde', 'qtde', 'Quantity', 'quantity', 'Qty', 'qty']
+    
+    # Typical unit price (R$) by product type - ranks items before any price is known
+    PRODUCT_PRICE_HINTS = {
+        'notebook': 4000, 'laptop': 4000, 'desktop': 3500, 'monitor': 1000, 'impressora': 1200,
+        'scanner': 1500, 'smartphone': 2000, 'tablet': 1800, 'iphone': 5000, 'ipad': 4000,
+        'galaxy': 2500, 'mouse': 80, 'teclado': 150,
+        'geladeira': 3000, 'freezer': 2500, 'fogão': 1500, 'cooktop': 1000, 'forno': 1200,
+        'microondas': 700, 'liquidificador': 200, 'batedeira': 300, 'cafeteira': 250,
+        'torradeira': 150, 'sanduicheira': 120,
+        'ar condicionado': 2500, 'ventilador': 200, 'aquecedor': 300, 'purificador': 600,
+        'televisão': 2500, 'tv': 2500, 'soundbar': 1000, 'home theater': 1500, 'caixa de som': 300,
+        'cadeira': 600, 'mesa': 800, 'armário': 900, 'estante': 500, 'roupeiro': 1200,
+        'gaveteiro': 500, 'balcão': 700, 'bancada': 900, 'prateleira': 200, 'rack': 500,
+        'painel': 400, 'sofá': 2000
+    }
+    DEFAULT_UNIT_PRICE = 100
+    
+    # Each matched indicator kind (brand, product type, spec) raises the priority by this share
+    SPECIFICITY_BONUS = 0.25
+    
+    # Typical answer size of a search (used for cost estimates)
+    TYPICAL_COMPLETION_TOKENS = 120
+    
+    def __init__(self, api_key: str, cache_ttl: Optional[float] = None, pool_size: int = 10,
+                 min_interval: float = 1.5, history=None, max_age_days: Optional[float] = None,
+                 min_confidence: float = 0.7, similarity=None, cost_tracker: Optional[CostTracker] = None,
+                 search_tiers: Optional[List[SearchTier]] = None, escalation_confidence: float = 0.7,
+                 catalog=None, catalog_min_score: float = 0.75, verifier=None, scheduling: str = 'value',
+                 providers: Optional[ProviderRouter] = None):
+        """
+        Initialize with Perplexity API key.
+        
+        Args:
+            cache_ttl: Seconds a found price stays in the in-memory item cache
+                (None keeps it for the lifetime of the process)
+            pool_size: Size of the HTTP connection pool kept warm between calls
+                (also the concurrency cap of the default provider)
+            min_interval: Rate budget - minimum seconds between API calls of each provider
+            history: PriceHistoryStore where every search is recorded
+            max_age_days: Incremental refresh - reuse history observations newer
+                than this (None always searches again)
+            min_confidence: Incremental refresh - history observations below this
+                confidence are searched again
+            similarity: SimilarityIndex used to reuse prices of near-duplicate
+                items (warmed with the history on incremental refresh)
+            cost_tracker: CostTracker shared with the rest of the run (optional
+                USD budget; searches that would exceed it are skipped)
+            search_tiers: Escalation ladder, cheapest first (default DEFAULT_SEARCH_TIERS)
+            escalation_confidence: Answers without a price or below this confidence
+                are searched again on the next tier
+            catalog: CatalogIndex queried before the paid search
+            catalog_min_score: Minimum relative BM25 score (0-1) to accept a catalog product
+            verifier: ResultVerifier checking returned URLs/prices in the background
+            scheduling: Processing order of a spreadsheet - 'value' (highest estimated
+                value first) or 'category' (similar items together)
+            providers: Search backends routed by live latency/error rate with failover
+                (default: SEARCH_PROVIDERS, or Perplexity with api_key)
+        """
         self.api_key = api_key
-        self.base_url = "https://api.perplexity.ai/chat/completions"
-        self.headers = {
-            "Authorization": f"Bearer {api_key}",
-            "Content-Type": "application/json"
+        self.router = providers or ProviderRouter.from_env(
+            'SEARCH_PROVIDERS',
+            [Provider('perplexity', PERPLEXITY_URL, api_key, concurrency=pool_size, min_interval=min_interval)],
+            min_interval=min_interval
+        )
+        
+        # Keep-alive connection pool shared by every search
+        self.session = requests.Session()
+        adapter = HTTPAdapter(pool_connections=pool_size, pool_maxsize=pool_size)
+        self.session.mount("https://", adapter)
+        self.session.mount("http://", adapter)
+        
+        # In-memory item cache: normalized item -> (PriceResult, stored_at)
+        self.cache_ttl = cache_ttl
+        self._item_cache: Dict[str, Tuple[PriceResult, float]] = {}
+        self._cache_lock = threading.Lock()
+        self.cache_hits = 0
+        
+        # Local price history and incremental refresh settings
+        self.history = history
+        self.max_age_days = max_age_days
+        self.min_confidence = min_confidence
+        self.history_hits = 0
+        
+        # Hit counters are updated by every thread sharing this instance (server jobs)
+        self._counter_lock = threading.Lock()
+        
+        # Token/cost accounting and optional hard budget
+        self.cost_tracker = cost_tracker or CostTracker()
+        
+        # Identical searches in flight at the same time share one API call
+        self.search_flight = SingleFlight()
+        
+        # Local offline catalog, first price source
+        self.catalog = catalog
+        self.catalog_min_score = catalog_min_score
+        self.catalog_hits = 0
+        
+        # Optional background verification of returned URLs and prices
+        self.verifier = verifier
+        
+        # Spreadsheet processing order
+        if scheduling not in SCHEDULING_STRATEGIES:
+            raise ValueError(f"Unknown scheduling '{scheduling}' (use {', '.join(SCHEDULING_STRATEGIES)})")
+        self.scheduling = scheduling
+        
+        # Tiered search: cheap short answer first, stronger model only when needed
+        self.search_tiers = search_tiers or parse_search_tiers(DEFAULT_SEARCH_TIERS)
+        self.escalation_confidence = escalation_confidence
+        self._tier_slots = [threading.BoundedSemaphore(tier.concurrency) for tier in self.search_tiers]
+        self._tier_stats = {
+            tier.label: {'calls': 0, 'resolved': 0, 'latency_s': 0.0, 'cost_usd': 0.0,
+                         'items': 0, 'item_latency_s': 0.0, 'saved_usd': 0.0, 'prompt_tokens': 0,
+                         'completion_tokens': 0, 'cached_tokens': 0}
+            for tier in self.search_tiers
         }
+        self._tier_lock = threading.Lock()
+        
+        # Near-duplicate matching against items already priced
+        self.similarity = similarity
+        self.similarity_hits = 0
+        if similarity is not None and history is not None and max_age_days is not None:
+            for key in history.found_item_keys():
+                similarity.add(key, key)
+            logger.info(f"🔗 Similarity index: {len(similarity)} priced items loaded from history")
     
     def _is_searchable(self, item_description: str) -> bool:
         """
@@ -148,47 +700,393 @@ class PriceDiscoverySystem:
         
         return simplified
     
-    def _search_with_ai(self, item_description: str) -> Optional[Dict[str, Any]]:
+    def _cache_key(self, item_description: str) -> str:
+        """Normalized item used as key for caches"""
+        return self._simplify_item_name(str(item_description)).lower()
+    
+    def _shard_of(self, item_description: str, num_shards: int) -> int:
+        """Stable shard number of an item (same normalized item -> same shard)"""
+        digest = hashlib.sha1(self._cache_key(item_description).encode('utf-8')).hexdigest()
+        return int(digest[:8], 16) % num_shards
+    
+    def _get_cached(self, key: str) -> Optional[PriceResult]:
+        """Return a cached result for the key, if still fresh"""
+        with self._cache_lock:
+            entry = self._item_cache.get(key)
+            if not entry:
+                return None
+            result, stored_at = entry
+            if self.cache_ttl is not None and time.time() - stored_at > self.cache_ttl:
+                del self._item_cache[key]
+                return None
+            self.cache_hits += 1
+            return result
+    
+    def _store_cached(self, key: str, result: PriceResult):
+        """Keep a found price in the item cache"""
+        with self._cache_lock:
+            self._item_cache[key] = (result, time.time())
+    
+    def _count(self, counter: str):
+        """Increment a hit counter (history_hits, similarity_hits, catalog_hits)"""
+        with self._counter_lock:
+            setattr(self, counter, getattr(self, counter) + 1)
+    
+    def cache_stats(self) -> Dict[str, Any]:
+        """Item cache size and hit count"""
+        with self._cache_lock:
+            return {"items": len(self._item_cache), "hits": self.cache_hits}
+    
+    @staticmethod
+    def _find_item_column(df: pd.DataFrame) -> Any:
+        """Find the product description column of the input spreadsheet"""
+        possible_columns = ['Item', 'item', 'Produto', 'produto', 'Descrição', 'descrição']
+        for col in df.columns:
+            if col in possible_columns or any(term in str(col).lower() for term in ['item', 'produto', 'descri']):
+                return col
+        return df.columns[0]
+    
+    @classmethod
+    def _find_category_column(cls, df: pd.DataFrame) -> Optional[str]:
+        """Find the category column of the input spreadsheet, if any"""
+        for col in df.columns:
+            if col in cls.CATEGORY_COLUMNS or 'categ' in str(col).lower():
+                return col
+        return None
+    
+    @classmethod
+    def _find_quantity_column(cls, df: pd.DataFrame) -> Optional[str]:
+        """Find the quantity column of the input spreadsheet, if any"""
+        for col in df.columns:
+            if col in cls.QUANTITY_COLUMNS or str(col).lower().startswith('quant'):
+                return col
+        return None
+    
+    @staticmethod
+    def _clean_quantity(value: Any) -> float:
+        """Normalize a raw quantity cell ("2", "2,5", NaN/empty -> 1)"""
+        try:
+            quantity = float(str(value).replace(',', '.'))
+        except ValueError:
+            return 1.0
+        return quantity if quantity > 0 else 1.0
+    
+    @staticmethod
+    def _clean_category(value: Any) -> Optional[str]:
+        """Normalize a raw category cell (NaN/empty -> None)"""
+        category = str(value).strip()
+        if not category or category.lower() in ['nan', 'none']:
+            return None
+        return category
+    
+    @staticmethod
+    def _match_indicator(item_lower: str, indicators: List[str]) -> str:
+        """Return the first indicator found as a whole word in the item, or ''"""
+        for indicator in indicators:
+            if re.search(rf'\b{re.escape(indicator)}\b', item_lower):
+                return indicator
+        return ''
+    
+    @classmethod
+    def _group_key(cls, item_description: str, category: Optional[str] = None) -> Tuple[str, str, str]:
+        """Scheduling key: (category, product type, brand)"""
+        item_lower = str(item_description).lower()
+        return (
+            (category or '').lower(),
+            cls._match_indicator(item_lower, cls.PRODUCT_INDICATORS),
+            cls._match_indicator(item_lower, cls.BRAND_INDICATORS)
+        )
+    
+    @classmethod
+    def _schedule_by_category(cls, entries: List[Tuple[str, Optional[str]]]) -> List[int]:
+        """
+        Order (item, category) entries so similar items are processed together.
+        Groups keep the order of their first appearance and items keep file
+        order inside each group. Returns the indices in processing order.
+        """
+        groups: Dict[Tuple[str, str, str], List[int]] = {}
+        for idx, (item, category) in enumerate(entries):
+            groups.setdefault(cls._group_key(item, category), []).append(idx)
+        
+        return [idx for indices in groups.values() for idx in indices]
+    
+    def _estimate_values(self, entries: List[Tuple[str, Optional[str]]],
+                         quantities: Optional[List[float]] = None) -> List[float]:
+        """
+        Estimated value (R$) of each (item, category) entry: quantity x unit price
+        x specificity. The unit price is the item's last price in the history, else
+        the median history price of its product type, else PRODUCT_PRICE_HINTS, else
+        the median estimate of its category in the same file.
+        """
+        history_prices = self.history.latest_prices() if self.history is not None else {}
+        observed: Dict[str, List[float]] = {}
+        for key, price in history_prices.items():
+            product = self._match_indicator(key, self.PRODUCT_INDICATORS)
+            if product:
+                observed.setdefault(product, []).append(price)
+        product_prices = {product: float(np.median(prices)) for product, prices in observed.items()}
+        
+        units: List[Optional[float]] = []
+        specificity: List[float] = []
+        by_category: Dict[str, List[float]] = {}
+        for item, category in entries:
+            category_key, product, brand = self._group_key(item, category)
+            spec = self._match_indicator(str(item).lower(), self.SPEC_INDICATORS)
+            unit = (history_prices.get(self._cache_key(item)) or product_prices.get(product)
+                    or self.PRODUCT_PRICE_HINTS.get(product))
+            if unit and category_key:
+                by_category.setdefault(category_key, []).append(unit)
+            units.append(unit)
+            specificity.append(1 + self.SPECIFICITY_BONUS * sum(bool(match) for match in (product, brand, spec)))
+        
+        category_prices = {category: float(np.median(prices)) for category, prices in by_category.items()}
+        quantities = quantities or [1.0] * len(entries)
+        return [
+            quantity * (unit or category_prices.get((category or '').lower(), self.DEFAULT_UNIT_PRICE)) * bonus
+            for (_, category), unit, quantity, bonus in zip(entries, units, quantities, specificity)
+        ]
+    
+    def _schedule_by_value(self, entries: List[Tuple[str, Optional[str]]],
+                           quantities: Optional[List[float]] = None) -> List[int]:
+        """
+        Order entries by estimated value, highest first, so a run cut short by its
+        time or cost budget already has the items that matter. Ties keep the
+        category grouping of _schedule_by_category.
         """
-        Pesquisa o preço de um item usando a IA da Perplexity.
+        values = self._estimate_values(entries, quantities)
+        rank = {idx: position for position, idx in enumerate(self._schedule_by_category(entries))}
+        order = sorted(range(len(entries)), key=lambda idx: (-values[idx], rank[idx]))
+        
+        if order:
+            top = ', '.join(f"{str(entries[idx][0])[:30]} (R$ {values[idx]:,.0f})" for idx in order[:3])
+            logger.info(f"🏷️ Highest estimated value first: {top}")
+        return order
+    
+    def schedule(self, entries: List[Tuple[str, Optional[str]]],
+                 quantities: Optional[List[float]] = None) -> List[int]:
+        """Processing order of the entries according to `scheduling`"""
+        if self.scheduling == 'category':
+            return self._schedule_by_category(entries)
+        return self._schedule_by_value(entries, quantities)
+    
+    @staticmethod
+    def _category_summary(results) -> pd.DataFrame:
+        """Per-category success rates and search throughput (searched items over their own time)"""
+        store = results if isinstance(results, ResultStore) else ResultStore.from_results(results)
+        df = store.to_dataframe()
+        df['Category'] = df['Category'].astype(object).fillna('Sem categoria')
+        df['Searched'] = ~df['Status'].isin(['filtered_out', 'not_processed'])
+        df['Found'] = df['Status'] == 'price_found'
+        # Filtered and skipped items take no search time and would inflate the throughput
+        df['Elapsed_s'] = df['Elapsed_s'].where(df['Searched'])
+        
+        summary = df.groupby('Category', sort=False).agg(
+            Items=('Item', 'size'),
+            Searched=('Searched', 'sum'),
+            Found=('Found', 'sum'),
+            Elapsed_s=('Elapsed_s', 'sum')
+        ).reset_index()
+        summary['Success_Rate'] = (summary['Found'] / summary['Searched'].where(summary['Searched'] > 0)).fillna(0.0)
+        summary['Items_per_min'] = summary['Searched'] / summary['Elapsed_s'].where(summary['Elapsed_s'] > 0) * 60
+        return summary
+    
+    def _build_search_messages(self, item_description: str) -> List[Dict[str, str]]:
+        """
+        Mensagens enviadas à Perplexity para um item: instruções fixas na
+        mensagem de sistema (prefixo idêntico em todas as chamadas, aproveitável
+        pelo cache de prompt do provedor) e só o produto na mensagem do usuário.
         """
         simplified_item = self._simplify_item_name(item_description)
+        return [
+            {"role": "system", "content": SEARCH_SYSTEM_PROMPT},
+            {"role": "user", "content": search_user_prompt(simplified_item)}
+        ]
+    
+    def estimate_prompt_tokens(self, item_description: str) -> int:
+        """Estimated prompt tokens of one search for the item (system + user message)"""
+        return sum(CostTracker.estimate_tokens(message['content'])
+                   for message in self._build_search_messages(item_description))
+    
+    def estimate_search_cost(self, item_description: str, tier: Optional[SearchTier] = None) -> float:
+        """Estimated USD cost of one Perplexity search for the item (first tier by default)"""
+        tier = tier or self.search_tiers[0]
+        prompt_tokens = self.estimate_prompt_tokens(item_description)
+        return CostTracker.cost(tier.model, prompt_tokens, min(self.TYPICAL_COMPLETION_TOKENS, tier.max_tokens))
+    
+    def _search_with_ai(self, item_description: str) -> Tuple[Optional[Dict[str, Any]], Dict[str, int]]:
+        """
+        Pesquisa o preço de um item usando a IA da Perplexity, subindo de nível
+        (modelo/tamanho da resposta) apenas quando o nível anterior não encontra
+        preço ou tem confiança baixa.
         
-        prompt = f"""
-        Encontre o menor preço atual de "{simplified_item}" no Brasil.
+        Returns:
+            (melhor resposta ou None, tokens somados de todas as chamadas do item)
+        """
+        messages = self._build_search_messages(item_description)
+        best = None
+        usage = {'prompt_tokens': 0, 'completion_tokens': 0, 'cached_tokens': 0}
+        calls = []
         
-        Requisitos:
-        - Busque apenas em sites brasileiros de e-commerce
-        - Retorne apenas se encontrar um preço específico e confiável
-        - Formato da resposta: JSON com price (número), store (nome da loja), url (link), confidence (0-1)
+        for level, tier in enumerate(self.search_tiers):
+            if level > 0:
+                if not self.cost_tracker.can_spend(self.estimate_search_cost(item_description, tier)):
+                    break
+                logger.info(f"⬆️ Escalating to {tier.label}: {item_description[:40]}")
+            
+            price_data, call_usage, latency = self._query_tier(level, messages)
+            for name, tokens in call_usage.items():
+                usage[name] += tokens
+            if call_usage:
+                calls.append((tier, latency, call_usage['prompt_tokens'], call_usage['completion_tokens']))
+            if not price_data:
+                continue
+            price_data['tier'] = tier.label
+            if best is None or price_data.get('confidence', 0.8) > best.get('confidence', 0.8):
+                best = price_data
+            if price_data.get('confidence', 0.8) >= self.escalation_confidence:
+                break
         
-        Exemplo: {{"price": 299.90, "store": "Mercado Livre", "url": "https://...", "confidence": 0.95}}
+        if calls:
+            self._record_item(calls)
+        if best:
+            self._record_resolution(best['tier'])
+        return best, usage
+    
+    def _query_tier(self, level: int, messages: List[Dict[str, str]]
+                    ) -> Tuple[Optional[Dict[str, Any]], Dict[str, int], Optional[float]]:
         """
+        Uma chamada de busca em um nível da escada, no provedor escolhido pelo
+        roteador (failover para o próximo em erro). Devolve (resposta, tokens da
+        chamada, latência da chamada); sem chamada registrada, ({}, None) no lugar.
+        """
+        tier = self.search_tiers[level]
+        payload = {
+            "model": tier.model,
+            "messages": messages,
+            "temperature": 0.1,
+            "max_tokens": tier.max_tokens
+        }
         
         try:
-            response = requests.post(
-                self.base_url,
-                headers=self.headers,
-                json={
-                    "model": "sonar",
-                    "messages": [{"role": "user", "content": prompt}],
-                    "temperature": 0.1,
-                    "max_tokens": 500
-                },
-                timeout=30
-            )
+            with self._tier_slots[level]:
+                (result, latency), provider = self.router.call(lambda provider: self._post(provider, payload))
             
-            if response.status_code == 200:
-                result = response.json()
-                content = result.get('choices', [{}])[0].get('message', {}).get('content', '')
-                return self._extract_price_data(content)
-            else:
-                logger.error(f"Perplexity API error: {response.status_code}")
-                return None
-                
+            usage = result.get('usage') or {}
+            prompt_tokens = usage.get('prompt_tokens') or sum(
+                CostTracker.estimate_tokens(message['content']) for message in messages)
+            completion_tokens = usage.get('completion_tokens') or min(self.TYPICAL_COMPLETION_TOKENS, tier.max_tokens)
+            cached_tokens = (usage.get('prompt_tokens_details') or {}).get('cached_tokens') or 0
+            self.cost_tracker.record(provider.model or tier.model, prompt_tokens, completion_tokens, cached_tokens)
+            self._record_call(tier, latency, prompt_tokens, completion_tokens, cached_tokens)
+            logger.debug(f"   {tier.label} @ {provider.name}: {latency:.2f}s, {prompt_tokens} prompt tokens "
+                         f"({cached_tokens} cached) + {completion_tokens} completion tokens")
+            content = result.get('choices', [{}])[0].get('message', {}).get('content', '')
+            price_data = self._extract_price_data(content)
+            if price_data:
+                price_data['provider'] = provider.name
+            call_usage = {'prompt_tokens': prompt_tokens, 'completion_tokens': completion_tokens,
+                          'cached_tokens': cached_tokens}
+            return price_data, call_usage, latency
+        
         except Exception as e:
             logger.error(f"Pesquisa com IA falhou: {e}")
-            return None
+            return None, {}, None
+    
+    def _post(self, provider: Provider, payload: Dict[str, Any]) -> Tuple[Dict[str, Any], float]:
+        """Uma requisição chat/completions a um provedor: (JSON da resposta, latência da requisição)"""
+        headers = {"Content-Type": "application/json"}
+        if provider.api_key:
+            headers["Authorization"] = f"Bearer {provider.api_key}"
+        if provider.model:
+            payload = dict(payload, model=provider.model)
+        
+        started = time.perf_counter()
+        response = self.session.post(provider.url, headers=headers, json=payload, timeout=30)
+        latency = time.perf_counter() - started
+        
+        if response.status_code != 200:
+            raise ProviderError(f"API error {response.status_code}")
+        return response.json(), latency
+    
+    def _record_call(self, tier: SearchTier, latency: float, prompt_tokens: int, completion_tokens: int,
+                     cached_tokens: int = 0):
+        """Latency/cost/tokens of a tier call"""
+        cost = CostTracker.cost(tier.model, prompt_tokens, completion_tokens)
+        with self._tier_lock:
+            stats = self._tier_stats[tier.label]
+            stats['calls'] += 1
+            stats['latency_s'] += latency
+            stats['cost_usd'] += cost
+            stats['prompt_tokens'] += prompt_tokens
+            stats['completion_tokens'] += completion_tokens
+            stats['cached_tokens'] += cached_tokens
+    
+    def _record_item(self, calls: List[Tuple[SearchTier, float, int, int]]):
+        """
+        Savings of one searched item, credited to the tier where its ladder
+        stopped: the same answer from a single top-tier call minus what all of
+        the item's calls cost (negative when escalating made it dearer).
+
+        Args:
+            calls: (tier, latency, prompt tokens, completion tokens) of each call, in order
+        """
+        top = self.search_tiers[-1]
+        last_tier, _, prompt_tokens, completion_tokens = calls[-1]
+        paid = sum(CostTracker.cost(tier.model, prompt, completion) for tier, _, prompt, completion in calls)
+        with self._tier_lock:
+            stats = self._tier_stats[last_tier.label]
+            stats['items'] += 1
+            stats['item_latency_s'] += sum(latency for _, latency, _, _ in calls)
+            stats['saved_usd'] += CostTracker.cost(top.model, prompt_tokens, completion_tokens) - paid
+    
+    def _record_resolution(self, label: str):
+        """Count an item priced by a tier"""
+        with self._tier_lock:
+            self._tier_stats[label]['resolved'] += 1
+    
+    def tier_summary(self) -> pd.DataFrame:
+        """
+        Items resolved, calls, latency, tokens and cost per search tier. Savings
+        are per item, on the tier where its search stopped: one top-tier call
+        (latency from the average top-tier call observed in this run) minus all
+        of the item's calls, so items that escalated count negative. Responses
+        are not streamed, so the average latency is also the time to first token.
+        """
+        with self._tier_lock:
+            rows = [dict(stats, Tier=label) for label, stats in self._tier_stats.items()]
+        df = pd.DataFrame(rows)
+        calls = df['calls'].where(df['calls'] > 0)
+        df['Avg_Latency_s'] = df['latency_s'] / calls
+        df['Avg_Prompt_Tokens'] = df['prompt_tokens'] / calls
+        df['Avg_Completion_Tokens'] = df['completion_tokens'] / calls
+        
+        top = df.iloc[-1]
+        if top['calls'] > 0:
+            df['saved_s'] = top['Avg_Latency_s'] * df['items'] - df['item_latency_s']
+        else:
+            df['saved_s'] = None
+        
+        return df.rename(columns={
+            'calls': 'Calls', 'resolved': 'Items_Resolved', 'latency_s': 'Latency_s',
+            'cost_usd': 'Cost_USD', 'saved_s': 'Latency_Saved_s', 'saved_usd': 'Cost_Saved_USD',
+            'cached_tokens': 'Cached_Tokens'
+        })[['Tier', 'Items_Resolved', 'Calls', 'Avg_Latency_s', 'Latency_s', 'Avg_Prompt_Tokens',
+            'Avg_Completion_Tokens', 'Cached_Tokens', 'Cost_USD', 'Latency_Saved_s', 'Cost_Saved_USD']]
+    
+    @staticmethod
+    def _parse_confidence(value: Any, default: float = 0.8) -> float:
+        """Confiança informada pela IA como número 0-1 (null, texto inválido ou fora da faixa: default)"""
+        try:
+            if isinstance(value, str):
+                value = value.strip().replace(',', '.')
+                if value.endswith('%'):
+                    value = float(value[:-1]) / 100
+            confidence = float(value)
+        except (TypeError, ValueError):
+            return default
+        if 1.0 < confidence <= 100.0:
+            confidence /= 100
+        return confidence if 0.0 <= confidence <= 1.0 else default
     
     def _extract_price_data(self, ai_response: str) -> Optional[Dict[str, Any]]:
         """Extrai dados estruturados do preço da resposta da IA"""
@@ -198,11 +1096,12 @@ class PriceDiscoverySystem:
             if json_match:
                 data = json.loads(json_match.group())
                 if isinstance(data.get('price'), (int, float)) and data['price'] > 0:
+                    data['confidence'] = self._parse_confidence(data.get('confidence'))
                     return data
-        except:
+        except (ValueError, TypeError, AttributeError):
             pass
         
-        # Fallback: extract price with regex
+        # Fallback: extract price with regex (the answer names no product page, so no store/URL)
         price_match = re.search(r'R\$\s*(\d+(?:[.,]\d+)*)', ai_response)
         if price_match:
             price_str = price_match.group(1).replace(',', '.')
@@ -211,117 +1110,373 @@ class PriceDiscoverySystem:
                 if 5.0 <= price <= 100000.0:
                     return {
                         "price": price,
-                        "store": "Mercado Livre",
-                        "url": "https://mercadolivre.com.br",
+                        "store": None,
+                        "url": None,
                         "confidence": 0.5
                     }
-            except:
+            except ValueError:
                 pass
         
         return None
     
-    def process_item(self, item_description: str) -> PriceResult:
+    def process_item(self, item_description: str, category: Optional[str] = None) -> PriceResult:
         """
         Processa um único item, incluindo validação e busca de preço
         """
+        started = time.perf_counter()
+        result = self._process_item(item_description)
+        result.category = category
+        result.elapsed = time.perf_counter() - started
+        return result
+    
+    def _process_item(self, item_description: str) -> PriceResult:
+        """Validação + busca de um item (sem métricas)"""
         # Step 1: Validate
         if not self._is_searchable(item_description):
             return PriceResult(
                 item=item_description,
-                status="filtrado",
+                status="filtered_out",
                 reason="Item muito genérico ou não pesquisável"
             )
         
-        # Step 2: Search with AI
-        logger.info(f"🤖 Searching: {item_description[:50]}...")
-        price_data = self._search_with_ai(item_description)
+        # Step 2: Reuse a price already found for the same normalized item
+        key = self._cache_key(item_description)
+        cached = self._get_cached(key)
+        if cached:
+            return replace(cached, item=item_description, reason="Found in item cache", match_score=None, **REUSED)
+        
+        # Step 3: Incremental refresh - reuse a recent, confident observation
+        if self.history is not None and self.max_age_days is not None:
+            observation = self.history.fresh_observation(key, self.max_age_days, self.min_confidence)
+            if observation:
+                self._count('history_hits')
+                result = PriceResult(
+                    item=item_description,
+                    status="price_found",
+                    reason=f"Price history ({observation['observed_at'][:10]})",
+                    price=observation['price'],
+                    store=observation['store'],
+                    url=observation['url'],
+                    confidence=observation['confidence'],
+                    verification=observation['verification']
+                )
+                self._store_cached(key, result)
+                return result
+        
+        # Step 4: Reuse the price of a near-duplicate item already priced
+        similar = self._find_similar(item_description, key)
+        if similar:
+            self._count('similarity_hits')
+            self._store_cached(key, similar)
+            return similar
+        
+        # Step 5: Local catalog index (offline, milliseconds)
+        price_data = self._search_catalog(key)
+        tokens = {}
+        
+        # Step 6: Search with AI (unless the budget cap was reached)
+        if not price_data:
+            if not self.cost_tracker.can_spend(self.estimate_search_cost(item_description)):
+                return PriceResult(
+                    item=item_description,
+                    status="not_processed",
+                    reason="Time budget reached" if self.cost_tracker.out_of_time else "Budget cap reached"
+                )
+            
+            logger.info(f"🤖 Searching: {item_description[:50]}...")
+            # Waiters on an identical search in flight made no call of their own
+            (price_data, usage), searched = self.search_flight.call(key, self._search_with_ai, item_description)
+            if searched:
+                tokens = dict(usage, prompt_version=SEARCH_PROMPT_VERSION)
         
         if price_data:
-            return PriceResult(
+            result = PriceResult(
                 item=item_description,
                 status="price_found",
-                reason="Found via AI search",
+                reason=price_data.get('reason', "Found via AI search"),
                 price=price_data.get('price'),
                 store=price_data.get('store'),
                 url=price_data.get('url'),
-                confidence=price_data.get('confidence', 0.8)
+                confidence=price_data.get('confidence', 0.8),
+                match_score=price_data.get('match_score'),
+                tier=price_data.get('tier'),
+                provider=price_data.get('provider'),
+                **tokens
             )
+            self._store_cached(key, result)
+            if self.similarity is not None:
+                self.similarity.add(key, key)
         else:
-            return PriceResult(
+            result = PriceResult(
                 item=item_description,
-                status="não encontrado",
-                reason="Nenhuma correspondência encontrada"
+                status="not_found",
+                reason="Nenhuma correspondência encontrada",
+                **tokens
             )
+        
+        if self.history is not None:
+            self.history.record(key, result)
+        return result
+    
+    def _search_catalog(self, key: str) -> Optional[Dict[str, Any]]:
+        """Best local catalog product for the item, if it scores above the threshold"""
+        if self.catalog is None:
+            return None
+        hits = self.catalog.search(key, limit=1)
+        if not hits or hits[0]['score'] < self.catalog_min_score:
+            return None
+        
+        hit = hits[0]
+        self._count('catalog_hits')
+        return {
+            'price': hit['price'],
+            'store': hit['store'],
+            'url': hit['url'],
+            'confidence': hit['score'],
+            'match_score': hit['score'],
+            'tier': 'catalog',
+            'reason': f"Local catalog: {hit['name']}"
+        }
+    
+    def _find_similar(self, item_description: str, key: str) -> Optional[PriceResult]:
+        """
+        Price of the most similar item already priced: item cache, or history
+        observations that pass the incremental refresh rules
+        """
+        if self.similarity is None:
+            return None
+        match = self.similarity.lookup(key)
+        # The same normalized item is the cache/history steps' decision
+        if not match or match[0] == key:
+            return None
+        
+        matched_key, score = match
+        source = self._get_cached(matched_key)
+        if source is None and self.history is not None and self.max_age_days is not None:
+            observation = self.history.fresh_observation(matched_key, self.max_age_days, self.min_confidence)
+            if observation:
+                source = PriceResult(
+                    item=observation['item'],
+                    status="price_found",
+                    reason="",
+                    price=observation['price'],
+                    store=observation['store'],
+                    url=observation['url'],
+                    confidence=observation['confidence'],
+                    verification=observation['verification']
+                )
+        if source is None:
+            return None
+        
+        logger.info(f"🔗 Similar item ({score:.2f}): {item_description[:40]} ~ {source.item[:40]}")
+        return replace(
+            source,
+            item=item_description,
+            reason=f"Similar item: {source.item}",
+            match_score=round(score, 3),
+            **REUSED
+        )
+    
+    def search_entries(self, entries: List[Tuple[Any, Optional[str]]], order: List[int],
+                       journal: Optional[ResultJournal] = None) -> ResultStore:
+        """
+        Search (item, category) entries in `order` (see schedule). Each finished
+        item goes to the journal right away and items already in it (from an
+        interrupted run) are not searched again; URLs/prices are verified in the
+        background while the next items are searched. Results keep input order.
+        """
+        results = ResultStore(len(entries))
+        # URLs verified in this run only: other runs (server jobs) share the verifier
+        verifying, checks = [], {}
+        
+        journaled = {result.item: result for result in journal.read()} if journal else {}
+        if journaled:
+            logger.info(f"📓 Resuming from journal: {len(journaled)} items already done ({journal.path})")
+        
+        with profiler.stage('search'):
+            for i, idx in enumerate(order):
+                item, category = entries[idx]
+                
+                if item in journaled:
+                    results.set(idx, journaled[item])
+                    continue
+                
+                logger.info(f"🔍 [{i+1}/{len(entries)}] Searching: {str(item)[:50]}...")
+                result = self.process_item(item, category)
+                results.set(idx, result)
+                
+                # Items skipped by the budget stay out of the journal so a resume retries them
+                if journal and result.status != 'not_processed':
+                    journal.append(result)
+                
+                # Verify URL/price in the background while the next items are searched
+                if self.verifier is not None:
+                    future = self.verifier.submit(result, checks)
+                    if future:
+                        verifying.append((idx, future))
+                
+                # Log result
+                if result.status == 'price_found':
+                    logger.info(f"✅ [{i+1}] FOUND: R$ {result.price:.2f} - {result.store}")
+                elif result.status == 'filtered_out':
+                    logger.info(f"⚠️ [{i+1}] FILTERED: {result.reason}")
+                elif result.status == 'not_processed':
+                    logger.info(f"⏸️ [{i+1}] SKIPPED: {result.reason}")
+                else:
+                    logger.info(f"❌ [{i+1}] NOT FOUND: {result.reason}")
+        
+        with profiler.stage('verification'):
+            self._collect_verifications(results, verifying, checks)
+        if journal:
+            # Verified versions replace the earlier lines when the journal is read back
+            for _, future in verifying:
+                journal.append(future.result())
+            journal.close()
+        return results
     
-    def process_excel_file(self, input_file: str, output_file: str) -> List[PriceResult]:
+    def process_excel_file(self, input_file: str, output_file: str,
+                           journal: Optional[ResultJournal] = None) -> ResultStore:
         """
-        Processa uma planilha Excel completa
+        Processa uma planilha Excel completa. Com `journal`, cada item é gravado
+        assim que termina e os itens já gravados por uma execução anterior
+        interrompida não são pesquisados de novo.
         """
         logger.info(f"📂 Loading Excel file: {input_file}")
         
         try:
-            df = pd.read_excel(input_file)
+            with profiler.stage('load_input'):
+                df = pd.read_excel(input_file)
         except Exception as e:
             logger.error(f"Falha ao carregar arquivo Excel: {e}")
-            return []
+            return ResultStore()
         
         logger.info(f"🔢 Processando {len(df)} itens...")
         
-        results = []
-        found_count = 0
-        filtered_count = 0
+        # Group similar items (category, product type, brand) for cache/prompt locality
+        category_column = self._find_category_column(df)
+        item_column = self._find_item_column(df)
+        items = df[item_column].tolist()
+        categories = (
+            [self._clean_category(value) for value in df[category_column]] if category_column
+            else [None] * len(df)
+        )
+        entries = list(zip(items, categories))
+        quantity_column = self._find_quantity_column(df)
+        quantities = [self._clean_quantity(value) for value in df[quantity_column]] if quantity_column else None
+        order = self.schedule(entries, quantities)
+        if category_column:
+            logger.info(f"🗂️ Agrupando itens pela coluna '{category_column}'")
+        if quantity_column:
+            logger.info(f"🔢 Quantidades lidas da coluna '{quantity_column}'")
         
-        for i, (_, row) in enumerate(df.iterrows()):
-            item = row.get('Item', 'N/A')
-            
-            # Process item
-            result = self.process_item(item)
-            results.append(result)
-            
-            # Log result
-            if result.status == 'price_found':
-                found_count += 1
-                logger.info(f"✅ [{i+1}] FOUND: R$ {result.price:.2f} - {result.store}")
-            elif result.status == 'filtered_out':
-                filtered_count += 1
-                logger.info(f"⚠️ [{i+1}] FILTERED: {result.reason}")
-            else:
-                logger.info(f"❌ [{i+1}] NOT FOUND: {result.reason}")
-            
-            # Rate limiting
-            time.sleep(1.5)
+        results = self.search_entries(entries, order, journal)
         
-        # Save results
-        self._save_results(results, output_file)
+        # Save results (in file order)
+        with profiler.stage('save_results'):
+            self._save_results(results, output_file)
         
         # Print summary
         total = len(results)
+        found_count = results.count(STATUS_FOUND)
+        filtered_count = results.count(STATUS_FILTERED)
         logger.info(f"\n📊 SUMMARY: {found_count} found, {filtered_count} filtered, {total-found_count-filtered_count} not found")
         logger.info(f"🎯 Success rate: {found_count/total*100:.1f}% of total items")
         logger.info(f"⚡ Efficiency: {filtered_count} items saved from API calls")
+        logger.info(f"🧮 Result memory: {results.bytes_per_item():.0f} bytes/item "
+                    f"({results.memory_usage()/1024/1024:.1f} MB)")
+        if self.history_hits:
+            logger.info(f"📚 Incremental refresh: {self.history_hits} items reused from price history")
+        if self.similarity_hits:
+            logger.info(f"🔗 Similarity: {self.similarity_hits} items reused from near-duplicates")
+        if self.catalog_hits:
+            logger.info(f"📦 Local catalog: {self.catalog_hits} items priced offline")
+        flight = self.search_flight.stats()
+        if flight['coalesced']:
+            logger.info(f"🤝 Coalesced searches: {flight['coalesced']} items shared an identical search in flight")
+        spend = self.cost_tracker.summary()
+        logger.info(f"💵 API spend: ${spend['spent_usd']:.4f} "
+                    f"({spend['prompt_tokens']} prompt + {spend['completion_tokens']} completion tokens, "
+                    f"{spend['cached_tokens']} cached, prompt {SEARCH_PROMPT_VERSION})")
+        self._log_tier_summary()
+        self.router.log_summary('Search')
+        if self.cost_tracker.out_of_time:
+            logger.warning(f"⏰ Time budget of {spend['time_budget_s']:.0f}s reached: "
+                           f"{results.count(STATUS_NOT_PROCESSED)} items not processed")
+        elif self.cost_tracker.exhausted:
+            logger.warning(f"🛑 Budget cap of ${spend['budget_usd']:.2f} reached: "
+                           f"{results.count(STATUS_NOT_PROCESSED)} items not processed")
+        
+        if category_column:
+            logger.info("🗂️ Per-category results:")
+            for _, row in self._category_summary(results).iterrows():
+                throughput = f"{row['Items_per_min']:.1f} items/min" if pd.notna(row['Items_per_min']) else "n/a"
+                logger.info(f"   {row['Category']}: {row['Found']}/{row['Searched']} found "
+                            f"({row['Success_Rate']*100:.1f}%), {throughput}")
         
         return results
     
-    def _save_results(self, results: List[PriceResult], output_file: str):
-        """Save results to Excel file"""
-        data = []
-        for result in results:
-            data.append({
-                'Item': result.item,
-                'Status': result.status,
-                'Reason': result.reason,
-                'Price': result.price,
-                'Store': result.store,
-                'URL': result.url,
-                'Confidence': result.confidence
-            })
-        
-        df = pd.DataFrame(data)
+    def _collect_verifications(self, results: ResultStore, verifying: List[Tuple[int, Any]], checks: Dict[Any, Any]):
+        """
+        Wait for the background verifications and store the adjusted results
+        (checks: this run's URL checks passed to ResultVerifier.submit)
+        """
+        if not verifying:
+            return
+        logger.info(f"🔎 Waiting for {sum(not future.done() for _, future in verifying)} "
+                    f"of {len(verifying)} URL verifications...")
+        for idx, future in verifying:
+            verified = future.result()
+            results.set(idx, verified)
+            self._store_verification(verified)
+        outcomes = pd.Series([future.result().verification for _, future in verifying]).value_counts()
+        logger.info("🔎 Verification: " + ", ".join(f"{name}={count}" for name, count in outcomes.items()))
+        reused = len(verifying) - len(checks)
+        if reused:
+            logger.info(f"🔎 {reused} verifications reused a URL already checked in this run")
+    
+    def _store_verification(self, result: PriceResult):
+        """Write a verification outcome back to the item cache and the price history"""
+        key = self._cache_key(result.item)
+        with self._cache_lock:
+            entry = self._item_cache.get(key)
+            if entry and entry[0].url == result.url:
+                self._item_cache[key] = (replace(entry[0], verification=result.verification,
+                                                 confidence=result.confidence), entry[1])
+        if self.history is not None:
+            self.history.record_verification(key, result)
+    
+    def _log_tier_summary(self):
+        """Per-tier resolution counts and savings"""
+        summary = self.tier_summary()
+        if not summary['Calls'].sum():
+            return
+        logger.info("🪜 Search tiers:")
+        for _, row in summary.iterrows():
+            saved = f", saved ${row['Cost_Saved_USD']:.4f}" if row['Cost_Saved_USD'] else ""
+            if pd.notna(row['Latency_Saved_s']) and row['Latency_Saved_s']:
+                saved += f" / {row['Latency_Saved_s']:.1f}s"
+            logger.info(f"   {row['Tier']}: {row['Items_Resolved']} resolved in {row['Calls']} calls, "
+                        f"${row['Cost_USD']:.4f}{saved}")
+            if row['Calls']:
+                logger.info(f"      per call: {row['Avg_Latency_s']:.2f}s, {row['Avg_Prompt_Tokens']:.0f} prompt "
+                            f"+ {row['Avg_Completion_Tokens']:.0f} completion tokens "
+                            f"({row['Cached_Tokens']} cached in total)")
+    
+    def _save_results(self, results, output_file: str):
+        """Save results (ResultStore or list of PriceResults) to Excel file"""
+        store = results if isinstance(results, ResultStore) else ResultStore.from_results(results)
+        df = store.to_dataframe()
         df.to_excel(output_file, index=False)
         logger.info(f"💾 Results saved to: {output_file}")
 
 def main():
     """Função principal para execução do sistema"""
+    import argparse
+    
+    parser = argparse.ArgumentParser(description='Price Discovery System (direct search)')
+    parser.add_argument('--profile', nargs='?', const=os.getenv('PROFILE_DIR', 'profiles'), metavar='DIR',
+                        help='Profile each stage and write flame graphs to DIR (default: PROFILE_DIR or profiles)')
+    args = parser.parse_args()
     
     # Configuration
     INPUT_FILE = os.getenv('INPUT_FILE', 'lista.xlsx')
@@ -329,19 +1484,84 @@ def main():
     
     # Get API key
     api_key = str(os.getenv('PERPLEXITY_API_KEY'))
+    
+    # Price history (incremental refresh when REFRESH_MAX_AGE_DAYS is set)
+    HISTORY_DB = os.getenv('PRICE_HISTORY_DB', 'price_history.db')
+    MAX_AGE_DAYS = os.getenv('REFRESH_MAX_AGE_DAYS')
+    MIN_CONFIDENCE = float(os.getenv('REFRESH_MIN_CONFIDENCE', '0.7'))
+    
+    # Near-duplicate matching (0 disables)
+    SIMILARITY_THRESHOLD = float(os.getenv('SIMILARITY_THRESHOLD', '0.8'))
+    
+    # Optional hard cap on API spend (USD) and on wall-clock time (seconds)
+    BUDGET_USD = os.getenv('BUDGET_USD')
+    TIME_BUDGET_S = os.getenv('TIME_BUDGET_S')
+    
+    # Processing order: 'value' (highest estimated value first) or 'category'
+    SCHEDULING = os.getenv('SCHEDULING', 'value')
+    
+    # Local catalog index (used when the directory exists)
+    CATALOG_INDEX = os.getenv('CATALOG_INDEX', 'catalog_index')
+    CATALOG_MIN_SCORE = float(os.getenv('CATALOG_MIN_SCORE', '0.75'))
+    
+    # Background verification of returned URLs/prices
+    VERIFY_RESULTS = os.getenv('VERIFY_RESULTS', '0').lower() in ('1', 'true', 'yes')
+    
+    # Search escalation: "model:max_tokens[:concurrency]", cheapest first
+    SEARCH_TIERS = os.getenv('SEARCH_TIERS', DEFAULT_SEARCH_TIERS)
+    ESCALATION_CONFIDENCE = float(os.getenv('ESCALATION_CONFIDENCE', '0.7'))
 
     # Check input file
     if not os.path.exists(INPUT_FILE):
         logger.error(f"❌ Input file not found: {INPUT_FILE}")
         return
     
+    # Journal of finished items: an interrupted or budget-stopped run resumes
+    # where it stopped (same list and search prompt; incremental runs start over)
+    with open(INPUT_FILE, 'rb') as f:
+        digest = hashlib.md5(f.read() + SEARCH_PROMPT_VERSION.encode('utf-8')).hexdigest()[:8]
+    journal = ResultJournal(f"Resultado_Journal_{digest}.jsonl")
+    if MAX_AGE_DAYS:
+        journal.remove()
+    
     # Run system
     logger.info("🚀 Starting Price Discovery System")
     logger.info("Strategy: Integrated validation + AI search")
     
+    if args.profile:
+        profiler.start(args.profile, label='busca_precos_basica')
+    
     try:
-        system = PriceDiscoverySystem(api_key)
-        results = system.process_excel_file(INPUT_FILE, OUTPUT_FILE)
+        from historico_precos import PriceHistoryStore
+        from similaridade import SimilarityIndex
+        from catalogo import CatalogIndex
+        from verificacao import ResultVerifier
+        
+        system = PriceDiscoverySystem(
+            api_key,
+            min_interval=float(os.getenv('RATE_LIMIT_DELAY', '1.5')),
+            history=PriceHistoryStore(HISTORY_DB),
+            max_age_days=float(MAX_AGE_DAYS) if MAX_AGE_DAYS else None,
+            min_confidence=MIN_CONFIDENCE,
+            similarity=(
+                SimilarityIndex(SIMILARITY_THRESHOLD, brands=PriceDiscoverySystem.BRAND_INDICATORS)
+                if SIMILARITY_THRESHOLD > 0 else None
+            ),
+            cost_tracker=CostTracker(float(BUDGET_USD) if BUDGET_USD else None,
+                                     float(TIME_BUDGET_S) if TIME_BUDGET_S else None),
+            search_tiers=parse_search_tiers(SEARCH_TIERS),
+            escalation_confidence=ESCALATION_CONFIDENCE,
+            catalog=(
+                CatalogIndex(CATALOG_INDEX, brands=PriceDiscoverySystem.BRAND_INDICATORS)
+                if os.path.isdir(CATALOG_INDEX) else None
+            ),
+            catalog_min_score=CATALOG_MIN_SCORE,
+            verifier=ResultVerifier.from_env() if VERIFY_RESULTS else None,
+            scheduling=SCHEDULING
+        )
+        results = system.process_excel_file(INPUT_FILE, OUTPUT_FILE, journal)
+        if not system.cost_tracker.exhausted:
+            journal.remove()
         logger.info(f"Results: {results}")
         logger.info("✅ Processing complete!")
         
@@ -349,6 +1569,8 @@ def main():
         logger.info("\n⚠️ Processing interrupted by user")
     except Exception as e:
         logger.error(f"❌ Processing failed: {e}")
+    finally:
+        profiler.stop()
 
 if __name__ == "__main__":
     main()
@@ -6,11 +6,17 @@ Combines agent-based preprocessing with price discovery for optimal results.
 
 import os
 import sys 
+import subprocess
 import pandas as pd
 import logging
-from datetime import datetime
+from collections import defaultdict, deque
+from datetime import datetime, timedelta
 from dotenv import load_dotenv
 
+from perfilamento import profiler
+from prompts import (OPTIMIZER_COMPLETION_TOKENS, OPTIMIZER_MODEL, OPTIMIZER_PROMPT_VERSION, SEARCH_PROMPT_VERSION,
+                     optimizer_prompt_tokens)
+
 # Load environment variables
 load_dotenv(override=True)
 
@@ -21,49 +27,136 @@ logger = logging.getLogger(__name__)
 class IntelligentPriceDiscoverySystem:
     """Integrated system with CrewAI preprocessing and price discovery"""
 
-    def __init__(self, force_reprocess=False):
+    # Typical duration (s) of one call, used by the planner to project wall time
+    LLM_LATENCY_S = 2.0
+    SEARCH_LATENCY_S = 4.0
+
+    def __init__(self, force_reprocess=False, input_file=None, output_dir=None,
+                 price_system=None, preprocessor=None, journal_file=None,
+                 history_db=None, max_age_days=None, min_confidence=0.7,
+                 similarity_threshold=None, budget_usd=None, check_api_keys=True,
+                 search_tiers=None, escalation_confidence=None, catalog_index=None, catalog_min_score=None,
+                 verify=None, time_budget_s=None, scheduling=None):
         """Initialize the integrated system
 
         Args:
             force_reprocess (bool): If True, always reprocess even if files exist
+            input_file (str): Input spreadsheet (defaults to INPUT_FILE env var)
+            output_dir (str): Directory for cache and report files (defaults to cwd)
+            price_system (PriceDiscoverySystem): Shared, already warm price system
+            preprocessor (SmartPreprocessor): Shared, already warm preprocessor
+            journal_file (str): JSONL file where each priced item is appended (defaults to
+                Price_Journal_<hash>.jsonl in the output directory)
+            history_db (str): SQLite price history (defaults to PRICE_HISTORY_DB env var)
+            max_age_days (float): Incremental refresh - only re-search items whose last
+                observation is older than this or below min_confidence (None = full search)
+            min_confidence (float): Incremental refresh confidence threshold
+            similarity_threshold (float): Reuse prices of near-duplicate items at or above
+                this similarity (defaults to SIMILARITY_THRESHOLD env var, 0 disables)
+            budget_usd (float): Hard cap on API spend; once reached the run stops cleanly
+            check_api_keys (bool): Exit when API keys are missing (planning needs none)
+            search_tiers (str): Search escalation "model:max_tokens[:concurrency],..."
+                (defaults to SEARCH_TIERS env var)
+            escalation_confidence (float): Escalate answers below this confidence
+                (defaults to ESCALATION_CONFIDENCE env var)
+            catalog_index (str): Local catalog index directory, used when it exists
+                (defaults to CATALOG_INDEX env var or catalog_index)
+            catalog_min_score (float): Minimum relative BM25 score to accept a catalog product
+            verify (bool): Check returned URLs/prices in the background and adjust confidence
+                (defaults to VERIFY_RESULTS env var)
+            time_budget_s (float): Wall-clock budget; once reached no more API calls are made
+                and the report is written with what was priced so far
+            scheduling (str): Price discovery order - 'value' (highest estimated value
+                first) or 'category' (defaults to SCHEDULING env var or value)
         """
-        self.input_file = os.getenv('INPUT_FILE', 'lista.xlsx')
+        self.input_file = input_file or os.getenv('INPUT_FILE', 'lista.xlsx')
+        self.output_dir = output_dir or '.'
         self.timestamp = datetime.now().strftime('%Y%m%d_%H%M%S')
         self.force_reprocess = force_reprocess
+        self.price_system = price_system
+        self.preprocessor = preprocessor
+        self.rate_delay = float(os.getenv('RATE_LIMIT_DELAY', '3'))
+        self.history_db = history_db or os.getenv('PRICE_HISTORY_DB', 'price_history.db')
+        self.max_age_days = max_age_days
+        self.min_confidence = min_confidence
+        self.similarity_threshold = (similarity_threshold if similarity_threshold is not None
+                                     else float(os.getenv('SIMILARITY_THRESHOLD', '0.8')))
+        self.result_bytes_per_item = None  # measured by run_price_discovery
+
+        # Tokens/cost of this run, shared by preprocessing and price discovery
+        from busca_precos_basica import CostTracker
+        self.budget_usd = budget_usd
+        self.time_budget_s = time_budget_s
+        self.cost_tracker = CostTracker(budget_usd, time_budget_s)
+        self.scheduling = scheduling or os.getenv('SCHEDULING', 'value')
+
+        # Tiered search escalation
+        from busca_precos_basica import DEFAULT_SEARCH_TIERS
+        self.search_tiers = search_tiers or os.getenv('SEARCH_TIERS', DEFAULT_SEARCH_TIERS)
+        self.escalation_confidence = (escalation_confidence if escalation_confidence is not None
+                                      else float(os.getenv('ESCALATION_CONFIDENCE', '0.7')))
+        self.tier_summary = None  # measured by run_price_discovery
+        self.provider_stats = []  # calls/latency/errors per provider of each stage
+        self.usage_from_results = False  # spend rebuilt from per-item tokens (shared systems, merged shards)
 
-        # File paths - use input file hash for consistent naming
-        input_hash = self._get_input_file_hash()
-        self.preprocessed_file = f"Preprocessed_Items_{input_hash}.xlsx"
-        self.final_results_file = f"Intelligent_Price_Discovery_Results_{self.timestamp}.xlsx"
+        # Local offline catalog (first price source)
+        self.catalog_index = catalog_index or os.getenv('CATALOG_INDEX', 'catalog_index')
+        self.catalog_min_score = (catalog_min_score if catalog_min_score is not None
+                                  else float(os.getenv('CATALOG_MIN_SCORE', '0.75')))
+
+        # Background URL/price verification
+        self.verify = (verify if verify is not None
+                       else os.getenv('VERIFY_RESULTS', '0').lower() in ('1', 'true', 'yes'))
+
+        # File paths - use input file hash for consistent naming; prompt versions
+        # are part of the hash, so a new prompt template invalidates cached results
+        self.preprocessed_file = self._output_path(
+            f"Preprocessed_Items_{self._get_input_file_hash(OPTIMIZER_PROMPT_VERSION)}.xlsx")
+        self.cached_price_file = self._output_path(
+            f"Price_Results_{self._get_input_file_hash(OPTIMIZER_PROMPT_VERSION, SEARCH_PROMPT_VERSION)}.xlsx")
+        self.price_results_file = self._output_path(f"Price_Results_{self.timestamp}.xlsx")
+        # Every run journals its priced items, so one cut short by the budget or
+        # interrupted resumes where it stopped (shards pass their own journal)
+        self.default_journal = journal_file is None
+        self.journal_file = journal_file or self._output_path(
+            f"Price_Journal_{self._get_input_file_hash(OPTIMIZER_PROMPT_VERSION, SEARCH_PROMPT_VERSION)}.jsonl")
+        self.final_results_file = self._output_path(f"Intelligent_Price_Discovery_Results_{self.timestamp}.xlsx")
 
         # Check required API keys
-        self._check_api_keys()
+        if check_api_keys:
+            self._check_api_keys()
 
-    def _get_input_file_hash(self) -> str:
-        """Generate a hash of the input file for consistent naming"""
+    def _output_path(self, file_name: str) -> str:
+        """Place a generated file inside the output directory"""
+        return os.path.join(self.output_dir, file_name)
+
+    def _get_input_file_hash(self, *versions) -> str:
+        """Generate a hash of the input file (and optional prompt versions) for consistent naming"""
         import hashlib
 
         try:
             with open(self.input_file, 'rb') as f:
-                file_hash = hashlib.md5(f.read()).hexdigest()[:8]
-            return file_hash
+                digest = hashlib.md5(f.read())
+            for version in versions:
+                digest.update(version.encode('utf-8'))
+            return digest.hexdigest()[:8]
         except Exception:
             # Fallback to timestamp if file reading fails
             return self.timestamp[:8]
 
     def _check_api_keys(self):
-        """Check if required API keys are available"""
-        openai_key = os.getenv('OPENAI_API_KEY')
-        perplexity_key = os.getenv('PERPLEXITY_API_KEY')
+        """Check if required API keys are available (not needed when the stage's providers are configured)"""
+        openai_key = os.getenv('OPENAI_API_KEY') or os.getenv('LLM_PROVIDERS')
+        perplexity_key = os.getenv('PERPLEXITY_API_KEY') or os.getenv('SEARCH_PROVIDERS')
         
         if not openai_key:
             logger.error("❌ OPENAI_API_KEY not found in environment variables")
-            logger.info("Required for CrewAI agents. Please add to .env file.")
+            logger.info("Required for CrewAI agents (or set LLM_PROVIDERS). Please add to .env file.")
             sys.exit(1)
         
         if not perplexity_key:
             logger.error("❌ PERPLEXITY_API_KEY not found in environment variables")
-            logger.info("Required for price discovery. Please add to .env file.")
+            logger.info("Required for price discovery (or set SEARCH_PROVIDERS). Please add to .env file.")
             sys.exit(1)
         
         logger.info("✅ API keys found and ready")
@@ -74,13 +167,20 @@ class IntelligentPriceDiscoverySystem:
         logger.info("=" * 60)
 
         # Check if preprocessed file already exists and if we should reuse it
+        resume = False
         if not self.force_reprocess and os.path.exists(self.preprocessed_file):
             logger.info(f"📁 Preprocessed file already exists: {self.preprocessed_file}")
 
             try:
                 # Verify file integrity
-                df = pd.read_excel(self.preprocessed_file, sheet_name='Itens_Otimizados')
-                if len(df) > 0:
+                df = pd.read_excel(self.preprocessed_file, sheet_name='Resultados_Completos')
+                pending = self._pending_optimizations(df)
+                if pending:
+                    # A run cut short by the budget: keep its optimizations, redo the basic fallbacks
+                    logger.info(f"⏸️ {pending} items got the basic optimization when the budget ran out, "
+                                f"optimizing them now")
+                    resume = True
+                elif len(df) > 0:
                     logger.info(f"✅ Using existing preprocessed file with {len(df)} items")
                     logger.info("💰 Tokens saved by skipping preprocessing!")
                     return True
@@ -92,11 +192,20 @@ class IntelligentPriceDiscoverySystem:
             logger.info("🔄 Force reprocess enabled - will regenerate preprocessed file")
 
         try:
-            # Import and run preprocessing
-            from preprocessamento import SmartPreprocessor
-
-            processor = SmartPreprocessor()
+            # Reuse the shared preprocessor (server mode) or import and create one
+            processor = self.preprocessor
+            if processor is None:
+                from preprocessamento import SmartPreprocessor
+                processor = SmartPreprocessor(cost_tracker=self.cost_tracker)
+            if resume:
+                processor.load_previous(self.preprocessed_file)
             results = processor.process_file(self.input_file, self.preprocessed_file)
+            if self.preprocessor is None:
+                self.provider_stats += [dict(entry, stage='preprocessing') for entry in processor.router.stats()]
+            else:
+                # The shared preprocessor's tracker spans every job: count this file's calls only
+                self._record_llm_usage([(result.provider, result.prompt_tokens, result.completion_tokens,
+                                         result.cached_tokens) for result in results])
 
             if not results:
                 logger.error("❌ Preprocessing failed - no results generated")
@@ -113,16 +222,31 @@ class IntelligentPriceDiscoverySystem:
             logger.error(f"❌ Preprocessing failed: {e}")
             return False
     
+    @staticmethod
+    def _pending_optimizations(preprocessed_df: pd.DataFrame) -> int:
+        """Items a budget-stopped preprocessing left with the basic optimization"""
+        try:
+            from preprocessamento import BUDGET_FALLBACK_NOTE
+        except ImportError:
+            # Without CrewAI they could not be optimized again anyway
+            return 0
+        if 'Notas' not in preprocessed_df.columns:
+            return 0
+        return int((preprocessed_df['Notas'] == BUDGET_FALLBACK_NOTE).sum())
+
     def run_price_discovery(self) -> bool:
         """Run price discovery on preprocessed items"""
         logger.info("\n💰 STEP 2: Running Price Discovery")
         logger.info("=" * 60)
 
         # Check if price results already exist
-        input_hash = self._get_input_file_hash()
-        price_results_file = f"Price_Results_{input_hash}.xlsx"
+        price_results_file = self.cached_price_file
+        incremental = self.max_age_days is not None
 
-        if not self.force_reprocess and os.path.exists(price_results_file):
+        if incremental:
+            logger.info(f"📚 Incremental refresh: re-searching items older than {self.max_age_days} days "
+                        f"or with confidence below {self.min_confidence}")
+        elif not self.force_reprocess and os.path.exists(price_results_file):
             logger.info(f"📁 Price results already exist: {price_results_file}")
 
             try:
@@ -134,7 +258,7 @@ class IntelligentPriceDiscoverySystem:
                     logger.info("💰 API calls saved by skipping price discovery!")
 
                     # Copy to timestamped file for this session
-                    timestamped_file = f"Price_Results_{self.timestamp}.xlsx"
+                    timestamped_file = self.price_results_file
                     df.to_excel(timestamped_file, index=False)
                     logger.info(f"📄 Results copied to: {timestamped_file}")
                     return True
@@ -152,7 +276,8 @@ class IntelligentPriceDiscoverySystem:
                 return False
             
             # Read the optimized items sheet
-            searchable_df = pd.read_excel(self.preprocessed_file, sheet_name='Itens_Otimizados')
+            with profiler.stage('load_input'):
+                searchable_df = pd.read_excel(self.preprocessed_file, sheet_name='Itens_Otimizados')
             
             if len(searchable_df) == 0:
                 logger.warning("⚠️ No searchable items in preprocessed file")
@@ -161,52 +286,95 @@ class IntelligentPriceDiscoverySystem:
             logger.info(f"📊 Processing {len(searchable_df)} optimized items...")
             
             # Import and run price discovery
-            from busca_precos_basica import PriceDiscoverySystem
-            
-            # Get API key
-            api_key = str(os.getenv('PERPLEXITY_API_KEY'))
+            from busca_precos_basica import (PriceDiscoverySystem, ResultJournal, STATUS_FOUND, STATUS_NOT_PROCESSED,
+                                             parse_search_tiers)
             
-            # Initialize price discovery system
-            price_system = PriceDiscoverySystem(api_key)
+            # Reuse the shared price system (server mode) or create one
+            price_system = self.price_system
+            if price_system is None:
+                api_key = str(os.getenv('PERPLEXITY_API_KEY'))
+                from historico_precos import PriceHistoryStore
+                from similaridade import SimilarityIndex
+                price_system = PriceDiscoverySystem(
+                    api_key,
+                    min_interval=self.rate_delay,
+                    history=PriceHistoryStore(self.history_db),
+                    max_age_days=self.max_age_days,
+                    min_confidence=self.min_confidence,
+                    similarity=(
+                        SimilarityIndex(self.similarity_threshold, brands=PriceDiscoverySystem.BRAND_INDICATORS)
+                        if self.similarity_threshold > 0 else None
+                    ),
+                    cost_tracker=self.cost_tracker,
+                    search_tiers=parse_search_tiers(self.search_tiers),
+                    escalation_confidence=self.escalation_confidence,
+                    catalog=self._open_catalog(),
+                    catalog_min_score=self.catalog_min_score,
+                    verifier=self._open_verifier(),
+                    scheduling=self.scheduling
+                )
             
-            # Process each optimized item
-            results = []
-            found_count = 0
-            
-            for idx, (_, row) in enumerate(searchable_df.iterrows()):
-                item = row['Item']
-
-                logger.info(f"🔍 [{idx+1}/{len(searchable_df)}] Searching: {item[:50]}...")
-
-                # Process the item
-                result = price_system.process_item(item)
-                results.append(result)
+            # Process optimized items, highest estimated value first (or grouped by category)
+            categories = (
+                [PriceDiscoverySystem._clean_category(value) for value in searchable_df['Categoria']]
+                if 'Categoria' in searchable_df.columns else [None] * len(searchable_df)
+            )
+            quantities = (
+                [PriceDiscoverySystem._clean_quantity(value) for value in searchable_df['Quantidade']]
+                if 'Quantidade' in searchable_df.columns else None
+            )
+            entries = list(zip(searchable_df['Item'].tolist(), categories))
+            order = price_system.schedule(entries, quantities)
 
-                # Log result
-                if result.status == 'price_found':
-                    found_count += 1
-                    logger.info(f"✅ [{idx+1}] FOUND: R$ {result.price:.2f} - {result.store}")
-                elif result.status == 'filtered_out':
-                    logger.info(f"⚠️ [{idx+1}] FILTERED: {result.reason}")
-                else:
-                    logger.info(f"❌ [{idx+1}] NOT FOUND: {result.reason}")
-                
-                # Rate limiting
-                import time
-                time.sleep(3)
+            # Journal: one JSON line per finished item, so interrupted runs resume.
+            # A forced or incremental run starts over (shard journals are reset by run_shard)
+            if (self.default_journal and (self.force_reprocess or incremental)
+                    and os.path.exists(self.journal_file)):
+                os.remove(self.journal_file)
+            journal = ResultJournal(self.journal_file)
+            resumed = {result.item for result in journal.read()}
+            results = price_system.search_entries(entries, order, journal)
             
-            # Save results with hash-based name for caching
-            input_hash = self._get_input_file_hash()
-            cached_results_file = f"Price_Results_{input_hash}.xlsx"
-            price_system._save_results(results, cached_results_file)
+            # Save results with hash-based name for caching (not for runs cut short by the budget)
+            budget_stopped = price_system.cost_tracker.exhausted
+            cached_results_file = self.cached_price_file
+            price_results_file = self.price_results_file
+            with profiler.stage('save_results'):
+                if not budget_stopped:
+                    price_system._save_results(results, cached_results_file)
 
-            # Also save with timestamp for this session
-            price_results_file = f"Price_Results_{self.timestamp}.xlsx"
-            price_system._save_results(results, price_results_file)
+                # Also save with timestamp for this session
+                price_system._save_results(results, price_results_file)
 
             logger.info(f"💾 Price discovery results saved to: {price_results_file}")
-            logger.info(f"💾 Cached results saved to: {cached_results_file}")
+            if budget_stopped:
+                limit = '--time-budget-s' if price_system.cost_tracker.out_of_time else '--budget-usd'
+                logger.warning(f"🛑 Budget reached: {results.count(STATUS_NOT_PROCESSED)} items not processed "
+                               f"(results not cached; rerun with a higher {limit} to complete)")
+            else:
+                logger.info(f"💾 Cached results saved to: {cached_results_file}")
+                # The complete cached file supersedes the journal of this input
+                if self.default_journal:
+                    journal.remove()
+            found_count = results.count(STATUS_FOUND)
             logger.info(f"🎯 Success rate: {found_count}/{len(results)} ({found_count/len(results)*100:.1f}%)")
+            logger.info(f"🧮 Result memory: {results.bytes_per_item():.0f} bytes/item "
+                        f"({results.memory_usage()/1024/1024:.1f} MB)")
+            self.result_bytes_per_item = results.bytes_per_item()
+            price_system._log_tier_summary()
+            if self.price_system is None:
+                self.tier_summary = price_system.tier_summary()
+                self.provider_stats += [dict(entry, stage='price_discovery') for entry in price_system.router.stats()]
+            else:
+                # The shared price system's trackers span every job: count this file's searches only
+                self._record_search_usage([result for result in results if result.item not in resumed])
+            if incremental:
+                logger.info(f"📚 Reused from price history: {price_system.history_hits} items")
+            if price_system.catalog_hits:
+                logger.info(f"📦 Priced from the local catalog: {price_system.catalog_hits} items")
+            flight = price_system.search_flight.stats()
+            if flight['coalesced']:
+                logger.info(f"🤝 Coalesced searches: {flight['coalesced']} items shared an identical search in flight")
             
             return True
             
@@ -214,6 +382,94 @@ class IntelligentPriceDiscoverySystem:
             logger.error(f"❌ Price discovery failed: {e}")
             return False
     
+    def _open_catalog(self):
+        """Local catalog index, if one was imported"""
+        if not os.path.isdir(self.catalog_index):
+            return None
+        from busca_precos_basica import PriceDiscoverySystem
+        from catalogo import CatalogIndex
+        catalog = CatalogIndex(self.catalog_index, brands=PriceDiscoverySystem.BRAND_INDICATORS)
+        logger.info(f"📦 Local catalog: {len(catalog)} products ({self.catalog_index})")
+        return catalog
+
+    def _open_verifier(self):
+        """Background URL/price verifier, if enabled"""
+        if not self.verify:
+            return None
+
+        from verificacao import ResultVerifier
+        verifier = ResultVerifier.from_env()
+        logger.info(f"🔎 Verifying returned URLs/prices ({verifier.executor._max_workers} workers, "
+                    f"{verifier.per_domain} per domain)")
+        return verifier
+
+    def _record_usage(self, stage: str, usage: pd.DataFrame) -> pd.DataFrame:
+        """
+        Add per-item token usage read back from results (columns model, provider,
+        prompt_tokens, completion_tokens, cached_tokens) to the run's tracker and
+        per-provider totals. Used when the live trackers are not this run's own:
+        server jobs on the shared systems and merged shards.
+
+        Returns:
+            The usage with a cost_usd column
+        """
+        from busca_precos_basica import CostTracker
+
+        self.usage_from_results = True
+        if usage.empty:
+            return usage.assign(cost_usd=0.0)
+        usage = usage.astype({'prompt_tokens': int, 'completion_tokens': int, 'cached_tokens': int})
+        usage['provider'] = usage['provider'].fillna('unknown')
+        usage['cost_usd'] = [CostTracker.cost(row.model, row.prompt_tokens, row.completion_tokens)
+                             for row in usage.itertuples()]
+        for row in usage.itertuples():
+            self.cost_tracker.record(row.model, row.prompt_tokens, row.completion_tokens, row.cached_tokens)
+
+        by_provider = usage.groupby('provider', sort=False).agg(
+            items=('model', 'size'), prompt_tokens=('prompt_tokens', 'sum'),
+            completion_tokens=('completion_tokens', 'sum'), cached_tokens=('cached_tokens', 'sum'),
+            cost_usd=('cost_usd', 'sum')
+        ).reset_index()
+        self.provider_stats += [dict(entry, stage=stage) for entry in by_provider.to_dict('records')]
+        return usage
+
+    def _record_llm_usage(self, rows: list):
+        """Preprocessing usage from (provider, prompt, completion, cached tokens) per optimized item"""
+        models = ({provider.name: provider.model for provider in self.preprocessor.router.providers}
+                  if self.preprocessor is not None else {})
+        self._record_usage('preprocessing', pd.DataFrame([
+            {'model': models.get(provider) or OPTIMIZER_MODEL, 'provider': provider,
+             'prompt_tokens': prompt_tokens, 'completion_tokens': completion_tokens,
+             'cached_tokens': cached_tokens or 0}
+            for provider, prompt_tokens, completion_tokens, cached_tokens in rows
+            if pd.notna(prompt_tokens)
+        ], columns=['model', 'provider', 'prompt_tokens', 'completion_tokens', 'cached_tokens']))
+
+    def _record_search_usage(self, results: list):
+        """
+        Search usage and Tier_Summary from the PriceResults with calls of their own.
+        Tokens of an item are priced at the model of the tier that answered it
+        (the last tier when nothing was found).
+        """
+        from busca_precos_basica import parse_search_tiers
+
+        top_model = parse_search_tiers(self.search_tiers)[-1].model
+        usage = pd.DataFrame([
+            {'model': result.tier.rsplit('/', 1)[0] if result.tier else top_model,
+             'provider': result.provider, 'tier': result.tier or 'unresolved',
+             'found': result.status == 'price_found', 'prompt_tokens': result.prompt_tokens,
+             'completion_tokens': result.completion_tokens, 'cached_tokens': result.cached_tokens or 0}
+            for result in results if result.prompt_tokens is not None
+        ], columns=['model', 'provider', 'tier', 'found', 'prompt_tokens', 'completion_tokens', 'cached_tokens'])
+        usage = self._record_usage('price_discovery', usage)
+        if usage.empty:
+            return
+        self.tier_summary = usage.groupby('tier', sort=False).agg(
+            Items_Searched=('found', 'size'), Items_Resolved=('found', 'sum'),
+            Prompt_Tokens=('prompt_tokens', 'sum'), Completion_Tokens=('completion_tokens', 'sum'),
+            Cached_Tokens=('cached_tokens', 'sum'), Cost_USD=('cost_usd', 'sum')
+        ).reset_index().rename(columns={'tier': 'Tier'})
+
     def create_final_report(self) -> bool:
         """Create comprehensive final report combining all results"""
         logger.info("\n📊 STEP 3: Creating Final Comprehensive Report")
@@ -232,9 +488,8 @@ class IntelligentPriceDiscoverySystem:
             )
 
             # Try to load price results (check both timestamped and cached versions)
-            price_results_file = f"Price_Results_{self.timestamp}.xlsx"
-            input_hash = self._get_input_file_hash()
-            cached_price_file = f"Price_Results_{input_hash}.xlsx"
+            price_results_file = self.price_results_file
+            cached_price_file = self.cached_price_file
 
             price_df = pd.DataFrame()
             if os.path.exists(price_results_file):
@@ -246,43 +501,39 @@ class IntelligentPriceDiscoverySystem:
                 logger.warning("⚠️ Price results file not found, creating report without prices")
             
             # Merge preprocessing and price data
+            price_columns = {
+                'Status': 'Price_Status', 'Reason': 'Price_Reason', 'Price': 'Price', 'Store': 'Store',
+                'URL': 'URL', 'Confidence': 'Confidence', 'Elapsed_s': 'Elapsed_s',
+                'Match_Score': 'Match_Score', 'Verification': 'Verification',
+                'Prompt_Tokens': 'Search_Prompt_Tokens', 'Completion_Tokens': 'Search_Completion_Tokens',
+                'Cached_Tokens': 'Search_Cached_Tokens', 'Prompt_Version': 'Search_Prompt_Version'
+            }
+            searchable = preprocessed_df['Is_Searchable']
+
             if not price_df.empty:
-                # Create mapping from optimized items to price results
-                price_mapping = {}
-                for _, row in price_df.iterrows():
-                    price_mapping[row['Item']] = {
-                        'Price_Status': row['Status'],
-                        'Price_Reason': row['Reason'],
-                        'Price': row['Price'],
-                        'Store': row['Store'],
-                        'URL': row['URL'],
-                        'Confidence': row['Confidence']
-                    }
-
-                # Add price information to preprocessed data
-                for col in ['Price_Status', 'Price_Reason', 'Price', 'Store', 'URL', 'Confidence']:
-                    preprocessed_df[col] = None
+                # Join price results on the optimized item (last result wins for repeated items)
+                from busca_precos_basica import STATUS_CODES, STATUS_LABELS
+                price_df['Status'] = price_df['Status'].map(lambda status: STATUS_LABELS[STATUS_CODES[status]]
+                                                            if status in STATUS_CODES else status)
+                price_df = price_df.drop_duplicates('Item', keep='last').set_index('Item')
+                price_df = price_df[[col for col in price_columns if col in price_df.columns]]
+                joined = preprocessed_df[['Item_Otimizado']].join(
+                    price_df.rename(columns=price_columns), on='Item_Otimizado'
+                )
 
-                for idx, row in preprocessed_df.iterrows():
-                    if row['Is_Searchable'] and row['Item_Otimizado'] in price_mapping:
-                        price_info = price_mapping[row['Item_Otimizado']]
-                        for col, value in price_info.items():
-                            preprocessed_df.at[idx, col] = value
-                    elif not row['Is_Searchable']:
-                        preprocessed_df.at[idx, 'Price_Status'] = 'filtered_out'
-                        preprocessed_df.at[idx, 'Price_Reason'] = 'Filtered during preprocessing'
+                # Add price information to searchable items only
+                for col in price_columns.values():
+                    preprocessed_df[col] = joined[col].where(searchable, None) if col in joined.columns else None
             else:
                 # No price data available, mark all searchable items as not processed
                 for col in ['Price_Status', 'Price_Reason', 'Price', 'Store', 'URL', 'Confidence']:
                     preprocessed_df[col] = None
 
-                for idx, row in preprocessed_df.iterrows():
-                    if not row['Is_Searchable']:
-                        preprocessed_df.at[idx, 'Price_Status'] = 'filtered_out'
-                        preprocessed_df.at[idx, 'Price_Reason'] = 'Filtered during preprocessing'
-                    else:
-                        preprocessed_df.at[idx, 'Price_Status'] = 'not_processed'
-                        preprocessed_df.at[idx, 'Price_Reason'] = 'Price discovery not run'
+                preprocessed_df.loc[searchable, 'Price_Status'] = 'not_processed'
+                preprocessed_df.loc[searchable, 'Price_Reason'] = 'Price discovery not run'
+
+            preprocessed_df.loc[~searchable, 'Price_Status'] = 'filtered_out'
+            preprocessed_df.loc[~searchable, 'Price_Reason'] = 'Filtered during preprocessing'
             
             # Create comprehensive Excel report
             with pd.ExcelWriter(self.final_results_file, engine='openpyxl') as writer:
@@ -324,6 +575,29 @@ class IntelligentPriceDiscoverySystem:
                     ]
                 }
                 
+                if self.result_bytes_per_item is not None:
+                    summary_data['Metric'].append('Result Memory per Item (bytes)')
+                    summary_data['Value'].append(round(self.result_bytes_per_item))
+
+                spend = self.cost_tracker.summary()
+                summary_data['Metric'] += ['API Calls', 'Prompt Tokens', 'Cached Prompt Tokens', 'Completion Tokens',
+                                           'API Spend (USD)', 'Prompt Versions']
+                summary_data['Value'] += [sum(spend['calls'].values()), spend['prompt_tokens'], spend['cached_tokens'],
+                                          spend['completion_tokens'], round(spend['spent_usd'], 4),
+                                          f"{OPTIMIZER_PROMPT_VERSION}, {SEARCH_PROMPT_VERSION}"]
+                if self.usage_from_results:
+                    summary_data['Metric'].append('Spend Source')
+                    summary_data['Value'].append('per-item tokens of the results (API Calls = items with calls)')
+                if self.budget_usd is not None:
+                    summary_data['Metric'].append('Budget (USD)')
+                    summary_data['Value'].append(self.budget_usd)
+                if self.time_budget_s is not None:
+                    summary_data['Metric'].append('Time Budget (s)')
+                    summary_data['Value'].append(self.time_budget_s)
+                if self.cost_tracker.exhausted:
+                    summary_data['Metric'].append('Stopped Early')
+                    summary_data['Value'].append('time budget' if self.cost_tracker.out_of_time else 'cost budget')
+
                 summary_df = pd.DataFrame(summary_data)
                 summary_df.to_excel(writer, sheet_name='Summary', index=False)
                 
@@ -336,6 +610,21 @@ class IntelligentPriceDiscoverySystem:
                 if filtered_items > 0:
                     filtered_df = preprocessed_df[~preprocessed_df['Is_Searchable']]
                     filtered_df.to_excel(writer, sheet_name='Filtered_Items', index=False)
+
+                # Items resolved, latency and cost per search tier
+                if self.tier_summary is not None and self.tier_summary.filter(['Calls', 'Items_Searched']).sum().sum():
+                    self.tier_summary.to_excel(writer, sheet_name='Tier_Summary', index=False)
+
+                # Calls, live latency and error rate per provider (routing/failover)
+                if sum(entry.get('calls', entry.get('items', 0)) for entry in self.provider_stats):
+                    provider_df = pd.DataFrame(self.provider_stats)
+                    provider_df = provider_df[['stage'] + [col for col in provider_df.columns if col != 'stage']]
+                    provider_df.to_excel(writer, sheet_name='Provider_Summary', index=False)
+
+                # Per-category throughput and success rates
+                if 'Categoria' in preprocessed_df.columns:
+                    category_df = self._build_category_summary(preprocessed_df)
+                    category_df.to_excel(writer, sheet_name='Category_Summary', index=False)
             
             logger.info(f"📋 Final comprehensive report created: {self.final_results_file}")
             
@@ -355,7 +644,414 @@ class IntelligentPriceDiscoverySystem:
             logger.error(f"❌ Failed to create final report: {e}")
             return False
     
-    def run_complete_workflow(self):
+    def _build_category_summary(self, report_df: pd.DataFrame) -> pd.DataFrame:
+        """Aggregate the comprehensive report per category"""
+        df = report_df.copy()
+        df['Categoria'] = df['Categoria'].fillna('Sem categoria')
+        df['Found'] = df['Price_Status'] == 'price_found'
+        if 'Elapsed_s' not in df.columns:
+            df['Elapsed_s'] = None
+        # Only searched items count towards the throughput, over their own search time
+        df['Searched'] = ~df['Price_Status'].isin(['filtered_out', 'not_processed'])
+        df['Elapsed_s'] = pd.to_numeric(df['Elapsed_s'], errors='coerce').where(df['Searched'])
+
+        summary = df.groupby('Categoria', sort=False).agg(
+            Items=('Item_Otimizado', 'size'),
+            Searchable=('Is_Searchable', 'sum'),
+            Searched=('Searched', 'sum'),
+            Found=('Found', 'sum'),
+            Elapsed_s=('Elapsed_s', 'sum')
+        ).reset_index()
+
+        summary['Success_Rate (%)'] = (
+            summary['Found'] / summary['Searchable'].where(summary['Searchable'] > 0) * 100
+        ).round(1)
+        summary['Items_per_min'] = (
+            summary['Searched'] / summary['Elapsed_s'].where(summary['Elapsed_s'] > 0) * 60
+        ).round(1)
+
+        for _, row in summary.iterrows():
+            logger.info(f"🗂️ {row['Categoria']}: {row['Found']}/{row['Searchable']} found, "
+                        f"{row['Items_per_min']} items/min")
+
+        return summary
+
+    def _shard_paths(self, shard_dir: str, shard_index: int, num_shards: int) -> dict:
+        """Input and journal files of one shard inside the shared shard directory"""
+        suffix = f"s{shard_index}of{num_shards}"
+        return {
+            'input': os.path.join(shard_dir, f"Shard_Input_{suffix}.xlsx"),
+            'journal': os.path.join(shard_dir, f"Shard_Journal_{suffix}.jsonl")
+        }
+
+    def default_shard_dir(self) -> str:
+        """Shared shard directory derived from the input file hash"""
+        return self._output_path(f"Shards_{self._get_input_file_hash()}")
+
+    def run_shard(self, shard_index: int, num_shards: int, shard_dir: str) -> bool:
+        """Preprocess and price one shard of the input (stable hash of the normalized item)"""
+        from busca_precos_basica import PriceDiscoverySystem
+
+        logger.info(f"🧩 SHARD {shard_index + 1}/{num_shards} - {shard_dir}")
+        os.makedirs(shard_dir, exist_ok=True)
+        paths = self._shard_paths(shard_dir, shard_index, num_shards)
+
+        # The shard input is written once: rewriting it would change its hash and the cache names
+        if not os.path.exists(paths['input']):
+            df = pd.read_excel(self.input_file)
+            item_column = PriceDiscoverySystem._find_item_column(df)
+            hasher = PriceDiscoverySystem("dummy")  # Just for the normalization logic
+            in_shard = df[item_column].astype(str).str.strip().map(
+                lambda item: hasher._shard_of(item, num_shards) == shard_index
+            )
+            df[in_shard].to_excel(paths['input'], index=False)
+
+        # The journal resumes an interrupted run; a new forced or incremental run starts over
+        if (self.force_reprocess or self.max_age_days is not None) and os.path.exists(paths['journal']):
+            os.remove(paths['journal'])
+
+        if pd.read_excel(paths['input']).empty:
+            logger.info("📭 Empty shard, nothing to do")
+            return True
+
+        shard_system = IntelligentPriceDiscoverySystem(
+            force_reprocess=self.force_reprocess,
+            input_file=paths['input'],
+            output_dir=shard_dir,
+            price_system=self.price_system,
+            preprocessor=self.preprocessor,
+            journal_file=paths['journal'],
+            history_db=self.history_db,
+            max_age_days=self.max_age_days,
+            min_confidence=self.min_confidence,
+            similarity_threshold=self.similarity_threshold,
+            budget_usd=self.budget_usd,
+            search_tiers=self.search_tiers,
+            escalation_confidence=self.escalation_confidence,
+            catalog_index=self.catalog_index,
+            catalog_min_score=self.catalog_min_score,
+            verify=self.verify,
+            time_budget_s=self.time_budget_s,
+            scheduling=self.scheduling
+        )
+        # Shards share the directory: keep their session copies apart
+        shard_system.price_results_file = shard_system._output_path(
+            f"Price_Results_{self.timestamp}_s{shard_index}of{num_shards}.xlsx"
+        )
+        with profiler.stage('preprocessing'):
+            if not shard_system.run_preprocessing():
+                return False
+        with profiler.stage('price_discovery'):
+            return shard_system.run_price_discovery()
+
+    def run_sharded(self, num_shards: int, shard_dir: str) -> bool:
+        """Run every shard as an independent local worker process, then merge"""
+        from provedores import share_providers
+
+        keys = [key.strip() for key in os.getenv('PERPLEXITY_API_KEYS', '').split(',') if key.strip()]
+        keys = keys or [str(os.getenv('PERPLEXITY_API_KEY'))]
+
+        # Configured providers are used by every worker: split their limits instead of the keys
+        shared_env = {}
+        if os.getenv('SEARCH_PROVIDERS'):
+            shared_env['SEARCH_PROVIDERS'] = share_providers(os.environ['SEARCH_PROVIDERS'], num_shards)
+            shared_env['RATE_LIMIT_DELAY'] = str(self.rate_delay * num_shards)
+            logger.info(f"🧩 Launching {num_shards} shard workers sharing the SEARCH_PROVIDERS "
+                        f"({self.rate_delay * num_shards}s between searches per provider in each worker)")
+        else:
+            logger.info(f"🧩 Launching {num_shards} shard workers with {len(keys)} API key(s)")
+        if os.getenv('LLM_PROVIDERS'):
+            shared_env['LLM_PROVIDERS'] = share_providers(os.environ['LLM_PROVIDERS'], num_shards)
+
+        workers = []
+        for shard_index in range(num_shards):
+            cmd = [
+                sys.executable, os.path.abspath(__file__),
+                '--input-file', self.input_file,
+                '--shards', str(num_shards),
+                '--shard-index', str(shard_index),
+                '--shard-dir', shard_dir,
+                '--similarity-threshold', str(self.similarity_threshold),
+                '--search-tiers', self.search_tiers,
+                '--escalation-confidence', str(self.escalation_confidence),
+                '--catalog-index', self.catalog_index,
+                '--catalog-min-score', str(self.catalog_min_score),
+                '--scheduling', self.scheduling
+            ]
+            if self.force_reprocess:
+                cmd.append('--force-reprocess')
+            if self.verify:
+                cmd.append('--verify')
+            if profiler.enabled:
+                cmd += ['--profile', profiler.base_dir]
+            if self.budget_usd is not None:
+                # Each worker gets an equal share of the budget
+                cmd += ['--budget-usd', str(self.budget_usd / num_shards)]
+            if self.time_budget_s is not None:
+                # Workers run in parallel: each gets the whole time budget
+                cmd += ['--time-budget-s', str(self.time_budget_s)]
+            if self.max_age_days is not None:
+                cmd += ['--incremental', '--max-age-days', str(self.max_age_days),
+                        '--min-confidence', str(self.min_confidence)]
+            env = dict(os.environ, PERPLEXITY_API_KEY=keys[shard_index % len(keys)],
+                       PRICE_HISTORY_DB=self.history_db, **shared_env)
+            workers.append(subprocess.Popen(cmd, env=env))
+
+        failed = [index for index, worker in enumerate(workers) if worker.wait() != 0]
+        if failed:
+            logger.error(f"❌ Shard workers failed: {failed} - rerun them to resume from their journals")
+            return False
+
+        return self.merge_shards(num_shards, shard_dir)
+
+    def merge_shards(self, num_shards: int, shard_dir: str) -> bool:
+        """Combine shard preprocessing files and journals into the usual final report"""
+        from busca_precos_basica import PriceDiscoverySystem, ResultJournal
+
+        logger.info(f"\n🧩 Merging {num_shards} shards from {shard_dir}")
+        preprocessed_frames = []
+        results = []
+
+        for shard_index in range(num_shards):
+            paths = self._shard_paths(shard_dir, shard_index, num_shards)
+            if not os.path.exists(paths['input']):
+                logger.error(f"❌ Shard {shard_index} was never run: {paths['input']} not found")
+                return False
+            if pd.read_excel(paths['input']).empty:
+                continue
+
+            shard_system = IntelligentPriceDiscoverySystem(input_file=paths['input'], output_dir=shard_dir,
+                                                           check_api_keys=False)  # only for the file names
+            if not os.path.exists(shard_system.preprocessed_file):
+                logger.error(f"❌ Shard {shard_index} has no preprocessed file")
+                return False
+
+            preprocessed_frames.append(
+                pd.read_excel(shard_system.preprocessed_file, sheet_name='Resultados_Completos')
+            )
+            results.extend(ResultJournal(paths['journal']).read())
+
+        if not preprocessed_frames:
+            logger.error("❌ No shard results to merge")
+            return False
+
+        merged_df = self._restore_input_order(pd.concat(preprocessed_frames, ignore_index=True))
+        with pd.ExcelWriter(self.preprocessed_file, engine='openpyxl') as writer:
+            merged_df.to_excel(writer, sheet_name='Resultados_Completos', index=False)
+            optimized_df = merged_df[[col for col in ['Item_Otimizado', 'Categoria', 'Quantidade']
+                                      if col in merged_df.columns]]
+            optimized_df.rename(columns={'Item_Otimizado': 'Item'}).to_excel(
+                writer, sheet_name='Itens_Otimizados', index=False
+            )
+
+        price_system = PriceDiscoverySystem("dummy")  # Just for the results layout
+        price_system._save_results(results, self.cached_price_file)
+        price_system._save_results(results, self.price_results_file)
+        logger.info(f"✅ Merged {len(merged_df)} preprocessed items and {len(results)} price results")
+
+        # Spend of all shard runs, from the tokens saved with each item
+        if {'Provedor', 'Tokens_Prompt', 'Tokens_Resposta', 'Tokens_Cache'}.issubset(merged_df.columns):
+            self._record_llm_usage(merged_df[['Provedor', 'Tokens_Prompt', 'Tokens_Resposta',
+                                              'Tokens_Cache']].itertuples(index=False))
+        self._record_search_usage(results)
+        spend = self.cost_tracker.summary()
+        logger.info(f"💵 Shard API spend: ${spend['spent_usd']:.4f} ({spend['prompt_tokens']} prompt + "
+                    f"{spend['completion_tokens']} completion tokens)")
+
+        return self.create_final_report()
+
+    def _restore_input_order(self, merged_df: pd.DataFrame) -> pd.DataFrame:
+        """Sort merged shard rows back into the original input order"""
+        from busca_precos_basica import PriceDiscoverySystem
+
+        input_df = pd.read_excel(self.input_file)
+        item_column = PriceDiscoverySystem._find_item_column(input_df)
+
+        positions = defaultdict(deque)
+        for position, item in enumerate(input_df[item_column].astype(str).str.strip()):
+            positions[item].append(position)
+
+        merged_df['_position'] = [
+            positions[item].popleft() if positions[item] else len(input_df)
+            for item in merged_df['Item_Original'].astype(str)
+        ]
+        return merged_df.sort_values('_position', kind='stable').drop(columns='_position').reset_index(drop=True)
+
+    def plan(self, num_shards: int = 1) -> dict:
+        """
+        Dry run of the workflow: estimate LLM and Perplexity calls, tokens, USD cost
+        and wall time from the input, the caches and the price history, without
+        calling any API
+        """
+        from busca_precos_basica import PriceDiscoverySystem, CostTracker, parse_search_tiers
+
+        tiers = parse_search_tiers(self.search_tiers)
+        price_system = PriceDiscoverySystem(  # Just for validation/normalization logic and the catalog
+            "dummy", search_tiers=tiers, catalog=self._open_catalog(), catalog_min_score=self.catalog_min_score
+        )
+
+        input_df = pd.read_excel(self.input_file)
+        item_column = PriceDiscoverySystem._find_item_column(input_df)
+        category_column = PriceDiscoverySystem._find_category_column(input_df)
+        entries = []
+        for _, row in input_df.iterrows():
+            item = str(row[item_column]).strip()
+            if item and item.lower() not in ['nan', 'none', '']:
+                category = PriceDiscoverySystem._clean_category(row[category_column]) if category_column else None
+                entries.append((item, category))
+
+        # Step 1: preprocessing (one LLM call per distinct item, unless the file is cached)
+        reuse_preprocessed = not self.force_reprocess and os.path.exists(self.preprocessed_file)
+        if reuse_preprocessed:
+            optimized_df = pd.read_excel(self.preprocessed_file, sheet_name='Itens_Otimizados')
+            search_items = optimized_df['Item'].astype(str).tolist()
+            llm_prompts = []
+        else:
+            # Optimized names are unknown before the LLM runs: plan with the originals
+            search_items = [item for item, _ in entries]
+            llm_prompts = list({(item.lower(), category): (item, category) for item, category in entries}.values())
+        llm_calls = len(llm_prompts)
+        # Estimates come from prompts.py: planning works without CrewAI installed
+        llm_prompt_tokens = sum(optimizer_prompt_tokens(item, category) for item, category in llm_prompts)
+        llm_completion_tokens = llm_calls * OPTIMIZER_COMPLETION_TOKENS
+
+        # Step 2: price discovery (searchable, distinct, not cached / fresh in history)
+        incremental = self.max_age_days is not None
+        reuse_prices = not incremental and not self.force_reprocess and os.path.exists(self.cached_price_file)
+        searchable = [item for item in search_items if price_system._is_searchable(item)]
+        unique = {price_system._cache_key(item): item for item in searchable}
+
+        history_hits = similar_hits = catalog_hits = 0
+        to_search = []
+        if not reuse_prices:
+            history = None
+            if incremental and os.path.exists(self.history_db):
+                from historico_precos import PriceHistoryStore
+                history = PriceHistoryStore(self.history_db)
+
+            similarity = None
+            if self.similarity_threshold > 0:
+                from similaridade import SimilarityIndex
+                similarity = SimilarityIndex(self.similarity_threshold, brands=PriceDiscoverySystem.BRAND_INDICATORS)
+                if history is not None:
+                    for key in history.found_item_keys():
+                        similarity.add(key, key)
+
+            for key, item in unique.items():
+                if history is not None and history.fresh_observation(key, self.max_age_days, self.min_confidence):
+                    history_hits += 1
+                    continue
+                # Optimistic: assumes the first of a group of near-duplicates gets a price
+                match = similarity.lookup(key) if similarity is not None else None
+                if match and match[0] != key:
+                    similar_hits += 1
+                    continue
+                if similarity is not None:
+                    similarity.add(key, key)
+                # The local catalog answers offline
+                if price_system._search_catalog(key):
+                    catalog_hits += 1
+                    continue
+                to_search.append(item)
+
+            if history is not None:
+                history.close()
+
+        # Every item starts on the first tier; escalation cost is an upper bound
+        search_calls = len(to_search)
+        search_prompt_tokens = sum(price_system.estimate_prompt_tokens(item) for item in to_search)
+
+        def tier_cost(tier):
+            completion = search_calls * min(PriceDiscoverySystem.TYPICAL_COMPLETION_TOKENS, tier.max_tokens)
+            return CostTracker.cost(tier.model, search_prompt_tokens, completion, search_calls), completion
+
+        search_cost, search_completion_tokens = tier_cost(tiers[0])
+        escalation_cost = sum(tier_cost(tier)[0] for tier in tiers[1:])
+
+        llm_cost = CostTracker.cost(OPTIMIZER_MODEL, llm_prompt_tokens, llm_completion_tokens, llm_calls)
+        total_cost = llm_cost + search_cost
+
+        # Each worker makes one call at a time. Parallel searches are capped by the
+        # tier's concurrency on every provider, and each provider is spaced by the rate limit
+        num_shards = max(1, num_shards)
+        providers = len(price_system.router.providers)
+
+        def tier_time(tier):
+            parallel = min(num_shards, tier.concurrency * providers)
+            return search_calls * max(self.SEARCH_LATENCY_S / parallel, self.rate_delay / providers)
+
+        search_time_s = tier_time(tiers[0])
+        escalation_time_s = sum(tier_time(tier) for tier in tiers[1:])
+        wall_time_s = llm_calls * self.LLM_LATENCY_S / num_shards + search_time_s
+
+        plan = {
+            'items': len(entries),
+            'preprocessing_cached': reuse_preprocessed,
+            'llm_calls': llm_calls,
+            'llm_prompt_tokens': llm_prompt_tokens,
+            'llm_completion_tokens': llm_completion_tokens,
+            'llm_cost_usd': round(llm_cost, 4),
+            'searchable_items': len(searchable),
+            'unique_items': len(unique),
+            'price_results_cached': reuse_prices,
+            'history_reused': history_hits,
+            'similar_reused': similar_hits,
+            'catalog_hits': catalog_hits,
+            'search_calls': search_calls,
+            'search_prompt_tokens': search_prompt_tokens,
+            'search_completion_tokens': search_completion_tokens,
+            'search_cost_usd': round(search_cost, 4),
+            'max_escalation_cost_usd': round(escalation_cost, 4),
+            'total_cost_usd': round(total_cost, 4),
+            'workers': num_shards,
+            'search_providers': providers,
+            'wall_time_s': round(wall_time_s, 1),
+            'max_escalation_time_s': round(escalation_time_s, 1),
+            'budget_usd': self.budget_usd,
+            'time_budget_s': self.time_budget_s
+        }
+
+        logger.info("🧭 RUN PLAN (no API calls made)")
+        logger.info("=" * 60)
+        logger.info(f"📊 Items: {len(entries)} in {self.input_file}")
+        if reuse_preprocessed:
+            logger.info(f"🤖 Preprocessing: cached ({self.preprocessed_file}), 0 LLM calls")
+        else:
+            logger.info(f"🤖 Preprocessing: {llm_calls} LLM calls ({OPTIMIZER_MODEL}), "
+                        f"~{llm_prompt_tokens} prompt + {llm_completion_tokens} completion tokens, ${llm_cost:.4f}")
+        logger.info(f"🔎 Searchable: {len(searchable)} items, {len(unique)} distinct")
+        if reuse_prices:
+            logger.info(f"💰 Price discovery: cached ({self.cached_price_file}), 0 searches")
+        else:
+            logger.info(f"📚 Reused from price history: {history_hits} | 🔗 near-duplicates: {similar_hits} "
+                        f"| 📦 local catalog: {catalog_hits}")
+            logger.info(f"💰 Price discovery: {search_calls} Perplexity calls ({tiers[0].label}), "
+                        f"~{search_prompt_tokens} prompt + {search_completion_tokens} completion tokens, "
+                        f"${search_cost:.4f}")
+            if len(tiers) > 1:
+                logger.info(f"🪜 Escalation ({', '.join(tier.label for tier in tiers[1:])}): "
+                            f"up to +${escalation_cost:.4f} and "
+                            f"+{timedelta(seconds=round(escalation_time_s))} if every item escalates")
+        logger.info(f"💵 Estimated cost: ${total_cost:.4f}")
+        logger.info(f"⏱️ Estimated wall time: {timedelta(seconds=round(wall_time_s))} "
+                    f"({num_shards} worker(s), {providers} search provider(s), "
+                    f"{self.rate_delay}s between searches per provider)")
+        if self.budget_usd is not None:
+            if total_cost <= self.budget_usd:
+                logger.info(f"✅ Fits the budget of ${self.budget_usd:.2f}")
+            else:
+                logger.warning(f"🛑 Exceeds the budget of ${self.budget_usd:.2f}: "
+                               "the run will stop cleanly when it is reached")
+        if self.time_budget_s is not None:
+            if wall_time_s <= self.time_budget_s:
+                logger.info(f"✅ Fits the time budget of {timedelta(seconds=round(self.time_budget_s))}")
+            else:
+                logger.warning(f"⏰ Exceeds the time budget of {timedelta(seconds=round(self.time_budget_s))}: "
+                               f"the highest-value items are priced first and the rest left not processed")
+        logger.info("=" * 60)
+        return plan
+
+    def run_complete_workflow(self) -> bool:
         """Run the complete intelligent price discovery workflow"""
         logger.info("🚀 INTELLIGENT PRICE DISCOVERY SYSTEM")
         logger.info("Powered by CrewAI Agents + Perplexity AI")
@@ -364,19 +1060,25 @@ class IntelligentPriceDiscoverySystem:
         start_time = datetime.now()
         
         # Step 1: Preprocessing
-        if not self.run_preprocessing():
+        with profiler.stage('preprocessing'):
+            preprocessed = self.run_preprocessing()
+        if not preprocessed:
             logger.error("❌ Workflow failed at preprocessing step")
-            return
+            return False
         
         # Step 2: Price Discovery
-        if not self.run_price_discovery():
+        with profiler.stage('price_discovery'):
+            priced = self.run_price_discovery()
+        if not priced:
             logger.error("❌ Workflow failed at price discovery step")
-            return
+            return False
         
         # Step 3: Final Report
-        if not self.create_final_report():
+        with profiler.stage('report'):
+            reported = self.create_final_report()
+        if not reported:
             logger.error("❌ Workflow failed at report generation step")
-            return
+            return False
         
         # Calculate total time
         end_time = datetime.now()
@@ -385,6 +1087,7 @@ class IntelligentPriceDiscoverySystem:
         logger.info("\n🎉 WORKFLOW COMPLETED SUCCESSFULLY!")
         logger.info(f"⏱️ Total processing time: {total_time}")
         logger.info(f"📁 Final report: {self.final_results_file}")
+        return True
 
 def main():
     """Main function to run intelligent price discovery"""
@@ -396,6 +1099,54 @@ def main():
                        help='Force reprocessing even if preprocessed files exist')
     parser.add_argument('--input-file', type=str,
                        help='Override input file path')
+    parser.add_argument('--shards', type=int,
+                       help='Split the input into N shards by a stable hash of the normalized item')
+    parser.add_argument('--shard-index', type=int,
+                       help='Run only this shard (0-based), e.g. on another host sharing --shard-dir')
+    parser.add_argument('--shard-dir', type=str,
+                       help='Shared directory for shard inputs, caches and journals')
+    parser.add_argument('--merge-shards', action='store_true',
+                       help='Merge the journals of all shards into the final report')
+    parser.add_argument('--incremental', action='store_true',
+                       help='Only re-search items with stale or low-confidence price history')
+    parser.add_argument('--max-age-days', type=float,
+                       default=float(os.getenv('REFRESH_MAX_AGE_DAYS', '7')),
+                       help='Incremental refresh: observations older than this are searched again')
+    parser.add_argument('--min-confidence', type=float,
+                       default=float(os.getenv('REFRESH_MIN_CONFIDENCE', '0.7')),
+                       help='Incremental refresh: observations below this confidence are searched again')
+    parser.add_argument('--history-db', type=str,
+                       help='SQLite price history file (default: PRICE_HISTORY_DB or price_history.db)')
+    parser.add_argument('--similarity-threshold', type=float,
+                       default=float(os.getenv('SIMILARITY_THRESHOLD', '0.8')),
+                       help='Reuse the price of near-duplicate items at or above this similarity (0 disables)')
+    parser.add_argument('--search-tiers', type=str,
+                       help='Search escalation "model:max_tokens[:concurrency],...", cheapest first '
+                            '(default: SEARCH_TIERS or sonar:150:4,sonar-pro:500:2)')
+    parser.add_argument('--escalation-confidence', type=float,
+                       help='Escalate to the next tier below this confidence (default: ESCALATION_CONFIDENCE or 0.7)')
+    parser.add_argument('--catalog-index', type=str,
+                       help='Local catalog index directory (default: CATALOG_INDEX or catalog_index)')
+    parser.add_argument('--catalog-min-score', type=float,
+                       help='Minimum relative BM25 score (0-1) to accept a local catalog product '
+                            '(default: CATALOG_MIN_SCORE or 0.75)')
+    parser.add_argument('--plan', action='store_true',
+                       help='Dry run: estimate API calls, tokens, cost and wall time without calling any API')
+    parser.add_argument('--budget-usd', type=float,
+                       default=float(os.getenv('BUDGET_USD')) if os.getenv('BUDGET_USD') else None,
+                       help='Hard cap on API spend (USD); the run stops cleanly when it is reached')
+    parser.add_argument('--time-budget-s', type=float,
+                       default=float(os.getenv('TIME_BUDGET_S')) if os.getenv('TIME_BUDGET_S') else None,
+                       help='Wall-clock budget (seconds); no API calls are made after it and the '
+                            'report keeps what was priced, highest-value items first')
+    parser.add_argument('--scheduling', choices=['value', 'category'],
+                       help='Price discovery order: highest estimated value first, or similar items '
+                            'together (default: SCHEDULING or value)')
+    parser.add_argument('--profile', nargs='?', const=os.getenv('PROFILE_DIR', 'profiles'), metavar='DIR',
+                       help='Profile each stage and write flame graphs to DIR (default: PROFILE_DIR or profiles)')
+    parser.add_argument('--verify', action='store_true', default=None,
+                       help='Check returned URLs/prices in the background and adjust confidence '
+                            '(default: VERIFY_RESULTS)')
     args = parser.parse_args()
 
     # Check if input file exists
@@ -409,14 +1160,52 @@ def main():
     if args.input_file:
         os.environ['INPUT_FILE'] = args.input_file
 
+    if args.profile and not args.plan:
+        label = 'busca_precos_completa'
+        if args.shard_index is not None:
+            label += f"_shard{args.shard_index}"
+        profiler.start(args.profile, label=label)
+
     try:
-        system = IntelligentPriceDiscoverySystem(force_reprocess=args.force_reprocess)
+        system = IntelligentPriceDiscoverySystem(
+            force_reprocess=args.force_reprocess,
+            history_db=args.history_db,
+            max_age_days=args.max_age_days if args.incremental else None,
+            min_confidence=args.min_confidence,
+            similarity_threshold=args.similarity_threshold,
+            budget_usd=args.budget_usd,
+            check_api_keys=not (args.plan or args.merge_shards),  # neither makes API calls
+            search_tiers=args.search_tiers,
+            escalation_confidence=args.escalation_confidence,
+            catalog_index=args.catalog_index,
+            catalog_min_score=args.catalog_min_score,
+            verify=args.verify,
+            time_budget_s=args.time_budget_s,
+            scheduling=args.scheduling
+        )
+
+        if args.plan:
+            system.plan(num_shards=args.shards or 1)
+            return
+
+        if args.shards:
+            shard_dir = args.shard_dir or system.default_shard_dir()
+            if args.shard_index is not None:
+                sys.exit(0 if system.run_shard(args.shard_index, args.shards, shard_dir) else 1)
+            elif args.merge_shards:
+                system.merge_shards(args.shards, shard_dir)
+            else:
+                system.run_sharded(args.shards, shard_dir)
+            return
+
         system.run_complete_workflow()
 
     except KeyboardInterrupt:
         logger.info("\n⚠️ Workflow interrupted by user")
     except Exception as e:
         logger.error(f"❌ Workflow failed: {e}")
+    finally:
+        profiler.stop()
 
 if __name__ == "__main__":
     main()
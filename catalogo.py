@@ -0,0 +1,452 @@
+#!/usr/bin/env python3
+"""
+Catálogo Local de Preços
+Importa dumps de catálogos de lojas (CSV/JSON/Parquet) para um índice invertido
+local com ranking BM25 e filtros de unidade e marca. Consultado antes da
+Perplexity, responde itens de catálogo em milissegundos, sem rede.
+
+O índice fica em um diretório com segmentos imutáveis (arrays .npy abertos
+com memory-map, então a inicialização não lê o catálogo inteiro). Cada
+importação acrescenta um segmento; produtos repetidos (mesma loja + nome ou
+URL) valem pela versão mais nova. `compact` junta tudo em um só segmento.
+
+Uso:
+    python catalogo.py import dump.csv --store "Loja X"
+    python catalogo.py search "geladeira brastemp 375 litros"
+    python catalogo.py compact
+    python catalogo.py stats
+"""
+
+import os
+import re
+import json
+import math
+import shutil
+import hashlib
+import logging
+import argparse
+import threading
+from typing import Any, Dict, List, Optional
+
+import numpy as np
+import pandas as pd
+
+from similaridade import TextNormalizer
+
+logger = logging.getLogger(__name__)
+
+# Nomes aceitos para as colunas dos dumps
+COLUMN_ALIASES = {
+    'name': ['name', 'title', 'nome', 'produto', 'item', 'descricao', 'descrição'],
+    'price': ['price', 'preco', 'preço', 'valor'],
+    'store': ['store', 'loja', 'seller', 'retailer', 'vendedor'],
+    'url': ['url', 'link'],
+    'brand': ['brand', 'marca'],
+}
+
+MANIFEST = 'manifest.json'
+TEXT_FIELDS = 4  # nome, loja, url, marca
+
+
+def _hash(value: str) -> int:
+    """Hash estável de 64 bits (termos, facetas e chaves de produto)"""
+    return int.from_bytes(hashlib.blake2b(value.encode('utf-8'), digest_size=8).digest(), 'little')
+
+
+def _facet(values: List[str]) -> int:
+    """Hash de um conjunto de unidades/marcas (0 = nenhuma)"""
+    return _hash('|'.join(values)) if values else 0
+
+
+def _parse_price(value: Any) -> float:
+    """Preço numérico ou texto ("R$ 1.299,90")"""
+    if isinstance(value, (int, float)):
+        return float(value)
+    text = re.sub(r'[^\d,.]', '', str(value))
+    if ',' in text:
+        text = text.replace('.', '').replace(',', '.')
+    try:
+        return float(text)
+    except ValueError:
+        return math.nan
+
+
+class CatalogSegment:
+    """Segmento imutável do índice (arrays abertos com memory-map)"""
+
+    ARRAYS = ['term_hashes', 'term_offsets', 'postings_docs', 'postings_tf', 'doc_len', 'price',
+              'unit_facet', 'brand_facet', 'product_keys', 'sorted_product_keys', 'text_offsets', 'text']
+
+    def __init__(self, path: str):
+        self.path = path
+        self.name = os.path.basename(path)
+        for array_name in self.ARRAYS:
+            setattr(self, array_name, np.load(os.path.join(path, f"{array_name}.npy"), mmap_mode='r'))
+        self.num_docs = len(self.doc_len)
+        self.total_len = int(np.asarray(self.doc_len, dtype=np.int64).sum())
+
+    @classmethod
+    def write(cls, path: str, records: List[Dict[str, Any]], normalizer: TextNormalizer) -> 'CatalogSegment':
+        """Grava um segmento a partir de registros {name, price, store, url, brand}"""
+        term_hashes, postings_docs, postings_tf = [], [], []
+        doc_len = np.zeros(len(records), dtype=np.int32)
+        unit_facet = np.zeros(len(records), dtype=np.uint64)
+        brand_facet = np.zeros(len(records), dtype=np.uint64)
+        product_keys = np.zeros(len(records), dtype=np.uint64)
+        text = bytearray()
+        text_offsets = [0]
+
+        for doc, record in enumerate(records):
+            normalized, units, brands = normalizer.normalize(record['name'])
+            if record.get('brand'):
+                brands = normalizer.normalize(record['brand'])[2] or [str(record['brand']).strip().lower()]
+            tokens = normalized.split()
+
+            counts: Dict[str, int] = {}
+            for token in tokens:
+                counts[token] = counts.get(token, 0) + 1
+            for token, tf in counts.items():
+                term_hashes.append(_hash(token))
+                postings_docs.append(doc)
+                postings_tf.append(min(tf, 65535))
+
+            doc_len[doc] = len(tokens)
+            unit_facet[doc] = _facet(units)
+            brand_facet[doc] = _facet(brands)
+            product_keys[doc] = _hash(record.get('url') or f"{record.get('store') or ''}|{normalized}")
+
+            for field in (record['name'], record.get('store') or '', record.get('url') or '', record.get('brand') or ''):
+                text += str(field).encode('utf-8')
+                text_offsets.append(len(text))
+
+        term_hashes = np.asarray(term_hashes, dtype=np.uint64)
+        postings_docs = np.asarray(postings_docs, dtype=np.int32)
+        postings_tf = np.asarray(postings_tf, dtype=np.uint16)
+        order = np.lexsort((postings_docs, term_hashes))
+        term_hashes, postings_docs, postings_tf = term_hashes[order], postings_docs[order], postings_tf[order]
+        unique_terms, starts = np.unique(term_hashes, return_index=True)
+
+        arrays = {
+            'term_hashes': unique_terms,
+            'term_offsets': np.append(starts, len(term_hashes)).astype(np.int64),
+            'postings_docs': postings_docs,
+            'postings_tf': postings_tf,
+            'doc_len': doc_len,
+            'price': np.asarray([record['price'] for record in records], dtype=np.float64),
+            'unit_facet': unit_facet,
+            'brand_facet': brand_facet,
+            'product_keys': product_keys,
+            'sorted_product_keys': np.sort(product_keys),
+            'text_offsets': np.asarray(text_offsets, dtype=np.int64),
+            'text': np.frombuffer(bytes(text), dtype=np.uint8),
+        }
+
+        os.makedirs(path)
+        for array_name, values in arrays.items():
+            np.save(os.path.join(path, f"{array_name}.npy"), values)
+        return cls(path)
+
+    def postings(self, term_hash: np.uint64):
+        """Documentos e frequências de um termo (None se ausente)"""
+        position = int(self.term_hashes.searchsorted(term_hash))
+        if position >= len(self.term_hashes) or self.term_hashes[position] != term_hash:
+            return None
+        start, end = int(self.term_offsets[position]), int(self.term_offsets[position + 1])
+        return self.postings_docs[start:end], self.postings_tf[start:end]
+
+    def contains_products(self, keys: np.ndarray) -> np.ndarray:
+        """Quais chaves de produto existem neste segmento"""
+        if not len(self.sorted_product_keys):
+            return np.zeros(len(keys), dtype=bool)
+        positions = np.minimum(self.sorted_product_keys.searchsorted(keys), len(self.sorted_product_keys) - 1)
+        return self.sorted_product_keys[positions] == keys
+
+    def text_field(self, doc: int, field: int) -> str:
+        """Nome (0), loja (1), URL (2) ou marca (3) de um documento"""
+        index = doc * TEXT_FIELDS + field
+        start, end = int(self.text_offsets[index]), int(self.text_offsets[index + 1])
+        return bytes(self.text[start:end]).decode('utf-8')
+
+
+class CatalogIndex:
+    """Índice BM25 de catálogos de lojas, em disco e com atualizações incrementais"""
+
+    K1 = 1.2
+    B = 0.75
+    # Termos presentes em mais que essa fração do catálogo não geram candidatos,
+    # só pontuam os candidatos dos termos mais seletivos
+    COMMON_TERM_RATIO = 0.05
+
+    def __init__(self, index_dir: str = 'catalog_index', brands=()):
+        """
+        Args:
+            index_dir: Diretório do índice (criado na primeira importação)
+            brands: Marcas reconhecidas nos nomes dos produtos (filtro de marca)
+        """
+        self.index_dir = index_dir
+        self.normalizer = TextNormalizer(brands)
+        self._lock = threading.Lock()
+        self.segments: List[CatalogSegment] = []
+        self._load()
+
+    def _load(self):
+        """Abre os segmentos listados no manifesto"""
+        manifest = os.path.join(self.index_dir, MANIFEST)
+        if not os.path.exists(manifest):
+            return
+        with open(manifest, encoding='utf-8') as f:
+            names = json.load(f)['segments']
+        self.segments = [CatalogSegment(os.path.join(self.index_dir, name)) for name in names]
+
+    def _write_manifest(self, segments: List[CatalogSegment]):
+        """Troca o manifesto de forma atômica (leitores veem o antigo ou o novo)"""
+        manifest = os.path.join(self.index_dir, MANIFEST)
+        with open(manifest + '.tmp', 'w', encoding='utf-8') as f:
+            json.dump({'segments': [segment.name for segment in segments]}, f)
+        os.replace(manifest + '.tmp', manifest)
+
+    def _next_segment_path(self) -> str:
+        existing = [int(name.split('_')[1]) for name in os.listdir(self.index_dir) if name.startswith('seg_')]
+        return os.path.join(self.index_dir, f"seg_{max(existing, default=0) + 1:06d}")
+
+    def __len__(self) -> int:
+        return sum(segment.num_docs for segment in self.segments)
+
+    @staticmethod
+    def read_dump(path: str, store: Optional[str] = None) -> List[Dict[str, Any]]:
+        """Lê um dump CSV/JSON/JSONL/Parquet e devolve registros válidos"""
+        extension = os.path.splitext(path)[1].lower()
+        if extension == '.csv':
+            df = pd.read_csv(path, low_memory=False)
+        elif extension in ('.jsonl', '.ndjson'):
+            df = pd.read_json(path, lines=True)
+        elif extension == '.json':
+            df = pd.read_json(path)
+        elif extension == '.parquet':
+            df = pd.read_parquet(path)  # requer pyarrow ou fastparquet
+        else:
+            raise ValueError(f"Formato de catálogo não suportado: {extension}")
+
+        lower = {str(column).strip().lower(): column for column in df.columns}
+        columns = {}
+        for field, aliases in COLUMN_ALIASES.items():
+            columns[field] = next((lower[alias] for alias in aliases if alias in lower), None)
+        if columns['name'] is None or columns['price'] is None:
+            raise ValueError(f"Catálogo sem colunas de nome e preço: {list(df.columns)}")
+
+        records = []
+        for row in df.itertuples(index=False):
+            values = dict(zip(df.columns, row))
+            name = str(values[columns['name']]).strip()
+            price = _parse_price(values[columns['price']])
+            if not name or name.lower() == 'nan' or not (price > 0):
+                continue
+
+            def optional(field):
+                value = values[columns[field]] if columns[field] is not None else None
+                return None if value is None or (isinstance(value, float) and math.isnan(value)) else str(value)
+
+            records.append({
+                'name': name,
+                'price': price,
+                'store': optional('store') or store,
+                'url': optional('url'),
+                'brand': optional('brand')
+            })
+        return records
+
+    def import_records(self, records: List[Dict[str, Any]]) -> int:
+        """Acrescenta um segmento com os registros (atualização incremental)"""
+        if not records:
+            return 0
+        os.makedirs(self.index_dir, exist_ok=True)
+        with self._lock:
+            segment = CatalogSegment.write(self._next_segment_path(), records, self.normalizer)
+            segments = self.segments + [segment]
+            self._write_manifest(segments)
+            self.segments = segments
+        logger.info(f"📦 Catalog: {len(records)} products added ({segment.name}, {len(self)} total)")
+        return len(records)
+
+    def import_file(self, path: str, store: Optional[str] = None) -> int:
+        """Importa um dump de catálogo"""
+        return self.import_records(self.read_dump(path, store))
+
+    def compact(self) -> int:
+        """Junta todos os segmentos em um, descartando versões antigas de produtos"""
+        with self._lock:
+            segments = self.segments
+            records = []
+            for position, segment in enumerate(segments):
+                keys = np.asarray(segment.product_keys)
+                stale = np.zeros(len(keys), dtype=bool)
+                for newer in segments[position + 1:]:
+                    stale |= newer.contains_products(keys)
+                for doc in np.flatnonzero(~stale):
+                    records.append({
+                        'name': segment.text_field(doc, 0),
+                        'price': float(segment.price[doc]),
+                        'store': segment.text_field(doc, 1) or None,
+                        'url': segment.text_field(doc, 2) or None,
+                        'brand': segment.text_field(doc, 3) or None
+                    })
+            if len(segments) <= 1:
+                return len(records)
+
+            merged = CatalogSegment.write(self._next_segment_path(), records, self.normalizer)
+            self._write_manifest([merged])
+            self.segments = [merged]
+        for segment in segments:
+            shutil.rmtree(segment.path, ignore_errors=True)
+        logger.info(f"🗜️ Catalog compacted: {len(segments)} segments -> 1 ({len(records)} products)")
+        return len(records)
+
+    def search(self, text: str, limit: int = 1) -> List[Dict[str, Any]]:
+        """
+        Produtos mais relevantes para a descrição (BM25). Unidades e marcas
+        presentes na consulta precisam coincidir com as do produto. `score` é o
+        BM25 relativo ao de um produto idêntico à consulta (0-1).
+        """
+        segments = self.segments
+        if not segments:
+            return []
+
+        normalized, units, brands = self.normalizer.normalize(text)
+        terms = sorted(set(normalized.split()))
+        if not terms:
+            return []
+        term_hashes = [np.uint64(_hash(term)) for term in terms]
+        unit_facet = np.uint64(_facet(units))
+        brand_facet = np.uint64(_facet(brands))
+
+        num_docs = sum(segment.num_docs for segment in segments)
+        avg_len = sum(segment.total_len for segment in segments) / num_docs
+
+        # Postings por segmento e frequência de documentos global de cada termo
+        postings = [[segment.postings(term_hash) for term_hash in term_hashes] for segment in segments]
+        df = [sum(len(found[0]) for found in (seg[i] for seg in postings) if found) for i in range(len(terms))]
+        idf = [math.log(1 + (num_docs - count + 0.5) / (count + 0.5)) for count in df]
+
+        # Score de um produto idêntico à consulta (normalização para 0-1). Inclui
+        # os termos ausentes do catálogo (idf máximo, df = 0): um produto que não
+        # cobre parte da consulta não chega perto de 1
+        query_norm = self.K1 * (1 - self.B + self.B * len(normalized.split()) / avg_len)
+        ideal = sum(weight * (self.K1 + 1) / (1 + query_norm) for weight in idf)
+        if ideal <= 0:
+            return []
+
+        common_cutoff = max(1000, self.COMMON_TERM_RATIO * num_docs)
+        selective = [i for i, count in enumerate(df) if 0 < count <= common_cutoff] or range(len(terms))
+
+        hits = []
+        for position, (segment, segment_postings) in enumerate(zip(segments, postings)):
+            def bm25(weight, tf, docs):
+                lengths = np.asarray(segment.doc_len[docs], dtype=np.float64)
+                return weight * tf * (self.K1 + 1) / (tf + self.K1 * (1 - self.B + self.B * lengths / avg_len))
+
+            docs_parts, score_parts = [], []
+            for i in selective:
+                found = segment_postings[i]
+                if not found:
+                    continue
+                docs, tf = np.asarray(found[0]), np.asarray(found[1], dtype=np.float64)
+                docs_parts.append(docs)
+                score_parts.append(bm25(idf[i], tf, docs))
+            if not docs_parts:
+                continue
+
+            docs, inverse = np.unique(np.concatenate(docs_parts), return_inverse=True)
+            scores = np.bincount(inverse, weights=np.concatenate(score_parts))
+
+            # Termos comuns: busca binária dos candidatos nas listas (ordenadas por documento)
+            for i, found in enumerate(segment_postings):
+                if i in selective or not found:
+                    continue
+                common_docs, common_tf = found
+                positions = np.minimum(common_docs.searchsorted(docs), len(common_docs) - 1)
+                matched = common_docs[positions] == docs
+                if matched.any():
+                    tf = np.asarray(common_tf[positions[matched]], dtype=np.float64)
+                    scores[matched] += bm25(idf[i], tf, docs[matched])
+
+            # Filtros de unidade/marca e versões substituídas por segmentos mais novos
+            keep = np.ones(len(docs), dtype=bool)
+            if units:
+                keep &= segment.unit_facet[docs] == unit_facet
+            if brands:
+                keep &= segment.brand_facet[docs] == brand_facet
+            keys = np.asarray(segment.product_keys[docs])
+            for newer in segments[position + 1:]:
+                keep &= ~newer.contains_products(keys)
+            docs, scores = docs[keep], scores[keep]
+            if not len(docs):
+                continue
+
+            top = np.argsort(-scores)[:limit]
+            hits.extend((float(scores[i]), segment, int(docs[i])) for i in top)
+
+        hits.sort(key=lambda hit: -hit[0])
+        return [
+            {
+                'name': segment.text_field(doc, 0),
+                'price': float(segment.price[doc]),
+                'store': segment.text_field(doc, 1) or None,
+                'url': segment.text_field(doc, 2) or None,
+                'bm25': round(score, 4),
+                'score': round(min(score / ideal, 1.0), 4)
+            }
+            for score, segment, doc in hits[:limit]
+        ]
+
+    def stats(self) -> Dict[str, Any]:
+        """Produtos, segmentos e tamanho em disco"""
+        size = sum(
+            os.path.getsize(os.path.join(segment.path, name))
+            for segment in self.segments for name in os.listdir(segment.path)
+        )
+        return {'products': len(self), 'segments': len(self.segments), 'disk_mb': round(size / 1024 / 1024, 2)}
+
+
+def main():
+    """Importação, compactação e consulta do catálogo local"""
+    from dotenv import load_dotenv
+    from busca_precos_basica import PriceDiscoverySystem
+
+    load_dotenv(override=True)
+    logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s')
+
+    parser = argparse.ArgumentParser(description='Local price catalog index')
+    parser.add_argument('--index', default=os.getenv('CATALOG_INDEX', 'catalog_index'),
+                        help='Diretório do índice (padrão: CATALOG_INDEX ou catalog_index)')
+    commands = parser.add_subparsers(dest='command', required=True)
+    import_parser = commands.add_parser('import', help='Importa dumps CSV/JSON/Parquet')
+    import_parser.add_argument('files', nargs='+')
+    import_parser.add_argument('--store', help='Loja dos produtos quando o dump não tem essa coluna')
+    search_parser = commands.add_parser('search', help='Consulta o índice')
+    search_parser.add_argument('query')
+    search_parser.add_argument('--limit', type=int, default=5)
+    commands.add_parser('compact', help='Junta os segmentos do índice')
+    commands.add_parser('stats', help='Tamanho do índice')
+    args = parser.parse_args()
+
+    index = CatalogIndex(args.index, brands=PriceDiscoverySystem.BRAND_INDICATORS)
+
+    if args.command == 'import':
+        for path in args.files:
+            index.import_file(path, args.store)
+        logger.info(f"📊 {index.stats()}")
+    elif args.command == 'search':
+        hits = index.search(args.query, args.limit)
+        if not hits:
+            logger.info(f"🔍 Nenhum produto para '{args.query}'")
+        for hit in hits:
+            logger.info(f"🔍 {hit['score']:.2f}  R$ {hit['price']:>10.2f}  {hit['store'] or '-'}  {hit['name']}")
+    elif args.command == 'compact':
+        index.compact()
+        logger.info(f"📊 {index.stats()}")
+    else:
+        logger.info(f"📊 {index.stats()}")
+
+
+if __name__ == "__main__":
+    main()
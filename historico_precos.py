@@ -0,0 +1,143 @@
+#!/usr/bin/env python3
+"""
+Histórico de Preços
+Banco SQLite local com uma linha por observação de preço, usado para
+atualização incremental: apenas itens com observação antiga ou de baixa
+confiança voltam a ser pesquisados.
+"""
+
+import sqlite3
+import logging
+import threading
+from datetime import datetime, timedelta, timezone
+from typing import Any, Dict, Iterator, Optional
+
+logger = logging.getLogger(__name__)
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS observations (
+    id INTEGER PRIMARY KEY AUTOINCREMENT,
+    item_key TEXT NOT NULL,
+    item TEXT NOT NULL,
+    status TEXT NOT NULL,
+    price REAL,
+    store TEXT,
+    url TEXT,
+    confidence REAL,
+    observed_at TEXT NOT NULL,
+    verification TEXT
+);
+CREATE INDEX IF NOT EXISTS idx_observations_item ON observations (item_key, observed_at);
+"""
+
+# Última observação de um item: a mais recente pela data (empate no mesmo segundo: a inserida por último).
+# Única definição usada por todas as consultas, mesmo com observações gravadas fora de ordem (shards)
+LATEST_ID = "SELECT id FROM observations WHERE item_key = {} ORDER BY observed_at DESC, id DESC LIMIT 1"
+
+
+def _utc_now() -> datetime:
+    return datetime.now(timezone.utc).replace(microsecond=0)
+
+
+class PriceHistoryStore:
+    """Banco local de observações de preço (item normalizado, loja, preço, url, confiança, data)"""
+
+    def __init__(self, db_path: str = 'price_history.db'):
+        """
+        Args:
+            db_path: Arquivo SQLite (criado se não existir)
+        """
+        self.db_path = db_path
+        # timeout: vários processos (shards) podem gravar no mesmo arquivo
+        self._conn = sqlite3.connect(db_path, timeout=30, check_same_thread=False)
+        self._conn.row_factory = sqlite3.Row
+        self._lock = threading.Lock()
+
+        with self._lock, self._conn:
+            self._conn.execute("PRAGMA journal_mode=WAL")
+            self._conn.executescript(SCHEMA)
+            # Bancos criados antes da verificação de URLs
+            columns = {row['name'] for row in self._conn.execute("PRAGMA table_info(observations)")}
+            if 'verification' not in columns:
+                self._conn.execute("ALTER TABLE observations ADD COLUMN verification TEXT")
+
+    def record(self, item_key: str, result) -> None:
+        """Registra o resultado de uma busca (PriceResult)"""
+        with self._lock, self._conn:
+            self._conn.execute(
+                "INSERT INTO observations (item_key, item, status, price, store, url, confidence, observed_at, "
+                "verification) VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)",
+                (item_key, str(result.item), result.status, result.price, result.store,
+                 result.url, result.confidence, _utc_now().isoformat(), getattr(result, 'verification', None))
+            )
+
+    def record_verification(self, item_key: str, result) -> None:
+        """
+        Grava o desfecho da verificação (e a confiança ajustada) na última
+        observação do item, se ela ainda for a da URL verificada
+        """
+        with self._lock, self._conn:
+            self._conn.execute(
+                "UPDATE observations SET verification = ?, confidence = ? "
+                f"WHERE id = ({LATEST_ID.format('?')}) AND url = ?",
+                (result.verification, result.confidence, item_key, result.url)
+            )
+
+    def latest(self, item_key: str) -> Optional[Dict[str, Any]]:
+        """Última observação de um item normalizado"""
+        with self._lock:
+            row = self._conn.execute(
+                f"SELECT * FROM observations WHERE id = ({LATEST_ID.format('?')})",
+                (item_key,)
+            ).fetchone()
+        return dict(row) if row else None
+
+    def fresh_observation(self, item_key: str, max_age_days: float,
+                          min_confidence: float) -> Optional[Dict[str, Any]]:
+        """
+        Última observação com preço se ainda estiver válida: mais nova que
+        max_age_days e com confiança >= min_confidence. Caso contrário o item
+        deve ser pesquisado novamente.
+        """
+        observation = self.latest(item_key)
+        if not observation or observation['status'] != 'price_found' or observation['price'] is None:
+            return None
+
+        threshold = (_utc_now() - timedelta(days=max_age_days)).isoformat()
+        if observation['observed_at'] < threshold:
+            return None
+        if (observation['confidence'] or 0.0) < min_confidence:
+            return None
+
+        return observation
+
+    def found_item_keys(self) -> Iterator[str]:
+        """Itens normalizados cuja última observação tem preço"""
+        with self._lock:
+            rows = self._conn.execute(
+                "SELECT item_key FROM observations o WHERE status = 'price_found' AND price IS NOT NULL "
+                f"AND id = ({LATEST_ID.format('o.item_key')})"
+            ).fetchall()
+        return (row['item_key'] for row in rows)
+
+    def latest_prices(self) -> Dict[str, float]:
+        """Último preço de cada item normalizado cuja última observação tem preço"""
+        with self._lock:
+            rows = self._conn.execute(
+                "SELECT item_key, price FROM observations o WHERE status = 'price_found' AND price IS NOT NULL "
+                f"AND id = ({LATEST_ID.format('o.item_key')})"
+            ).fetchall()
+        return {row['item_key']: row['price'] for row in rows}
+
+    def stats(self) -> Dict[str, int]:
+        """Quantidade de observações e de itens distintos"""
+        with self._lock:
+            row = self._conn.execute(
+                "SELECT COUNT(*) AS observations, COUNT(DISTINCT item_key) AS items FROM observations"
+            ).fetchone()
+        return dict(row)
+
+    def close(self) -> None:
+        """Fecha a conexão com o banco"""
+        with self._lock:
+            self._conn.close()
@@ -0,0 +1,278 @@
+#!/usr/bin/env python3
+"""
+Perfilamento por Etapa
+Modo `--profile` dos pontos de entrada: um amostrador em thread separada lê a
+pilha de todas as threads a cada poucos milissegundos e atribui cada amostra à
+etapa ativa naquela thread (leitura da planilha, busca, verificação,
+relatório...). Cada thread tem sua pilha de etapas (jobs simultâneos do
+servidor não se misturam); threads sem etapa própria, como as dos pools de
+verificação, contam na etapa da thread principal. Com o
+relógio de CPU de cada thread, separa tempo de CPU de espera de rede e de
+outras esperas (locks, sleep do rate limit, futures).
+
+Grava, por execução, um arquivo de pilhas colapsadas por etapa
+(`<etapa>.folded`, compatível com flamegraph.pl/speedscope), um flame graph
+combinado (`flamegraph.folded` e `flamegraph.svg`) e `summary.json`.
+Desligado, `profiler.stage()` devolve um contexto nulo compartilhado.
+"""
+
+import os
+import sys
+import json
+import time
+import zlib
+import html
+import logging
+import threading
+from contextlib import contextmanager, nullcontext
+from datetime import datetime
+from typing import Dict, List, Optional, Tuple
+
+logger = logging.getLogger(__name__)
+
+_NULL_STAGE = nullcontext()
+
+# Frames que indicam espera de rede (socket, TLS, HTTP)
+NETWORK_MODULES = (
+    os.sep + 'socket.py', os.sep + 'ssl.py', os.sep + os.path.join('http', 'client.py'),
+    os.sep + 'urllib3' + os.sep, os.sep + 'requests' + os.sep, os.sep + 'httpx' + os.sep,
+    os.sep + 'httpcore' + os.sep,
+)
+
+CATEGORIES = ('cpu', 'network', 'wait')
+
+
+class StageProfiler:
+    """Amostrador de pilhas com atribuição por etapa (desligado até start())"""
+
+    def __init__(self):
+        self.enabled = False
+        self.base_dir: Optional[str] = None
+        self.output_dir: Optional[str] = None
+        self.interval = 0.005
+
+        # Etapas abertas por thread (ident -> pilha) e o caminho da etapa atual de cada uma
+        self._lock = threading.Lock()
+        self._stacks: Dict[int, List[str]] = {}
+        self._current: Dict[int, str] = {}
+        self._wall: Dict[str, float] = {}
+        self._cpu: Dict[str, float] = {}
+        self._thread_seconds: Dict[str, Dict[str, float]] = {}
+        self._samples: Dict[Tuple[str, str, str], int] = {}
+
+        self._stop = threading.Event()
+        self._thread: Optional[threading.Thread] = None
+
+    def start(self, base_dir: str, label: str, interval_ms: Optional[float] = None):
+        """Liga o amostrador; os arquivos vão para base_dir/<label>_<timestamp>"""
+        self.base_dir = base_dir
+        self.output_dir = os.path.join(base_dir, f"{label}_{datetime.now().strftime('%Y%m%d_%H%M%S')}")
+        os.makedirs(self.output_dir, exist_ok=True)
+        self.interval = (interval_ms if interval_ms is not None
+                         else float(os.getenv('PROFILE_INTERVAL_MS', '5'))) / 1000
+        self.enabled = True
+
+        self._stop.clear()
+        self._thread = threading.Thread(target=self._sample_loop, name='profiler', daemon=True)
+        self._thread.start()
+        logger.info(f"🔬 Profiling every {self.interval * 1000:.0f} ms -> {self.output_dir}")
+
+    def stage(self, name: str):
+        """Contexto de uma etapa (aninhável: "price_discovery/search")"""
+        if not self.enabled:
+            return _NULL_STAGE
+        return self._stage(name)
+
+    @contextmanager
+    def _stage(self, name: str):
+        ident = threading.get_ident()
+        with self._lock:
+            stack = self._stacks.setdefault(ident, [])
+            stack.append(name)
+            path = self._current[ident] = '/'.join(stack)
+        wall, cpu = time.perf_counter(), time.process_time()
+        try:
+            yield
+        finally:
+            with self._lock:
+                self._wall[path] = self._wall.get(path, 0.0) + time.perf_counter() - wall
+                self._cpu[path] = self._cpu.get(path, 0.0) + time.process_time() - cpu
+                stack.pop()
+                if stack:
+                    self._current[ident] = '/'.join(stack)
+                else:
+                    del self._stacks[ident], self._current[ident]
+
+    # ------------------------------------------------------------------ sampling
+
+    @staticmethod
+    def _frame_label(frame) -> str:
+        code = frame.f_code
+        return f"{code.co_name} ({os.path.basename(code.co_filename)}:{code.co_firstlineno})".replace(';', ',')
+
+    @staticmethod
+    def _is_idle_worker(frame) -> bool:
+        """Thread de pool parada esperando trabalho (não conta como espera da etapa)"""
+        code = frame.f_code
+        return code.co_name == '_worker' and code.co_filename.endswith(os.path.join('futures', 'thread.py'))
+
+    def _sample_loop(self):
+        own = threading.get_ident()
+        clocks: Dict[int, int] = {}
+        last_cpu: Dict[int, float] = {}
+        last = time.perf_counter()
+
+        while not self._stop.wait(self.interval):
+            now = time.perf_counter()
+            elapsed, last = now - last, now
+            with self._lock:
+                current = dict(self._current)
+            fallback = current.get(threading.main_thread().ident, 'outside')
+
+            for ident, frame in sys._current_frames().items():
+                if ident == own or self._is_idle_worker(frame):
+                    continue
+                stage = current.get(ident, fallback)
+                seconds = self._thread_seconds.setdefault(stage, dict.fromkeys(CATEGORIES, 0.0))
+
+                labels, network = [], False
+                while frame is not None:
+                    labels.append(self._frame_label(frame))
+                    network = network or any(module in frame.f_code.co_filename for module in NETWORK_MODULES)
+                    frame = frame.f_back
+
+                # Relógio de CPU da thread: andou no intervalo -> CPU, senão espera
+                on_cpu = None
+                try:
+                    if ident not in clocks:
+                        clocks[ident] = time.pthread_getcpuclockid(ident)
+                    cpu = time.clock_gettime(clocks[ident])
+                    if ident in last_cpu:
+                        on_cpu = cpu - last_cpu[ident] >= elapsed / 2
+                    last_cpu[ident] = cpu
+                except (AttributeError, OSError):
+                    pass  # sem relógio por thread: classifica só pela pilha
+
+                if on_cpu is None:
+                    category = 'network' if network else 'cpu'
+                else:
+                    category = 'cpu' if on_cpu else ('network' if network else 'wait')
+
+                seconds[category] += elapsed
+                key = (stage, category, ';'.join(reversed(labels)))
+                self._samples[key] = self._samples.get(key, 0) + 1
+
+    # ------------------------------------------------------------------ output
+
+    def stop(self):
+        """Desliga o amostrador e grava os arquivos de perfil"""
+        if not self.enabled:
+            return
+        self._stop.set()
+        self._thread.join()
+        self.enabled = False
+
+        combined: Dict[str, int] = {}
+        per_stage: Dict[str, Dict[str, int]] = {}
+        for (stage, category, stack), count in self._samples.items():
+            folded = f"{category};{stack}"
+            per_stage.setdefault(stage, {})
+            per_stage[stage][folded] = per_stage[stage].get(folded, 0) + count
+            combined[f"{stage};{folded}"] = combined.get(f"{stage};{folded}", 0) + count
+
+        for stage, folded in per_stage.items():
+            self._write_folded(folded, os.path.join(self.output_dir, stage.replace('/', '.') + '.folded'))
+        self._write_folded(combined, os.path.join(self.output_dir, 'flamegraph.folded'))
+        self._write_svg(combined, os.path.join(self.output_dir, 'flamegraph.svg'))
+
+        summary = self.summary()
+        with open(os.path.join(self.output_dir, 'summary.json'), 'w', encoding='utf-8') as f:
+            json.dump(summary, f, indent=2, ensure_ascii=False)
+        self._log_summary(summary)
+
+    def summary(self) -> Dict[str, Dict]:
+        """Por etapa: tempo de parede e de CPU do processo, segundos-thread por categoria e funções mais caras"""
+        self_time: Dict[str, Dict[str, int]] = {}
+        for (stage, category, stack), count in self._samples.items():
+            leaf = f"[{category}] " + stack.rsplit(';', 1)[-1]
+            functions = self_time.setdefault(stage, {})
+            functions[leaf] = functions.get(leaf, 0) + count
+
+        summary = {}
+        for stage in sorted(set(self._wall) | set(self._thread_seconds)):
+            seconds = self._thread_seconds.get(stage, dict.fromkeys(CATEGORIES, 0.0))
+            top = sorted(self_time.get(stage, {}).items(), key=lambda entry: -entry[1])[:10]
+            summary[stage] = {
+                'wall_s': round(self._wall.get(stage, 0.0), 3),
+                'process_cpu_s': round(self._cpu.get(stage, 0.0), 3),
+                **{f"{category}_thread_s": round(seconds[category], 3) for category in CATEGORIES},
+                'top_functions': [{'function': name, 'samples': count} for name, count in top],
+            }
+        return summary
+
+    def _log_summary(self, summary: Dict[str, Dict]):
+        logger.info("🔬 Profile by stage (wall includes sub-stages; cpu/network/wait in thread-seconds):")
+        for stage, data in summary.items():
+            logger.info(f"   {stage}: wall {data['wall_s']:.2f}s | cpu {data['cpu_thread_s']:.2f}s "
+                        f"| network {data['network_thread_s']:.2f}s | wait {data['wait_thread_s']:.2f}s")
+            if data['top_functions']:
+                hottest = data['top_functions'][0]
+                logger.info(f"      hottest: {hottest['function']} ({hottest['samples']} samples)")
+        logger.info(f"🔥 Flame graph: {os.path.join(self.output_dir, 'flamegraph.svg')}")
+
+    @staticmethod
+    def _write_folded(folded: Dict[str, int], path: str):
+        with open(path, 'w', encoding='utf-8') as f:
+            for stack, count in sorted(folded.items()):
+                f.write(f"{stack} {count}\n")
+
+    @staticmethod
+    def _write_svg(folded: Dict[str, int], path: str, width: int = 1200, row: int = 16):
+        """Flame graph SVG autocontido a partir das pilhas colapsadas"""
+        tree = {'value': 0, 'children': {}}
+        for stack, count in folded.items():
+            node = tree
+            node['value'] += count
+            for frame in stack.split(';'):
+                node = node['children'].setdefault(frame, {'value': 0, 'children': {}})
+                node['value'] += count
+
+        def depth_of(node):
+            return 1 + max((depth_of(child) for child in node['children'].values()), default=0)
+
+        total = max(tree['value'], 1)
+        height = (depth_of(tree) + 1) * row
+        colors = {'cpu': (220, 110, 40), 'network': (60, 120, 210), 'wait': (150, 150, 150)}
+        rects = []
+
+        def walk(name, node, x, depth, category):
+            w = node['value'] / total * width
+            if w < 0.5:
+                return
+            if depth == 2:
+                category = name
+            base = colors.get(category, (200, 80, 60))
+            shade = zlib.crc32(name.encode('utf-8')) % 40
+            fill = f"rgb({min(255, base[0] + shade)},{min(255, base[1] + shade)},{min(255, base[2] + shade)})"
+            y = height - (depth + 1) * row
+            label = name if len(name) * 7 < w else (name[:int(w / 7) - 2] + '..' if w > 28 else '')
+            rects.append(
+                f'<g><title>{html.escape(name)} ({node["value"]} samples, {node["value"] / total:.1%})</title>'
+                f'<rect x="{x:.1f}" y="{y}" width="{w:.1f}" height="{row - 1}" fill="{fill}"/>'
+                f'<text x="{x + 3:.1f}" y="{y + row - 4}">{html.escape(label)}</text></g>'
+            )
+            child_x = x
+            for child_name, child in sorted(node['children'].items()):
+                walk(child_name, child, child_x, depth + 1, category)
+                child_x += child['value'] / total * width
+
+        walk('all', tree, 0.0, 0, None)
+        with open(path, 'w', encoding='utf-8') as f:
+            f.write(f'<svg xmlns="http://www.w3.org/2000/svg" width="{width}" height="{height}" '
+                    f'font-family="monospace" font-size="11">\n')
+            f.write('\n'.join(rects))
+            f.write('\n</svg>\n')
+
+
+# Instância única usada pelos pontos de entrada e pelas etapas
+profiler = StageProfiler()
@@ -7,13 +7,21 @@ Otimiza descrições de produtos para melhor descoberta de preços.
 import pandas as pd
 import os
 import logging
+import threading
 from datetime import datetime
-from typing import List
-from dataclasses import dataclass
+from typing import Dict, List, Optional, Tuple
+from dataclasses import dataclass, replace
 from dotenv import load_dotenv
 
+from busca_precos_basica import PriceDiscoverySystem, CostTracker, SingleFlight
+from perfilamento import profiler
+from prompts import (OPTIMIZER_PROMPT_VERSION, OPTIMIZER_ROLE, OPTIMIZER_GOAL, OPTIMIZER_BACKSTORY,
+                     OPTIMIZER_EXPECTED_OUTPUT, OPTIMIZER_MODEL, OPTIMIZER_COMPLETION_TOKENS, optimizer_task_prompt,
+                     optimizer_prompt_tokens)
+from provedores import Provider, ProviderRouter
+
 # CrewAI imports
-from crewai import Agent, Task, Crew, Process
+from crewai import Agent, Task, Crew, Process, LLM
 
 # Load environment variables
 load_dotenv()
@@ -22,113 +30,206 @@ load_dotenv()
 logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s')
 logger = logging.getLogger(__name__)
 
+# Nota dos itens que ficaram sem IA por falta de orçamento (otimizados de novo na próxima execução)
+BUDGET_FALLBACK_NOTE = "Otimização básica (orçamento esgotado)"
+
 @dataclass
 class ItemResult:
     """Resultado do processamento de um item"""
     original: str
     optimized: str
     notes: str
+    category: Optional[str] = None
+    quantity: Optional[float] = None
+    prompt_tokens: Optional[int] = None  # tokens da chamada ao LLM (None sem chamada própria)
+    completion_tokens: Optional[int] = None
+    cached_tokens: Optional[int] = None  # parte do prompt servida pelo cache do provedor
+    prompt_version: Optional[str] = None  # versão do prompt usada (ver prompts.py)
+    provider: Optional[str] = None  # provedor do LLM que respondeu (ver provedores.py)
 
 class SmartPreprocessor:
     """Sistema inteligente de pré-processamento com CrewAI"""
 
-    def __init__(self):
-        """Inicializa o sistema"""
+    # Modelo usado pelos agentes e tamanho típico das respostas (ver prompts.py)
+    LLM_MODEL = OPTIMIZER_MODEL
+    TYPICAL_COMPLETION_TOKENS = OPTIMIZER_COMPLETION_TOKENS
+
+    def __init__(self, cost_tracker: Optional[CostTracker] = None, providers: Optional[ProviderRouter] = None):
+        """
+        Inicializa o sistema
+
+        Args:
+            cost_tracker: Contabiliza tokens/custo da execução (orçamento opcional)
+            providers: Backends do LLM roteados por latência/erro com failover
+                (padrão: LLM_PROVIDERS, ou OpenAI com OPENAI_API_KEY)
+        """
         api_key = os.getenv('OPENAI_API_KEY')
-        if not api_key:
+        if not api_key and providers is None and not os.getenv('LLM_PROVIDERS'):
             raise ValueError("OPENAI_API_KEY não encontrada nas variáveis de ambiente")
 
-        # Agente especialista em otimização de produtos brasileiros
-        self.optimizer_agent = Agent(
-            role="Especialista em E-commerce Brasileiro",
-            goal="Otimizar descrições de produtos para busca em e-commerces brasileiros",
-            backstory="""Você é um especialista em terminologia de e-commerce brasileiro.
-            Sua missão é reescrever descrições de produtos para maximizar a precisão
-            das buscas, mantendo o significado original e usando termos que consumidores
-            brasileiros realmente pesquisam.""",
+        self.router = providers or ProviderRouter.from_env(
+            'LLM_PROVIDERS',
+            [Provider('openai', os.getenv('OPENAI_API_BASE'), api_key, model=self.LLM_MODEL)]
+        )
+
+        # Um agente especialista por provedor; as regras ficam no backstory
+        # (prefixo fixo) e cada tarefa leva só o item
+        self.agents = {provider.name: self._build_agent(provider) for provider in self.router.providers}
+
+        # Cache de itens já otimizados (compartilhado entre arquivos no modo servidor)
+        self._cache: Dict[Tuple[str, Optional[str]], ItemResult] = {}
+        self._cache_lock = threading.Lock()
+
+        # Custo das chamadas ao LLM
+        self.cost_tracker = cost_tracker or CostTracker()
+
+        # Otimizações idênticas em andamento ao mesmo tempo compartilham uma chamada
+        self.optimize_flight = SingleFlight()
+
+    def _build_agent(self, provider: Provider) -> Agent:
+        """Agente de otimização ligado ao LLM de um provedor"""
+        llm = LLM(
+            model=provider.model or self.LLM_MODEL,
+            base_url=provider.url,
+            api_key=provider.api_key or 'local'  # endpoints locais não exigem chave
+        )
+        return Agent(
+            role=OPTIMIZER_ROLE,
+            goal=OPTIMIZER_GOAL,
+            backstory=OPTIMIZER_BACKSTORY,
+            llm=llm,
             verbose=False
         )
 
-    def _read_excel(self, file_path: str) -> List[str]:
-        """Lê arquivo Excel e extrai itens"""
+    @classmethod
+    def build_prompt(cls, item: str, category: Optional[str] = None) -> str:
+        """Descrição da tarefa de otimização de um item (sufixo mínimo por item)"""
+        return optimizer_task_prompt(item, category)
+
+    @classmethod
+    def estimate_prompt_tokens(cls, item: str, category: Optional[str] = None) -> int:
+        """Tokens estimados de uma chamada de otimização"""
+        return optimizer_prompt_tokens(item, category)
+
+    def _read_excel(self, file_path: str) -> List[Tuple[str, Optional[str], Optional[float]]]:
+        """Lê arquivo Excel e extrai itens com suas categorias e quantidades"""
         df = pd.read_excel(file_path)
 
         # Encontra coluna de produtos
-        possible_columns = ['Item', 'item', 'Produto', 'produto', 'Descrição', 'descrição']
-        product_column = None
+        product_column = PriceDiscoverySystem._find_item_column(df)
 
-        for col in df.columns:
-            if col in possible_columns or any(term in str(col).lower() for term in ['item', 'produto', 'descri']):
-                product_column = col
-                break
+        # Coluna de categoria (opcional)
+        category_column = PriceDiscoverySystem._find_category_column(df)
 
-        if not product_column:
-            product_column = df.columns[0]
+        # Coluna de quantidade (opcional, usada na priorização da busca de preços)
+        quantity_column = PriceDiscoverySystem._find_quantity_column(df)
 
         # Extrai e limpa itens
         items = []
         for _, row in df.iterrows():
             item = str(row[product_column]).strip()
             if item and item.lower() not in ['nan', 'none', '']:
-                items.append(item)
+                category = PriceDiscoverySystem._clean_category(row[category_column]) if category_column else None
+                quantity = PriceDiscoverySystem._clean_quantity(row[quantity_column]) if quantity_column else None
+                items.append((item, category, quantity))
 
         logger.info(f"📊 Extraídos {len(items)} itens da coluna '{product_column}'")
+        if category_column:
+            logger.info(f"🗂️ Categorias lidas da coluna '{category_column}'")
         return items
 
-    def _optimize_item(self, item: str) -> ItemResult:
+    def _optimize_item(self, item: str, category: Optional[str] = None) -> ItemResult:
         """Otimiza um item usando IA"""
 
-        task = Task(
-            description=f"""
-            Otimize esta descrição de produto para busca em e-commerce brasileiro:
-            "{item}"
-
-            Regras:
-            1. Mantenha o significado original
-            2. Use terminologia brasileira padrão
-            3. Adicione contexto se necessário (ex: "mouse" → "mouse para computador")
-            4. Padronize termos (ex: "micro ondas" → "microondas")
-            5. Remova detalhes desnecessários de projeto
-            6. Máximo 8 palavras
-
-            Retorne apenas a descrição otimizada, sem explicações.
-            """,
-            agent=self.optimizer_agent,
-            expected_output="Descrição otimizada do produto"
-        )
-
-        crew = Crew(
-            agents=[self.optimizer_agent],
-            tasks=[task],
-            process=Process.sequential,
-            verbose=False
-        )
-
-        try:
-            result = crew.kickoff()
-            optimized = str(result).strip().strip('"\'')
-
-            # Fallback: se a IA não otimizou bem, usa regras básicas
-            if len(optimized) > 100 or not optimized:
-                optimized = self._basic_optimization(item)
-                notes = "Otimização básica aplicada"
-            else:
-                notes = "Otimizado por IA"
+        cache_key = (item.strip().lower(), category)
+        with self._cache_lock:
+            cached = self._cache.get(cache_key)
+        if cached:
+            return self._reused(cached, item)
 
+        # Orçamento esgotado: otimização básica, sem custo
+        prompt_tokens = self.estimate_prompt_tokens(item, category)
+        estimate = CostTracker.cost(self.LLM_MODEL, prompt_tokens, self.TYPICAL_COMPLETION_TOKENS)
+        if not self.cost_tracker.can_spend(estimate):
             return ItemResult(
                 original=item,
-                optimized=optimized,
-                notes=notes
+                optimized=self._basic_optimization(item),
+                notes=BUDGET_FALLBACK_NOTE,
+                category=category
             )
 
+        try:
+            # Chamadas simultâneas para o mesmo item esperam a primeira (erros incluídos)
+            result, called = self.optimize_flight.call(cache_key, self._optimize_with_llm, item, category, prompt_tokens)
         except Exception as e:
             logger.warning(f"Erro na otimização IA para '{item}': {e}")
             return ItemResult(
                 original=item,
                 optimized=self._basic_optimization(item),
-                notes="Otimização básica (erro na IA)"
+                notes="Otimização básica (erro na IA)",
+                category=category
             )
 
+        with self._cache_lock:
+            self._cache[cache_key] = result
+        return replace(result, original=item) if called else self._reused(result, item)
+
+    @staticmethod
+    def _reused(result: ItemResult, item: str) -> ItemResult:
+        """Resultado de outra chamada aplicado a um item (sem tokens próprios)"""
+        return replace(result, original=item, prompt_tokens=None, completion_tokens=None, cached_tokens=None)
+
+    def _optimize_with_llm(self, item: str, category: Optional[str], prompt_tokens: int) -> ItemResult:
+        """
+        Uma chamada ao agente CrewAI no provedor escolhido pelo roteador, com
+        failover para os demais (se todos falharem, a exceção sobe para quem chamou)
+        """
+        result, provider = self.router.call(lambda provider: self._kickoff(provider, item, category))
+        usage = getattr(result, 'token_usage', None)
+        prompt_tokens = getattr(usage, 'prompt_tokens', 0) or prompt_tokens
+        completion_tokens = getattr(usage, 'completion_tokens', 0) or self.TYPICAL_COMPLETION_TOKENS
+        cached_tokens = getattr(usage, 'cached_prompt_tokens', 0) or 0
+        self.cost_tracker.record(provider.model or self.LLM_MODEL, prompt_tokens, completion_tokens, cached_tokens)
+        logger.debug(f"   {provider.name}: {prompt_tokens} tokens de prompt ({cached_tokens} em cache) "
+                     f"+ {completion_tokens} de resposta")
+        optimized = str(result).strip().strip('"\'')
+
+        # Fallback: se a IA não otimizou bem, usa regras básicas
+        if len(optimized) > 100 or not optimized:
+            optimized = self._basic_optimization(item)
+            notes = "Otimização básica aplicada"
+        else:
+            notes = "Otimizado por IA"
+
+        return ItemResult(
+            original=item,
+            optimized=optimized,
+            notes=notes,
+            category=category,
+            prompt_tokens=prompt_tokens,
+            completion_tokens=completion_tokens,
+            cached_tokens=cached_tokens,
+            prompt_version=OPTIMIZER_PROMPT_VERSION,
+            provider=provider.name
+        )
+
+    def _kickoff(self, provider: Provider, item: str, category: Optional[str]):
+        """Executa a tarefa de otimização com o agente de um provedor"""
+        agent = self.agents[provider.name]
+        task = Task(
+            description=self.build_prompt(item, category),
+            agent=agent,
+            expected_output=OPTIMIZER_EXPECTED_OUTPUT
+        )
+
+        crew = Crew(
+            agents=[agent],
+            tasks=[task],
+            process=Process.sequential,
+            verbose=False
+        )
+        return crew.kickoff()
+
     def _basic_optimization(self, item: str) -> str:
         """Otimização básica sem IA"""
         import re
@@ -158,32 +259,68 @@ class SmartPreprocessor:
 
         return optimized
 
+    def load_previous(self, file_path: str) -> int:
+        """
+        Reaproveita as otimizações de um arquivo salvo por uma execução anterior,
+        menos as básicas por orçamento esgotado (que voltam a ser otimizadas)
+        """
+        df = pd.read_excel(file_path, sheet_name='Resultados_Completos')
+        loaded = 0
+        with self._cache_lock:
+            for row in df.to_dict('records'):
+                if row['Notas'] == BUDGET_FALLBACK_NOTE:
+                    continue
+                category = None if pd.isna(row.get('Categoria')) else row['Categoria']
+                self._cache[(str(row['Item_Original']).strip().lower(), category)] = ItemResult(
+                    original=row['Item_Original'],
+                    optimized=row['Item_Otimizado'],
+                    notes=row['Notas'],
+                    category=category,
+                    prompt_version=None if pd.isna(row.get('Versao_Prompt')) else row['Versao_Prompt'],
+                    provider=None if pd.isna(row.get('Provedor')) else row['Provedor']
+                )
+                loaded += 1
+        logger.info(f"♻️ {loaded} otimizações reaproveitadas de {file_path}")
+        return loaded
+
     def process_file(self, input_file: str, output_file: str) -> List[ItemResult]:
         """Processa arquivo Excel completo"""
         logger.info(f"🤖 Iniciando pré-processamento inteligente: {input_file}")
 
         # Lê itens
-        items = self._read_excel(input_file)
+        with profiler.stage('load_input'):
+            items = self._read_excel(input_file)
 
-        # Processa cada item
-        results = []
-        for i, item in enumerate(items):
-            logger.info(f"✨ [{i+1}/{len(items)}] Otimizando: {item[:40]}...")
+        # Processa itens agrupados por categoria/marca/tipo de produto
+        order = PriceDiscoverySystem._schedule_by_category([(item, category) for item, category, _ in items])
+        results: List[Optional[ItemResult]] = [None] * len(items)
+        with profiler.stage('optimize'):
+            for i, idx in enumerate(order):
+                item, category, quantity = items[idx]
+                logger.info(f"✨ [{i+1}/{len(items)}] Otimizando: {item[:40]}...")
 
-            result = self._optimize_item(item)
-            results.append(result)
+                result = replace(self._optimize_item(item, category), quantity=quantity)
+                results[idx] = result
 
-            if result.optimized != result.original:
-                logger.info(f"   → {result.optimized}")
+                if result.optimized != result.original:
+                    logger.info(f"   → {result.optimized}")
 
         # Salva resultados
-        self._save_results(results, output_file)
+        with profiler.stage('save_results'):
+            self._save_results(results, output_file)
 
         # Estatísticas
         optimized_count = sum(1 for r in results if r.optimized != r.original)
         logger.info(f"\n📊 Processamento concluído:")
         logger.info(f"   Total: {len(results)} itens")
         logger.info(f"   Otimizados: {optimized_count} ({optimized_count/len(results)*100:.1f}%)")
+        spend = self.cost_tracker.summary()
+        logger.info(f"   Custo LLM: ${spend['spent_usd']:.4f} ({spend['prompt_tokens']} + {spend['completion_tokens']} tokens, "
+                    f"{spend['cached_tokens']} em cache, prompt {OPTIMIZER_PROMPT_VERSION})")
+        flight = self.optimize_flight.stats()
+        if flight['coalesced']:
+            logger.info(f"   Chamadas agrupadas: {flight['coalesced']} (aguardaram uma otimização em andamento)")
+        self.router.log_summary('LLM')
         logger.info(f"   Arquivo salvo: {output_file}")
 
         return results
@@ -195,10 +332,21 @@ class SmartPreprocessor:
             data.append({
                 'Item_Original': result.original,
                 'Item_Otimizado': result.optimized,
-                'Notas': result.notes
+                'Notas': result.notes,
+                'Categoria': result.category,
+                'Quantidade': result.quantity,
+                'Tokens_Prompt': result.prompt_tokens,
+                'Tokens_Resposta': result.completion_tokens,
+                'Tokens_Cache': result.cached_tokens,
+                'Versao_Prompt': result.prompt_version,
+                'Provedor': result.provider
             })
 
         df = pd.DataFrame(data)
+        for col in ['Tokens_Prompt', 'Tokens_Resposta', 'Tokens_Cache']:
+            df[col] = df[col].astype('Int64')
+        if df['Quantidade'].isna().all():
+            df = df.drop(columns='Quantidade')
 
         # Cria arquivo com múltiplas abas
         with pd.ExcelWriter(output_file, engine='openpyxl') as writer:
@@ -206,12 +354,19 @@ class SmartPreprocessor:
             df.to_excel(writer, sheet_name='Resultados_Completos', index=False)
 
             # Apenas itens otimizados (para descoberta de preços)
-            optimized_df = df[['Item_Otimizado']].copy()
+            optimized_df = df[[col for col in ['Item_Otimizado', 'Categoria', 'Quantidade'] if col in df.columns]].copy()
             optimized_df.rename(columns={'Item_Otimizado': 'Item'}, inplace=True)
             optimized_df.to_excel(writer, sheet_name='Itens_Otimizados', index=False)
 
 def main():
     """Função principal"""
+    import argparse
+
+    parser = argparse.ArgumentParser(description='Pré-processamento inteligente com CrewAI')
+    parser.add_argument('--profile', nargs='?', const=os.getenv('PROFILE_DIR', 'profiles'), metavar='DIR',
+                        help='Perfila cada etapa e grava flame graphs em DIR (padrão: PROFILE_DIR ou profiles)')
+    args = parser.parse_args()
+
     INPUT_FILE = os.getenv('INPUT_FILE', 'lista.xlsx')
     OUTPUT_FILE = f"Itens_Otimizados_{datetime.now().strftime('%Y%m%d_%H%M%S')}.xlsx"
 
@@ -219,6 +374,9 @@ def main():
         logger.error(f"❌ Arquivo não encontrado: {INPUT_FILE}")
         return
 
+    if args.profile:
+        profiler.start(args.profile, label='preprocessamento')
+
     try:
         processor = SmartPreprocessor()
         processor.process_file(INPUT_FILE, OUTPUT_FILE)
@@ -226,6 +384,8 @@ def main():
 
     except Exception as e:
         logger.error(f"❌ Erro no processamento: {e}")
+    finally:
+        profiler.stop()
 
 if __name__ == "__main__":
     main()
@@ -0,0 +1,88 @@
+#!/usr/bin/env python3
+"""
+Prompts Versionados
+Textos enviados aos modelos, divididos em um prefixo fixo (mensagem de sistema
+da busca, papel/objetivo/história do agente de otimização), igual em todas as
+chamadas e aproveitável pelo cache de prompt do provedor, e um sufixo mínimo
+por item. Também ficam aqui as estimativas de tokens desses prompts, usadas
+pelo planejamento (--plan) sem precisar do CrewAI instalado.
+
+Toda mudança de texto deve vir com uma nova versão: as versões entram na chave
+dos resultados guardados em disco (Preprocessed_Items_*, Price_Results_*), que
+assim são refeitos com o prompt novo.
+"""
+
+import os
+from typing import Optional
+
+# Tokens estimados por caracteres (sem dependência de tokenizador)
+CHARS_PER_TOKEN = 4
+
+
+def estimate_tokens(text: str) -> int:
+    """Contagem aproximada de tokens de um prompt"""
+    return max(1, len(text) // CHARS_PER_TOKEN)
+
+
+# Busca de preços (Perplexity)
+SEARCH_PROMPT_VERSION = 'busca-v2'
+
+SEARCH_SYSTEM_PROMPT = """Você encontra o menor preço atual de produtos no Brasil.
+
+Requisitos:
+- Busque apenas em sites brasileiros de e-commerce
+- Retorne apenas se encontrar um preço específico e confiável
+- Formato da resposta: JSON com price (número), store (nome da loja), url (link do produto), confidence (0-1)
+
+Exemplo: {"price": 299.90, "store": "Mercado Livre", "url": "https://...", "confidence": 0.95}"""
+
+
+def search_user_prompt(simplified_item: str) -> str:
+    """Parte da busca que muda a cada item"""
+    return f'Produto: "{simplified_item}"'
+
+
+# Otimização de descrições (agente CrewAI)
+OPTIMIZER_PROMPT_VERSION = 'otimizacao-v2'
+
+# Modelo usado pelos agentes (padrão do CrewAI) e tamanho típico das respostas
+OPTIMIZER_MODEL = os.getenv('OPENAI_MODEL_NAME', 'gpt-4o-mini')
+OPTIMIZER_COMPLETION_TOKENS = 20
+# Texto fixo que o CrewAI acrescenta a cada tarefa (formato da resposta, moldura do agente)
+CREWAI_OVERHEAD_TOKENS = 150
+
+OPTIMIZER_ROLE = "Especialista em E-commerce Brasileiro"
+
+OPTIMIZER_GOAL = "Otimizar descrições de produtos para busca em e-commerces brasileiros"
+
+OPTIMIZER_BACKSTORY = """Você é um especialista em terminologia de e-commerce brasileiro.
+Sua missão é reescrever descrições de produtos para maximizar a precisão
+das buscas, mantendo o significado original e usando termos que consumidores
+brasileiros realmente pesquisam.
+
+Regras para cada descrição:
+1. Mantenha o significado original
+2. Use terminologia brasileira padrão
+3. Adicione contexto se necessário (ex: "mouse" → "mouse para computador")
+4. Padronize termos (ex: "micro ondas" → "microondas")
+5. Remova detalhes desnecessários de projeto
+6. Máximo 8 palavras
+
+Retorne apenas a descrição otimizada, sem explicações."""
+
+OPTIMIZER_EXPECTED_OUTPUT = "Descrição otimizada do produto"
+
+
+def optimizer_task_prompt(item: str, category: Optional[str] = None) -> str:
+    """Parte da otimização que muda a cada item"""
+    category_context = f"Categoria: {category}\n" if category else ""
+    return f'{category_context}Otimize: "{item}"'
+
+
+# Prefixo do agente (role, goal, backstory), igual em todas as chamadas
+OPTIMIZER_AGENT_TOKENS = sum(estimate_tokens(text) for text in (OPTIMIZER_ROLE, OPTIMIZER_GOAL, OPTIMIZER_BACKSTORY))
+
+
+def optimizer_prompt_tokens(item: str, category: Optional[str] = None) -> int:
+    """Tokens estimados de uma chamada de otimização"""
+    return CREWAI_OVERHEAD_TOKENS + OPTIMIZER_AGENT_TOKENS + estimate_tokens(optimizer_task_prompt(item, category))
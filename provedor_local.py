@@ -0,0 +1,193 @@
+#!/usr/bin/env python3
+"""
+Provedor Local (stand-in)
+Endpoint chat/completions compatível com OpenAI/Perplexity para testar o
+roteamento entre provedores sem rede e sem custo: responde à busca de preços
+com um JSON de preço determinístico por produto, à otimização com a própria
+descrição, e serve as páginas de produto para a verificação de URLs. Latência e
+taxa de erro são configuráveis na linha de comando e podem ser mudadas com a
+execução em andamento (POST /control), para simular um provedor degradando.
+
+Exemplo (dois provedores locais, um lento e instável):
+    python provedor_local.py --port 8701
+    python provedor_local.py --port 8702 --latency 2 --error-rate 0.3
+    SEARCH_PROVIDERS="a|http://127.0.0.1:8701/chat/completions,b|http://127.0.0.1:8702/chat/completions" \\
+        python busca_precos_basica.py
+    curl -X POST localhost:8701/control -d '{"latency": 5, "error_rate": 1}'
+"""
+
+import re
+import json
+import time
+import zlib
+import random
+import logging
+import argparse
+import threading
+from http.server import ThreadingHTTPServer, BaseHTTPRequestHandler
+from typing import Any, Dict, List
+
+from prompts import SEARCH_SYSTEM_PROMPT
+
+logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s')
+logger = logging.getLogger(__name__)
+
+
+class StandInState:
+    """Comportamento simulado (ajustável ao vivo) e contadores"""
+
+    def __init__(self, latency: float, jitter: float, error_rate: float):
+        self.latency = latency
+        self.jitter = jitter
+        self.error_rate = error_rate
+        self.lock = threading.Lock()
+        self.requests = 0
+        self.errors = 0
+        self._seen_prefixes = set()
+
+    def cached_tokens(self, system_prompt: str) -> int:
+        """Simula cache de prompt: prefixo já visto conta como tokens em cache"""
+        with self.lock:
+            seen = system_prompt in self._seen_prefixes
+            self._seen_prefixes.add(system_prompt)
+        return len(system_prompt) // 4 if seen else 0
+
+
+def _search_answer(product: str, port: int) -> str:
+    """Preço determinístico por produto (mesmo produto, mesmo preço em todos os provedores)"""
+    cents = 5000 + zlib.crc32(product.lower().encode('utf-8')) % 500000
+    return json.dumps({
+        "price": cents / 100,
+        "store": "Loja Local",
+        "url": f"http://127.0.0.1:{port}/produto/{cents}",
+        "confidence": 0.9
+    })
+
+
+def _optimizer_answer(text: str) -> str:
+    """Resposta no formato do agente CrewAI: a própria descrição, no máximo 8 palavras"""
+    match = re.search(r'Otimize: "([^"]+)"', text)
+    description = ' '.join((match.group(1) if match else text.strip().splitlines()[-1]).split()[:8])
+    return f"Thought: I now can give a great answer\nFinal Answer: {description}"
+
+
+class StandInHandler(BaseHTTPRequestHandler):
+    """Rotas: POST */chat/completions, POST /control, GET /produto/<centavos>"""
+
+    state: StandInState = None
+
+    def log_message(self, format, *args):
+        logger.debug(format % args)
+
+    def _send_json(self, status: int, payload: Dict[str, Any]):
+        body = json.dumps(payload).encode('utf-8')
+        self.send_response(status)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def do_GET(self):
+        match = re.fullmatch(r'/produto/(\d+)', self.path)
+        if not match:
+            self._send_json(404, {'error': 'not found'})
+            return
+        price = f"{int(match.group(1)) / 100:,.2f}".replace(',', '_').replace('.', ',').replace('_', '.')
+        body = f"<html><body><h1>Produto</h1><p>Por R$ {price}</p></body></html>".encode('utf-8')
+        self.send_response(200)
+        self.send_header('Content-Type', 'text/html; charset=utf-8')
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def do_POST(self):
+        length = int(self.headers.get('Content-Length', 0))
+        try:
+            request = json.loads(self.rfile.read(length) or b'{}')
+        except json.JSONDecodeError:
+            self._send_json(400, {'error': 'invalid JSON'})
+            return
+
+        if self.path == '/control':
+            self._control(request)
+        elif self.path.rstrip('/').endswith('chat/completions'):
+            self._chat(request)
+        else:
+            self._send_json(404, {'error': 'not found'})
+
+    def _control(self, request: Dict[str, Any]):
+        state = self.state
+        with state.lock:
+            for field in ('latency', 'jitter', 'error_rate'):
+                if field in request:
+                    setattr(state, field, float(request[field]))
+            current = {'latency': state.latency, 'jitter': state.jitter, 'error_rate': state.error_rate,
+                       'requests': state.requests, 'errors': state.errors}
+        logger.info(f"🎛️ Control: {current}")
+        self._send_json(200, current)
+
+    def _chat(self, request: Dict[str, Any]):
+        state = self.state
+        with state.lock:
+            state.requests += 1
+            latency = max(0.0, state.latency + random.uniform(-state.jitter, state.jitter))
+            fail = random.random() < state.error_rate
+            if fail:
+                state.errors += 1
+        time.sleep(latency)
+        if fail:
+            self._send_json(503, {'error': {'message': 'simulated outage', 'type': 'server_error'}})
+            return
+
+        messages: List[Dict[str, Any]] = request.get('messages') or []
+        contents = [str(message.get('content') or '') for message in messages]
+        system = next((str(message.get('content') or '') for message in messages
+                       if message.get('role') == 'system'), '')
+        text = '\n'.join(contents)
+
+        if system == SEARCH_SYSTEM_PROMPT:
+            product = re.search(r'Produto: "([^"]+)"', contents[-1])
+            content = _search_answer(product.group(1) if product else contents[-1], self.server.server_port)
+        else:
+            content = _optimizer_answer(text)
+
+        self._send_json(200, {
+            'id': f"local-{state.requests}",
+            'object': 'chat.completion',
+            'created': int(time.time()),
+            'model': request.get('model', 'local'),
+            'choices': [{'index': 0, 'message': {'role': 'assistant', 'content': content},
+                         'finish_reason': 'stop'}],
+            'usage': {
+                'prompt_tokens': len(text) // 4,
+                'completion_tokens': len(content) // 4,
+                'total_tokens': len(text) // 4 + len(content) // 4,
+                'prompt_tokens_details': {'cached_tokens': state.cached_tokens(system) if system else 0}
+            }
+        })
+
+
+def main():
+    """Sobe um provedor local"""
+    parser = argparse.ArgumentParser(description='Provedor local (stand-in) para testes offline')
+    parser.add_argument('--host', default='127.0.0.1', help='Endereço (padrão: 127.0.0.1)')
+    parser.add_argument('--port', type=int, default=8701, help='Porta (padrão: 8701)')
+    parser.add_argument('--latency', type=float, default=0.2, help='Latência média (s) de cada resposta')
+    parser.add_argument('--jitter', type=float, default=0.05, help='Variação (s) da latência, para mais ou menos')
+    parser.add_argument('--error-rate', type=float, default=0.0, help='Fração das chamadas que falham com HTTP 503')
+    args = parser.parse_args()
+
+    StandInHandler.state = StandInState(args.latency, args.jitter, args.error_rate)
+    server = ThreadingHTTPServer((args.host, args.port), StandInHandler)
+    logger.info(f"🧪 Local provider on http://{args.host}:{args.port}/chat/completions "
+                f"(latency {args.latency}s, error rate {args.error_rate:.0%})")
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.server_close()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,287 @@
+#!/usr/bin/env python3
+"""
+Roteamento entre Provedores
+Camada de provedores das duas etapas que chamam modelos (busca de preços e
+otimização de descrições): vários backends/API keys por etapa, escolhidos a
+cada chamada pela latência e taxa de erro recentes (médias móveis
+exponenciais) e pela carga atual, com limite de chamadas simultâneas por
+provedor e failover automático para o próximo quando uma chamada falha. Um
+provedor com falhas seguidas fica de fora por um tempo e volta com uma chamada
+de teste; provedores ociosos também recebem chamadas de teste de tempos em
+tempos, para que suas estatísticas não fiquem velhas.
+
+Os provedores vêm de variáveis de ambiente (SEARCH_PROVIDERS, LLM_PROVIDERS),
+uma entrada por provedor separada por vírgula:
+
+    nome|url|chave|concorrência|modelo
+
+`chave` pode ser `$VARIAVEL` (lida do ambiente) ou vazia (endpoints locais);
+concorrência e modelo são opcionais. Para testar sem rede, aponte as URLs para
+instâncias de provedor_local.py.
+"""
+
+import os
+import time
+import logging
+import threading
+from typing import Any, Callable, Dict, List, Optional, Set, Tuple
+
+logger = logging.getLogger(__name__)
+
+
+class ProviderError(Exception):
+    """Resposta inválida de um provedor (HTTP != 200, corpo inesperado): tenta o próximo"""
+
+
+class RateLimiter:
+    """Minimum interval between API calls, shared by every thread using it"""
+
+    def __init__(self, min_interval: float):
+        self.min_interval = min_interval
+        self._lock = threading.Lock()
+        self._next_slot = 0.0
+
+    def wait(self):
+        """Block until the next call slot is available"""
+        with self._lock:
+            now = time.monotonic()
+            slot = max(now, self._next_slot)
+            self._next_slot = slot + self.min_interval
+        if slot > now:
+            time.sleep(slot - now)
+
+
+class Provider:
+    """Um backend (endpoint + API key) e suas estatísticas ao vivo"""
+
+    def __init__(self, name: str, url: Optional[str] = None, api_key: Optional[str] = None,
+                 concurrency: int = 4, model: Optional[str] = None, min_interval: float = 0.0):
+        """
+        Args:
+            name: Nome do provedor nos logs e relatórios
+            url: Endpoint (None usa o padrão do cliente)
+            api_key: Chave enviada ao endpoint (None para endpoints locais)
+            concurrency: Chamadas simultâneas permitidas neste provedor
+            model: Modelo usado neste provedor (None mantém o pedido pela chamada)
+            min_interval: Intervalo mínimo (s) entre chamadas com esta chave
+        """
+        if concurrency < 1:
+            raise ValueError(f"Provider '{name}': concurrency must be >= 1")
+        self.name = name
+        self.url = url
+        self.api_key = api_key
+        self.concurrency = concurrency
+        self.model = model
+        self.rate_limiter = RateLimiter(min_interval)
+
+        # Estado mantido pelo ProviderRouter (sob o lock dele)
+        self.latency_s: Optional[float] = None  # média móvel exponencial das chamadas bem-sucedidas
+        self.error_rate = 0.0                   # média móvel exponencial de falhas (0-1)
+        self.in_flight = 0
+        self.calls = 0
+        self.failures = 0
+        self.consecutive_failures = 0
+        self.cooldown_until = 0.0
+        self.last_used = 0.0
+
+    def __repr__(self) -> str:
+        return f"Provider({self.name}, {self.url or 'default'}, concurrency={self.concurrency})"
+
+
+def parse_providers(spec: str, default_concurrency: int = 4, min_interval: float = 0.0) -> List[Provider]:
+    """Parse "nome|url|chave|concorrência|modelo,..." (chave `$VAR` é lida do ambiente)"""
+    providers = []
+    for entry in spec.split(','):
+        entry = entry.strip()
+        if not entry:
+            continue
+        fields = [field.strip() for field in entry.split('|')]
+        if not fields[0] or len(fields) > 5:
+            raise ValueError(f"Invalid provider '{entry}' (use name|url|key|concurrency|model)")
+        name, url, key, concurrency, model = fields + [''] * (5 - len(fields))
+        if key.startswith('$'):
+            key = os.getenv(key[1:], '')
+        try:
+            concurrency = int(concurrency) if concurrency else default_concurrency
+        except ValueError:
+            raise ValueError(f"Invalid concurrency in provider '{entry}'")
+        providers.append(Provider(name, url or None, key or None, concurrency, model or None, min_interval))
+
+    names = [provider.name for provider in providers]
+    if not providers:
+        raise ValueError("No providers configured")
+    if len(set(names)) != len(names):
+        raise ValueError(f"Duplicate provider names in '{spec}'")
+    return providers
+
+
+def share_providers(spec: str, workers: int, default_concurrency: int = 4) -> str:
+    """
+    Spec de um entre `workers` processos que usam os mesmos provedores (shards):
+    a concorrência de cada provedor é dividida entre eles (mínimo 1), para que
+    juntos não passem do limite de cada chave. O intervalo mínimo entre
+    chamadas deve ser multiplicado por `workers` por quem lança os processos.
+    """
+    parse_providers(spec, default_concurrency)  # valida antes de repassar
+    entries = []
+    for entry in spec.split(','):
+        fields = [field.strip() for field in entry.strip().split('|')]
+        if not fields[0]:
+            continue
+        fields += [''] * (5 - len(fields))
+        concurrency = int(fields[3]) if fields[3] else default_concurrency
+        fields[3] = str(max(1, concurrency // workers))
+        entries.append('|'.join(fields).rstrip('|'))
+    return ','.join(entries)
+
+
+class ProviderRouter:
+    """Escolhe o provedor de cada chamada e faz failover entre eles"""
+
+    def __init__(self, providers: List[Provider], alpha: float = 0.3, failure_threshold: int = 3,
+                 cooldown_s: float = 30.0, probe_after_s: float = 15.0, initial_latency_s: float = 1.0):
+        """
+        Args:
+            providers: Backends disponíveis (a ordem desempata provedores sem histórico)
+            alpha: Peso da chamada mais recente nas médias móveis de latência e erro
+            failure_threshold: Falhas seguidas que tiram um provedor de rotação
+            cooldown_s: Tempo fora de rotação antes da chamada de teste
+            probe_after_s: Provedor sem chamadas há mais que isso recebe a próxima (teste)
+            initial_latency_s: Latência assumida antes da primeira chamada
+        """
+        if not providers:
+            raise ValueError("ProviderRouter needs at least one provider")
+        self.providers = list(providers)
+        self.alpha = alpha
+        self.failure_threshold = failure_threshold
+        self.cooldown_s = cooldown_s
+        self.probe_after_s = probe_after_s
+        self.initial_latency_s = initial_latency_s
+        self.failovers = 0
+        self._condition = threading.Condition()
+
+    @classmethod
+    def from_env(cls, variable: str, default: List[Provider], min_interval: float = 0.0) -> 'ProviderRouter':
+        """
+        Roteador com os provedores de `variable` (ou `default` se não definida),
+        ajustado por ROUTER_EWMA_ALPHA, ROUTER_FAILURE_THRESHOLD e ROUTER_COOLDOWN_S
+        """
+        spec = os.getenv(variable)
+        providers = parse_providers(spec, min_interval=min_interval) if spec else default
+        return cls(
+            providers,
+            alpha=float(os.getenv('ROUTER_EWMA_ALPHA', '0.3')),
+            failure_threshold=int(os.getenv('ROUTER_FAILURE_THRESHOLD', '3')),
+            cooldown_s=float(os.getenv('ROUTER_COOLDOWN_S', '30'))
+        )
+
+    def _score(self, provider: Provider) -> float:
+        """Custo esperado de mandar a próxima chamada ao provedor (menor é melhor)"""
+        latency = provider.latency_s if provider.latency_s is not None else self.initial_latency_s
+        load = 1 + provider.in_flight / provider.concurrency
+        return latency * load / max(0.05, 1 - provider.error_rate)
+
+    def _acquire(self, tried: Set[str]) -> Optional[Provider]:
+        """Reserva uma vaga no melhor provedor ainda não tentado (espera se todos estão cheios)"""
+        with self._condition:
+            while True:
+                candidates = [provider for provider in self.providers if provider.name not in tried]
+                if not candidates:
+                    return None
+                now = time.monotonic()
+                # Todos fora de rotação: melhor tentar do que falhar sem chamar
+                active = [provider for provider in candidates if provider.cooldown_until <= now] or candidates
+                free = [provider for provider in active if provider.in_flight < provider.concurrency]
+                if free:
+                    stale = [provider for provider in free if now - provider.last_used >= self.probe_after_s]
+                    provider = min(stale or free, key=self._score)
+                    provider.in_flight += 1
+                    provider.last_used = now
+                    return provider
+                self._condition.wait()
+
+    def _release(self, provider: Provider, latency: float, ok: bool):
+        """Libera a vaga e atualiza as médias móveis do provedor"""
+        paused = False
+        with self._condition:
+            provider.in_flight -= 1
+            provider.calls += 1
+            provider.error_rate += self.alpha * ((0.0 if ok else 1.0) - provider.error_rate)
+            if ok:
+                provider.consecutive_failures = 0
+                provider.latency_s = (latency if provider.latency_s is None
+                                      else provider.latency_s + self.alpha * (latency - provider.latency_s))
+            else:
+                provider.failures += 1
+                provider.consecutive_failures += 1
+                # Timeouts também são lentidão; falhas rápidas não baixam a latência
+                # (nem a semeiam abaixo da assumida para provedores sem histórico)
+                if provider.latency_s is None:
+                    provider.latency_s = max(latency, self.initial_latency_s)
+                elif latency > provider.latency_s:
+                    provider.latency_s += self.alpha * (latency - provider.latency_s)
+                if provider.consecutive_failures >= self.failure_threshold:
+                    now = time.monotonic()
+                    paused = provider.cooldown_until <= now  # só avisa ao sair de rotação
+                    provider.cooldown_until = now + self.cooldown_s
+            self._condition.notify_all()
+        if paused:
+            logger.warning(f"⏸️ Provider {provider.name} paused for {self.cooldown_s:.0f}s "
+                           f"after {provider.consecutive_failures} consecutive failures")
+
+    def call(self, function: Callable[[Provider], Any]) -> Tuple[Any, Provider]:
+        """
+        Executa function(provider) no melhor provedor; se ela levantar exceção,
+        tenta o próximo até esgotar os provedores (aí a última exceção sobe).
+
+        Returns:
+            (resultado de function, provedor que respondeu)
+        """
+        tried: Set[str] = set()
+        last_error: Optional[Exception] = None
+        while True:
+            provider = self._acquire(tried)
+            if provider is None:
+                raise last_error
+            if last_error is not None:
+                with self._condition:
+                    self.failovers += 1
+            tried.add(provider.name)
+
+            provider.rate_limiter.wait()
+            started = time.perf_counter()
+            try:
+                result = function(provider)
+            except Exception as e:
+                self._release(provider, time.perf_counter() - started, ok=False)
+                logger.warning(f"🔀 Provider {provider.name} failed: {e}")
+                last_error = e
+                continue
+            self._release(provider, time.perf_counter() - started, ok=True)
+            return result, provider
+
+    def stats(self) -> List[Dict[str, Any]]:
+        """Estado de cada provedor (para logs, relatórios e /health)"""
+        with self._condition:
+            now = time.monotonic()
+            return [{
+                'provider': provider.name,
+                'calls': provider.calls,
+                'failures': provider.failures,
+                'ewma_latency_s': round(provider.latency_s, 3) if provider.latency_s is not None else None,
+                'ewma_error_rate': round(provider.error_rate, 3),
+                'in_flight': provider.in_flight,
+                'paused': provider.cooldown_until > now
+            } for provider in self.providers]
+
+    def log_summary(self, label: str):
+        """Uma linha por provedor; só quando há mais de um ou houve falhas"""
+        stats = self.stats()
+        if len(stats) < 2 and not any(entry['failures'] for entry in stats):
+            return
+        logger.info(f"🔀 {label} providers ({self.failovers} failovers):")
+        for entry in stats:
+            latency = f"{entry['ewma_latency_s']:.2f}s" if entry['ewma_latency_s'] is not None else "n/a"
+            logger.info(f"   {entry['provider']}: {entry['calls']} calls, {entry['failures']} failures, "
+                        f"latency {latency}, error rate {entry['ewma_error_rate']:.0%}"
+                        + (" (paused)" if entry['paused'] else ""))
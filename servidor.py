@@ -0,0 +1,341 @@
+#!/usr/bin/env python3
+"""
+Modo Serviço - API HTTP local para descoberta de preços
+Mantém o sistema de preços, o pré-processador e seus caches carregados
+entre requisições, evitando o custo de inicialização a cada execução.
+
+Endpoints:
+    GET  /health                 Estado do serviço e dos caches
+    GET  /item?q=...&categoria=  Preço de um único item
+    POST /item                   Idem, corpo JSON {"item": "...", "categoria": "..."}
+    POST /jobs?force_reprocess=1 Envia uma planilha (corpo = bytes do .xlsx)
+    GET  /jobs/<id>              Consulta o andamento de um job
+    GET  /jobs/<id>/report       Baixa o relatório final de um job concluído
+"""
+
+import os
+import json
+import uuid
+import logging
+import argparse
+import threading
+from dataclasses import asdict
+from datetime import datetime
+from typing import Dict, Any, Optional
+from concurrent.futures import ThreadPoolExecutor
+from http.server import ThreadingHTTPServer, BaseHTTPRequestHandler
+from urllib.parse import urlparse, parse_qs
+from dotenv import load_dotenv
+
+from busca_precos_basica import PriceDiscoverySystem, DEFAULT_SEARCH_TIERS, parse_search_tiers
+from busca_precos_completa import IntelligentPriceDiscoverySystem
+from historico_precos import PriceHistoryStore
+from similaridade import SimilarityIndex
+from catalogo import CatalogIndex
+from verificacao import ResultVerifier
+
+# Load environment variables
+load_dotenv(override=True)
+
+# Configure logging
+logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s')
+logger = logging.getLogger(__name__)
+
+XLSX_CONTENT_TYPE = 'application/vnd.openxmlformats-officedocument.spreadsheetml.sheet'
+
+
+class PriceDiscoveryService:
+    """Estado compartilhado do serviço: sistemas aquecidos, caches e fila de jobs"""
+
+    def __init__(self, jobs_dir: str = 'jobs', workers: int = 2, cache_ttl: Optional[float] = None,
+                 max_age_days: Optional[float] = None, similarity_threshold: float = 0.8):
+        """
+        Args:
+            jobs_dir: Diretório onde cada job guarda entrada, caches e relatório
+            workers: Número de jobs de planilha executados em paralelo
+            cache_ttl: Validade (s) dos preços no cache de itens
+            max_age_days: Reaproveita observações do histórico mais novas que isso
+            similarity_threshold: Reaproveita preços de itens quase idênticos (0 desativa)
+        """
+        api_key = os.getenv('PERPLEXITY_API_KEY')
+        if not api_key and not os.getenv('SEARCH_PROVIDERS'):
+            raise ValueError("PERPLEXITY_API_KEY não encontrada nas variáveis de ambiente")
+
+        self.jobs_dir = jobs_dir
+        os.makedirs(jobs_dir, exist_ok=True)
+
+        # Sistemas compartilhados entre todas as requisições e jobs
+        self.history = PriceHistoryStore(os.getenv('PRICE_HISTORY_DB', 'price_history.db'))
+        self.price_system = PriceDiscoverySystem(
+            api_key,
+            cache_ttl=cache_ttl,
+            history=self.history,
+            max_age_days=max_age_days,
+            min_confidence=float(os.getenv('REFRESH_MIN_CONFIDENCE', '0.7')),
+            similarity=(
+                SimilarityIndex(similarity_threshold, brands=PriceDiscoverySystem.BRAND_INDICATORS)
+                if similarity_threshold > 0 else None
+            ),
+            search_tiers=parse_search_tiers(os.getenv('SEARCH_TIERS', DEFAULT_SEARCH_TIERS)),
+            escalation_confidence=float(os.getenv('ESCALATION_CONFIDENCE', '0.7')),
+            catalog=self._load_catalog(),
+            catalog_min_score=float(os.getenv('CATALOG_MIN_SCORE', '0.75')),
+            # Verificação de URLs/preços em segundo plano nos jobs de planilha
+            verifier=(ResultVerifier.from_env()
+                      if os.getenv('VERIFY_RESULTS', '0').lower() in ('1', 'true', 'yes') else None),
+            scheduling=os.getenv('SCHEDULING', 'value')
+        )
+        self.preprocessor = self._load_preprocessor()
+
+        self.executor = ThreadPoolExecutor(max_workers=workers, thread_name_prefix='job')
+        self.jobs: Dict[str, Dict[str, Any]] = {}
+        self.jobs_lock = threading.Lock()
+
+    def _load_catalog(self) -> Optional[CatalogIndex]:
+        """Abre o catálogo local (memory-map) se um índice foi importado"""
+        index_dir = os.getenv('CATALOG_INDEX', 'catalog_index')
+        if not os.path.isdir(index_dir):
+            return None
+        return CatalogIndex(index_dir, brands=PriceDiscoverySystem.BRAND_INDICATORS)
+
+    def _load_preprocessor(self):
+        """Carrega o pré-processador CrewAI uma única vez (opcional)"""
+        try:
+            from preprocessamento import SmartPreprocessor
+            return SmartPreprocessor()
+        except Exception as e:
+            logger.warning(f"⚠️ Pré-processador indisponível ({e}); jobs criarão um próprio")
+            return None
+
+    def price_item(self, item: str, category: Optional[str] = None) -> Dict[str, Any]:
+        """Busca o preço de um único item usando o cache compartilhado"""
+        result = self.price_system.process_item(item, category)
+        return asdict(result)
+
+    def submit_job(self, data: bytes, force_reprocess: bool = False) -> str:
+        """Registra uma planilha enviada e agenda o fluxo completo"""
+        job_id = uuid.uuid4().hex[:12]
+        job_dir = os.path.join(self.jobs_dir, job_id)
+        os.makedirs(job_dir)
+
+        input_file = os.path.join(job_dir, 'input.xlsx')
+        with open(input_file, 'wb') as f:
+            f.write(data)
+
+        with self.jobs_lock:
+            self.jobs[job_id] = {
+                'job_id': job_id,
+                'status': 'queued',
+                'submitted_at': datetime.now().isoformat(timespec='seconds'),
+                'started_at': None,
+                'finished_at': None,
+                'report': None,
+                'error': None
+            }
+
+        self.executor.submit(self._run_job, job_id, input_file, job_dir, force_reprocess)
+        logger.info(f"📥 Job {job_id} recebido ({len(data)} bytes)")
+        return job_id
+
+    def _update_job(self, job_id: str, **fields):
+        """Atualiza o estado de um job"""
+        with self.jobs_lock:
+            self.jobs[job_id].update(fields)
+
+    def _run_job(self, job_id: str, input_file: str, job_dir: str, force_reprocess: bool):
+        """Executa o fluxo completo de um job em uma thread do pool"""
+        self._update_job(job_id, status='running', started_at=datetime.now().isoformat(timespec='seconds'))
+
+        try:
+            system = IntelligentPriceDiscoverySystem(
+                force_reprocess=force_reprocess,
+                input_file=input_file,
+                output_dir=job_dir,
+                price_system=self.price_system,
+                preprocessor=self.preprocessor
+            )
+            success = system.run_complete_workflow()
+            self._update_job(
+                job_id,
+                status='done' if success else 'failed',
+                report=system.final_results_file if success else None,
+                error=None if success else 'Workflow failed, see server logs'
+            )
+        except (Exception, SystemExit) as e:  # _check_api_keys usa sys.exit
+            logger.error(f"❌ Job {job_id} falhou: {e}")
+            self._update_job(job_id, status='failed', error=str(e))
+        finally:
+            self._update_job(job_id, finished_at=datetime.now().isoformat(timespec='seconds'))
+
+    def job_status(self, job_id: str) -> Optional[Dict[str, Any]]:
+        """Estado atual de um job (ou None se não existir)"""
+        with self.jobs_lock:
+            job = self.jobs.get(job_id)
+            return dict(job) if job else None
+
+    def health(self) -> Dict[str, Any]:
+        """Resumo do serviço"""
+        with self.jobs_lock:
+            statuses = [job['status'] for job in self.jobs.values()]
+        # Camadas ainda sem chamadas têm médias NaN, que não existem em JSON: viram null
+        tiers = self.price_system.tier_summary()
+        return {
+            'status': 'ok',
+            'jobs': {status: statuses.count(status) for status in set(statuses)},
+            'item_cache': self.price_system.cache_stats(),
+            'price_history': self.history.stats(),
+            'similarity': {
+                'items': len(self.price_system.similarity) if self.price_system.similarity is not None else 0,
+                'hits': self.price_system.similarity_hits
+            },
+            'search_tiers': tiers.astype(object).where(tiers.notna(), None).to_dict(orient='records'),
+            'catalog': dict(self.price_system.catalog.stats(), hits=self.price_system.catalog_hits)
+                       if self.price_system.catalog is not None else None,
+            'preprocessor': self.preprocessor is not None,
+            # Latência/erro ao vivo de cada provedor (roteamento e failover)
+            'providers': {
+                'search': self.price_system.router.stats(),
+                'llm': self.preprocessor.router.stats() if self.preprocessor is not None else None
+            },
+            # Chamadas idênticas simultâneas (itens avulsos e jobs) agrupadas em uma só
+            'coalesced': {
+                'searches': self.price_system.search_flight.stats(),
+                'optimizations': self.preprocessor.optimize_flight.stats() if self.preprocessor is not None else None
+            }
+        }
+
+
+class PriceDiscoveryHandler(BaseHTTPRequestHandler):
+    """Roteamento HTTP para o PriceDiscoveryService"""
+
+    service: PriceDiscoveryService = None  # definido em create_server
+
+    def log_message(self, format, *args):
+        logger.debug(f"{self.address_string()} - {format % args}")
+
+    def _send_json(self, payload: Any, status: int = 200):
+        body = json.dumps(payload, ensure_ascii=False, default=str, allow_nan=False).encode('utf-8')
+        self.send_response(status)
+        self.send_header('Content-Type', 'application/json; charset=utf-8')
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def _read_body(self) -> bytes:
+        length = int(self.headers.get('Content-Length', 0))
+        return self.rfile.read(length) if length else b''
+
+    def do_GET(self):
+        url = urlparse(self.path)
+        query = parse_qs(url.query)
+        parts = [part for part in url.path.split('/') if part]
+
+        if parts == ['health']:
+            self._send_json(self.service.health())
+
+        elif parts == ['item']:
+            item = query.get('q', [''])[0].strip()
+            if not item:
+                self._send_json({'error': "Parâmetro 'q' obrigatório"}, 400)
+                return
+            category = query.get('categoria', [None])[0]
+            self._send_json(self.service.price_item(item, category))
+
+        elif len(parts) == 2 and parts[0] == 'jobs':
+            job = self.service.job_status(parts[1])
+            if job:
+                self._send_json(job)
+            else:
+                self._send_json({'error': 'Job não encontrado'}, 404)
+
+        elif len(parts) == 3 and parts[0] == 'jobs' and parts[2] == 'report':
+            job = self.service.job_status(parts[1])
+            if not job or not job['report'] or not os.path.exists(job['report']):
+                self._send_json({'error': 'Relatório indisponível'}, 404)
+                return
+            with open(job['report'], 'rb') as f:
+                data = f.read()
+            self.send_response(200)
+            self.send_header('Content-Type', XLSX_CONTENT_TYPE)
+            self.send_header('Content-Disposition', f'attachment; filename="{os.path.basename(job["report"])}"')
+            self.send_header('Content-Length', str(len(data)))
+            self.end_headers()
+            self.wfile.write(data)
+
+        else:
+            self._send_json({'error': 'Rota não encontrada'}, 404)
+
+    def do_POST(self):
+        url = urlparse(self.path)
+        query = parse_qs(url.query)
+        parts = [part for part in url.path.split('/') if part]
+
+        if parts == ['item']:
+            try:
+                payload = json.loads(self._read_body() or b'{}')
+            except json.JSONDecodeError:
+                self._send_json({'error': 'JSON inválido'}, 400)
+                return
+            item = str(payload.get('item', '')).strip()
+            if not item:
+                self._send_json({'error': "Campo 'item' obrigatório"}, 400)
+                return
+            category = payload.get('categoria') or payload.get('category')
+            self._send_json(self.service.price_item(item, category))
+
+        elif parts == ['jobs']:
+            data = self._read_body()
+            if not data:
+                self._send_json({'error': 'Envie a planilha no corpo da requisição'}, 400)
+                return
+            force = query.get('force_reprocess', ['0'])[0] in ('1', 'true')
+            job_id = self.service.submit_job(data, force_reprocess=force)
+            self._send_json({'job_id': job_id, 'status': 'queued'}, 202)
+
+        else:
+            self._send_json({'error': 'Rota não encontrada'}, 404)
+
+
+def create_server(service: PriceDiscoveryService, host: str = '127.0.0.1', port: int = 8080) -> ThreadingHTTPServer:
+    """Cria o servidor HTTP ligado ao serviço compartilhado"""
+    handler = type('BoundPriceDiscoveryHandler', (PriceDiscoveryHandler,), {'service': service})
+    return ThreadingHTTPServer((host, port), handler)
+
+
+def main():
+    """Inicia o serviço HTTP local"""
+    parser = argparse.ArgumentParser(description='Price Discovery HTTP Service')
+    parser.add_argument('--host', default='127.0.0.1', help='Endereço de escuta')
+    parser.add_argument('--port', type=int, default=8080, help='Porta de escuta')
+    parser.add_argument('--workers', type=int, default=2, help='Jobs de planilha em paralelo')
+    parser.add_argument('--jobs-dir', default='jobs', help='Diretório dos jobs')
+    parser.add_argument('--cache-ttl', type=float, default=6 * 3600,
+                        help='Validade (s) dos preços no cache de itens')
+    parser.add_argument('--max-age-days', type=float,
+                        help='Reaproveita preços do histórico mais novos que N dias')
+    parser.add_argument('--similarity-threshold', type=float,
+                        default=float(os.getenv('SIMILARITY_THRESHOLD', '0.8')),
+                        help='Reaproveita preços de itens quase idênticos (0 desativa)')
+    args = parser.parse_args()
+
+    try:
+        service = PriceDiscoveryService(args.jobs_dir, args.workers, args.cache_ttl, args.max_age_days,
+                                        args.similarity_threshold)
+    except ValueError as e:
+        logger.error(f"❌ {e}")
+        return
+
+    server = create_server(service, args.host, args.port)
+    logger.info(f"🌐 Price Discovery Service em http://{args.host}:{args.port}")
+
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        logger.info("\n⚠️ Serviço interrompido pelo usuário")
+    finally:
+        server.server_close()
+        service.executor.shutdown(wait=False)
+
+
+if __name__ == "__main__":
+    main()
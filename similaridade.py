@@ -0,0 +1,256 @@
+#!/usr/bin/env python3
+"""
+Índice de Similaridade de Itens
+Encontra itens já precificados escritos de outra forma ("Geladeira Brastemp
+375L inox", "geladeira brastemp 375 litros", "Refrigerador Brastemp 375L")
+usando MinHash-LSH sobre n-gramas de caracteres da descrição normalizada.
+Unidades e marcas extraídas precisam coincidir para que um preço seja reaproveitado.
+"""
+
+import re
+import zlib
+import threading
+import unicodedata
+from typing import Dict, Iterable, List, Optional, Tuple
+
+import numpy as np
+
+# Primo > 2^32 para a família de hashes (a*x + b) mod P
+_PRIME = np.uint64(4294967311)
+
+# Sinônimos levados a um termo único antes da comparação
+SYNONYMS = [(re.compile(pattern), replacement) for pattern, replacement in [
+    (r'\brefrigerador(es)?\b', 'geladeira'),
+    (r'\bmicro[\s-]?ondas\b', 'microondas'),
+    (r'\bar[\s-]condicionado\b', 'ar condicionado'),
+    (r'\btelevisao\b|\btelevisor\b', 'tv'),
+    (r'\bcelular\b', 'smartphone'),
+    (r'\blaptop\b', 'notebook'),
+]]
+
+# Unidades normalizadas: número + sufixo canônico ("375 litros" -> "375l")
+UNIT_SUFFIXES = {
+    'l': 'l', 'litro': 'l', 'litros': 'l', 'lt': 'l', 'lts': 'l',
+    'btu': 'btu', 'btus': 'btu',
+    'polegadas': 'pol', 'polegada': 'pol', 'pol': 'pol', '"': 'pol',
+    'w': 'w', 'watt': 'w', 'watts': 'w',
+    'gb': 'gb', 'tb': 'tb', 'kg': 'kg', 'quilos': 'kg', 'cm': 'cm', 'mm': 'mm',
+}
+UNIT_PATTERN = re.compile(
+    r'(\d+(?:[.,]\d+)?)\s*(' + '|'.join(sorted((re.escape(u) for u in UNIT_SUFFIXES), key=len, reverse=True)) + r')(?![a-z])'
+)
+THOUSANDS_PATTERN = re.compile(r'(\d)\.(\d{3})(?!\d)')
+TOKEN_PATTERN = re.compile(r'[a-z0-9]+')
+
+STOPWORDS = {'de', 'da', 'do', 'das', 'dos', 'para', 'com', 'em', 'na', 'no', 'e', 'a', 'o'}
+
+
+class TextNormalizer:
+    """Normaliza descrições (acentos, sinônimos, unidades) e extrai unidades e marcas"""
+
+    def __init__(self, brands: Iterable[str] = ()):
+        """
+        Args:
+            brands: Marcas reconhecidas nas descrições
+        """
+        brands = sorted({brand.lower() for brand in brands}, key=len, reverse=True)
+        self._brand_pattern = re.compile(r'\b(' + '|'.join(map(re.escape, brands)) + r')\b') if brands else None
+
+    def normalize(self, text: str) -> Tuple[str, List[str], List[str]]:
+        """Texto normalizado, unidades canônicas e marcas encontradas (ordenadas, sem repetição)"""
+        text = unicodedata.normalize('NFKD', str(text).lower())
+        text = ''.join(char for char in text if not unicodedata.combining(char))
+
+        for pattern, replacement in SYNONYMS:
+            text = pattern.sub(replacement, text)
+
+        # "12.000 BTUs" -> "12000 BTUs" antes de ler as unidades
+        text = THOUSANDS_PATTERN.sub(r'\1\2', text)
+
+        units = []
+
+        def canonical(match):
+            value = match.group(1).replace(',', '.')
+            if '.' in value:
+                value = value.rstrip('0').rstrip('.')
+            unit = value + UNIT_SUFFIXES[match.group(2)]
+            units.append(unit)
+            return f" {unit} "
+
+        text = UNIT_PATTERN.sub(canonical, text)
+        tokens = [token for token in TOKEN_PATTERN.findall(text) if token not in STOPWORDS]
+        normalized = ' '.join(tokens)
+
+        brands = self._brand_pattern.findall(normalized) if self._brand_pattern else []
+        return normalized, sorted(set(units)), sorted(set(brands))
+
+
+class SimilarityIndex:
+    """
+    Índice MinHash-LSH de descrições de itens.
+    Assinaturas ficam em uma matriz numpy e cada banda LSH em arrays ordenados
+    (busca binária), com um buffer em dicionário para inserções recentes, o que
+    mantém a memória previsível com milhões de itens e consultas abaixo de 1 ms.
+    """
+
+    def __init__(self, threshold: float = 0.8, brands: Iterable[str] = (), num_perm: int = 32,
+                 bands: int = 8, ngram: int = 3, seed: int = 42, merge_every: int = 50000):
+        """
+        Args:
+            threshold: Similaridade mínima (Jaccard estimado, 0-1) para aceitar um item
+            brands: Marcas que precisam coincidir entre os itens
+            num_perm: Número de funções de hash da assinatura MinHash
+            bands: Número de bandas LSH (num_perm deve ser múltiplo)
+            ngram: Tamanho dos n-gramas de caracteres
+            merge_every: Inserções acumuladas antes de reorganizar as bandas
+        """
+        if num_perm % bands:
+            raise ValueError("num_perm deve ser múltiplo de bands")
+
+        self.threshold = threshold
+        self.normalizer = TextNormalizer(brands)
+        self.num_perm = num_perm
+        self.bands = bands
+        self.rows = num_perm // bands
+        self.ngram = ngram
+        self.merge_every = merge_every
+
+        rng = np.random.RandomState(seed)
+        self._a = rng.randint(1, 2**32 - 1, size=num_perm, dtype=np.uint64)
+        self._b = rng.randint(0, 2**32 - 1, size=num_perm, dtype=np.uint64)
+        self._band_mult = rng.randint(1, 2**63 - 1, size=self.rows, dtype=np.uint64) | np.uint64(1)
+
+        self._signatures = np.empty((1024, num_perm), dtype=np.uint32)
+        self._keys: List[str] = []
+        self._key_ids: Dict[str, int] = {}
+        self._constraint_ids = np.empty(1024, dtype=np.int32)
+        self._constraints: Dict[str, int] = {}
+
+        self._band_keys = [np.empty(0, dtype=np.uint64) for _ in range(bands)]
+        self._band_ids = [np.empty(0, dtype=np.int32) for _ in range(bands)]
+        self._pending: List[Dict[int, List[int]]] = [{} for _ in range(bands)]
+        self._pending_count = 0
+
+        self._lock = threading.Lock()
+
+    def __len__(self) -> int:
+        return len(self._keys)
+
+    def _normalize(self, text: str) -> Tuple[str, str]:
+        """Texto normalizado e restrição (unidades + marcas) que precisa coincidir"""
+        normalized, units, brands = self.normalizer.normalize(text)
+        return normalized, '|'.join(units) + '#' + '|'.join(brands)
+
+    def _signature(self, normalized: str) -> Optional[np.ndarray]:
+        """Assinatura MinHash dos n-gramas de caracteres"""
+        padded = f" {normalized} "
+        if len(padded) < self.ngram + 2:
+            return None
+        shingles = {padded[i:i + self.ngram] for i in range(len(padded) - self.ngram + 1)}
+        hashes = np.fromiter((zlib.crc32(s.encode('utf-8')) for s in shingles),
+                             dtype=np.uint64, count=len(shingles))
+        permuted = (hashes[:, None] * self._a[None, :] + self._b[None, :]) % _PRIME
+        return (permuted.min(axis=0) & np.uint64(0xFFFFFFFF)).astype(np.uint32)
+
+    def _band_hashes(self, signature: np.ndarray) -> np.ndarray:
+        """Uma chave por banda LSH"""
+        rows = signature.astype(np.uint64).reshape(self.bands, self.rows)
+        return (rows * self._band_mult[None, :]).sum(axis=1)
+
+    def add(self, text: str, key: str) -> bool:
+        """
+        Indexa um item já precificado.
+        `key` é o identificador usado para recuperar o resultado armazenado
+        (ex.: chave do cache de itens / histórico de preços).
+        """
+        normalized, constraint = self._normalize(text)
+        signature = self._signature(normalized)
+        if signature is None:
+            return False
+
+        with self._lock:
+            if key in self._key_ids:
+                return False
+
+            entry_id = len(self._keys)
+            if entry_id >= len(self._signatures):
+                self._signatures = np.concatenate([self._signatures, np.empty_like(self._signatures)])
+                self._constraint_ids = np.concatenate([self._constraint_ids, np.empty_like(self._constraint_ids)])
+            self._signatures[entry_id] = signature
+            self._constraint_ids[entry_id] = self._constraints.setdefault(constraint, len(self._constraints))
+
+            self._keys.append(key)
+            self._key_ids[key] = entry_id
+
+            for band, band_key in enumerate(self._band_hashes(signature).tolist()):
+                self._pending[band].setdefault(band_key, []).append(entry_id)
+            self._pending_count += 1
+
+            if self._pending_count >= self.merge_every:
+                self._merge_pending()
+        return True
+
+    def _merge_pending(self):
+        """Move as inserções recentes para os arrays ordenados das bandas"""
+        for band in range(self.bands):
+            pending = self._pending[band]
+            if not pending:
+                continue
+            new_keys = np.fromiter((k for k, ids in pending.items() for _ in ids), dtype=np.uint64)
+            new_ids = np.fromiter((i for ids in pending.values() for i in ids), dtype=np.int32)
+            keys = np.concatenate([self._band_keys[band], new_keys])
+            ids = np.concatenate([self._band_ids[band], new_ids])
+            order = np.argsort(keys, kind='stable')
+            self._band_keys[band] = keys[order]
+            self._band_ids[band] = ids[order]
+            self._pending[band] = {}
+        self._pending_count = 0
+
+    def lookup(self, text: str, max_candidates: int = 256) -> Optional[Tuple[str, float]]:
+        """
+        Melhor item indexado similar ao texto: (key, score) ou None.
+        O score é o Jaccard estimado pelas assinaturas MinHash.
+        """
+        normalized, constraint = self._normalize(text)
+        signature = self._signature(normalized)
+        if signature is None:
+            return None
+
+        band_hashes = self._band_hashes(signature)
+        with self._lock:
+            constraint_id = self._constraints.get(constraint)
+            if constraint_id is None or not self._keys:
+                return None
+
+            parts = []
+            for band, band_key in enumerate(band_hashes):
+                # busca com o escalar uint64: um int Python forçaria conversão do array inteiro
+                keys = self._band_keys[band]
+                if len(keys):
+                    low = int(keys.searchsorted(band_key, side='left'))
+                    high = int(keys.searchsorted(band_key, side='right'))
+                    parts.append(self._band_ids[band][low:min(high, low + max_candidates)])
+                pending = self._pending[band].get(int(band_key))
+                if pending:
+                    parts.append(np.asarray(pending[:max_candidates], dtype=np.int32))
+            if not parts:
+                return None
+
+            ids = np.unique(np.concatenate(parts))
+            ids = ids[self._constraint_ids[ids] == constraint_id]
+            if not len(ids):
+                return None
+
+            scores = (self._signatures[ids] == signature[None, :]).mean(axis=1)
+            best = int(np.argmax(scores))
+            if scores[best] < self.threshold:
+                return None
+            return self._keys[ids[best]], float(scores[best])
+
+    def memory_usage(self) -> int:
+        """Bytes aproximados das estruturas numpy e das chaves"""
+        total = self._signatures[:len(self._keys)].nbytes
+        total += sum(keys.nbytes + ids.nbytes for keys, ids in zip(self._band_keys, self._band_ids))
+        total += self._constraint_ids[:len(self._keys)].nbytes
+        total += sum(len(key) + 49 for key in self._keys)
+        return total
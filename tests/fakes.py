@@ -0,0 +1,50 @@
+from types import SimpleNamespace
+
+import pandas as pd
+
+from busca_precos_basica import SingleFlight
+from provedores import Provider
+
+
+class FakeSession:
+    """requests.Session substituto: responde sem rede e guarda os payloads enviados"""
+
+    def __init__(self, answer, usage=None):
+        # answer: conteúdo fixo da resposta ou função payload -> conteúdo
+        self.answer = answer
+        self.usage = usage or {}
+        self.payloads = []
+
+    def post(self, url, headers=None, json=None, timeout=None):
+        self.payloads.append(json)
+        content = self.answer(json) if callable(self.answer) else self.answer
+        body = {'choices': [{'message': {'content': content}}], 'usage': self.usage}
+        return SimpleNamespace(status_code=200, json=lambda: body)
+
+    def close(self):
+        pass
+
+
+class FakePreprocessor:
+    """SmartPreprocessor substituto (sem CrewAI): mantém os itens e grava as mesmas abas"""
+
+    def __init__(self):
+        self.router = SimpleNamespace(providers=[Provider('fake-llm', None, None)], stats=lambda: [])
+        self.optimize_flight = SingleFlight()
+        self.files = []
+
+    def load_previous(self, file_path):
+        return 0
+
+    def process_file(self, input_file, output_file):
+        self.files.append(input_file)
+        items = pd.read_excel(input_file).iloc[:, 0].astype(str).str.strip().tolist()
+        results = [SimpleNamespace(original=item, optimized=item, provider='fake-llm', prompt_tokens=300,
+                                   completion_tokens=20, cached_tokens=0) for item in items]
+        df = pd.DataFrame({'Item_Original': items, 'Item_Otimizado': items, 'Notas': 'Mantido',
+                           'Categoria': None, 'Versao_Prompt': 'otimizacao-v2', 'Provedor': 'fake-llm'})
+        with pd.ExcelWriter(output_file, engine='openpyxl') as writer:
+            df.to_excel(writer, sheet_name='Resultados_Completos', index=False)
+            df[['Item_Otimizado', 'Categoria']].rename(columns={'Item_Otimizado': 'Item'}).to_excel(
+                writer, sheet_name='Itens_Otimizados', index=False)
+        return results
@@ -0,0 +1,481 @@
+import json
+import threading
+import time
+from concurrent.futures import Future, ThreadPoolExecutor
+from dataclasses import replace
+from datetime import timedelta
+
+import pandas as pd
+import pytest
+
+import historico_precos
+from busca_precos_basica import (STATUS_FOUND, CostTracker, PriceDiscoverySystem, PriceResult, ResultJournal,
+                                 ResultStore, SingleFlight, parse_search_tiers)
+from fakes import FakeSession
+from historico_precos import PriceHistoryStore
+from prompts import SEARCH_SYSTEM_PROMPT
+from similaridade import SimilarityIndex
+
+
+def test_items_are_grouped_by_category_product_and_brand():
+    entries = [('Mouse Logitech M170', 'Informática'), ('Geladeira Consul 375 litros', 'Cozinha'),
+               ('Teclado Logitech K120', 'Informática'), ('Mouse Dell MS116', 'Informática'),
+               ('Geladeira Consul 410 litros', 'Cozinha'), ('Mouse Logitech M90', 'informática'),
+               ('Grampeador de papel', None)]
+    order = PriceDiscoverySystem._schedule_by_category(entries)
+    # Grupos na ordem em que aparecem; dentro do grupo, a ordem do arquivo
+    assert order == [0, 5, 1, 4, 2, 3, 6]
+
+
+FOUND = '{"price": 199.9, "store": "Loja", "url": "https://loja/1", "confidence": 0.9}'
+
+
+@pytest.fixture
+def system(monkeypatch):
+    monkeypatch.delenv('SEARCH_PROVIDERS', raising=False)
+    system = PriceDiscoverySystem(api_key='test', min_interval=0)
+    system.session = FakeSession(FOUND)
+    return system
+
+
+@pytest.fixture
+def history(tmp_path):
+    history = PriceHistoryStore(str(tmp_path / 'history.db'))
+    yield history
+    history.close()
+
+
+def refreshing(history, max_age_days=30):
+    """Sistema novo (cache vazio) que reaproveita o histórico"""
+    system = PriceDiscoverySystem(api_key='test', min_interval=0, history=history, max_age_days=max_age_days,
+                                  min_confidence=0.7)
+    system.session = FakeSession('{"price": 2899.0, "store": "Loja", "url": "https://loja/2", "confidence": 0.9}')
+    return system
+
+
+def test_fresh_history_observation_skips_the_search(monkeypatch, history):
+    monkeypatch.delenv('SEARCH_PROVIDERS', raising=False)
+    first = refreshing(history)
+    assert first.process_item('Geladeira Consul 375 litros frost free').price == 2899.0
+    assert len(first.session.payloads) == 1
+
+    second = refreshing(history)
+    result = second.process_item('Geladeira  CONSUL 375 litros frost free')
+    assert result.status == 'price_found' and result.price == 2899.0
+    assert result.reason.startswith('Price history')
+    assert second.session.payloads == []
+    assert second.history_hits == 1
+
+
+def test_stale_or_unconfident_observation_is_searched_again(monkeypatch, history):
+    monkeypatch.delenv('SEARCH_PROVIDERS', raising=False)
+    history.record('geladeira consul 375 litros frost free', PriceResult(
+        item='Geladeira Consul 375 litros frost free', status='price_found', reason='', price=2499.0,
+        store='Loja', url='https://loja/1', confidence=0.5))
+    unconfident = refreshing(history)
+    assert unconfident.process_item('Geladeira Consul 375 litros frost free').price == 2899.0
+    assert len(unconfident.session.payloads) == 1
+
+    # A busca acima gravou uma observação confiável; 31 dias depois ela já não vale
+    later = historico_precos._utc_now() + timedelta(days=31)
+    monkeypatch.setattr(historico_precos, '_utc_now', lambda: later)
+    stale = refreshing(history)
+    stale.process_item('Geladeira Consul 375 litros frost free')
+    assert len(stale.session.payloads) == 1
+    assert stale.history_hits == 0
+
+
+def test_result_store_round_trips_results():
+    results = [
+        PriceResult(item='Geladeira Consul', status='price_found', reason='Found via AI search', price=2499.9,
+                    store='Loja', url='https://loja/1', confidence=0.9, category='Cozinha', elapsed=1.5),
+        PriceResult(item='Geladeira Consul 375L', status='price_found', reason='Found in item cache',
+                    price=2499.9, store='Loja', url='https://loja/1', confidence=0.9, category='Cozinha'),
+        PriceResult(item='Cimento', status='filtered_out', reason='Material de obra'),
+        None,
+    ]
+    store = ResultStore.from_results(results)
+
+    assert len(store) == 4
+    assert list(store)[:3] == results[:3]
+    # Linha não preenchida continua "não processada"
+    assert store[3].status == 'not_processed' and store[3].item is None
+    assert store.count(STATUS_FOUND) == 2
+    # Strings repetidas (loja, URL, categoria) são guardadas uma vez só
+    assert len(store._strings) == len(set(store._strings))
+
+    df = store.to_dataframe()
+    assert df['Status'].tolist() == ['price_found', 'price_found', 'filtered_out', 'not_processed']
+    assert df['Elapsed_s'].tolist()[0] == 1.5
+    assert pd.isna(df.loc[2, 'Price'])
+
+
+def test_result_store_set_overwrites_a_row():
+    store = ResultStore(2)
+    store.set(1, PriceResult(item='Monitor LG', status='price_found', reason='', price=899.0, confidence=0.9))
+    store.set(1, PriceResult(item='Monitor LG', status='price_found', reason='', price=899.0, confidence=0.75))
+    assert store[1].confidence == 0.75
+    assert store.count(STATUS_FOUND) == 1
+
+
+def test_result_store_keeps_call_metadata():
+    results = [
+        PriceResult(item='Geladeira Consul', status='price_found', reason='Found via AI search', price=2499.9,
+                    store='Loja', url='https://loja/1', confidence=0.9, tier='sonar/150', provider='perplexity',
+                    prompt_tokens=120, completion_tokens=40, cached_tokens=0, prompt_version='busca-v2'),
+        PriceResult(item='Geladeira Consul 375L', status='price_found', reason='Similar item: Geladeira Consul',
+                    price=2499.9, store='Loja', url='https://loja/1', confidence=0.9, match_score=0.82,
+                    verification='price_confirmed'),
+    ]
+    store = ResultStore.from_results(results)
+    assert list(store) == results
+
+    df = store.to_dataframe()
+    assert df['Prompt_Tokens'].tolist() == [120, pd.NA]
+    assert df['Tier'].tolist()[0] == 'sonar/150' and pd.isna(df['Tier'].tolist()[1])
+    assert df.loc[1, 'Match_Score'] == 0.82
+    assert df.loc[1, 'Verification'] == 'price_confirmed'
+
+
+def test_cost_tracker_refuses_calls_over_the_budget():
+    tracker = CostTracker(budget_usd=0.02)
+    assert tracker.can_spend(0.015)
+    tracker.record('sonar', 1000, 500)           # 0.0015 + 0.005 por chamada
+    assert tracker.summary()['spent_usd'] == pytest.approx(0.0065)
+    assert tracker.can_spend(0.0135)             # cabe exatamente no teto
+    assert not tracker.exhausted
+
+    assert not tracker.can_spend(0.014)
+    assert tracker.exhausted
+    assert tracker.summary()['budget_stops'] == 1
+    # Sem teto, tudo cabe
+    assert CostTracker().can_spend(1e9)
+
+
+def test_budget_stop_skips_items_without_calling(monkeypatch):
+    monkeypatch.delenv('SEARCH_PROVIDERS', raising=False)
+    tracker = CostTracker(budget_usd=0.01)
+    system = PriceDiscoverySystem(api_key='test', min_interval=0, cost_tracker=tracker,
+                                  search_tiers=parse_search_tiers('sonar:150'))
+    system.session = FakeSession('{"price": 99.9, "store": "Loja", "url": "https://loja/1"}',
+                                 usage={'prompt_tokens': 100, 'completion_tokens': 50})
+
+    first = system.process_item('Mouse Logitech sem fio M170')
+    second = system.process_item('Teclado Logitech K120 USB')
+    assert first.status == 'price_found'
+    # A primeira busca gastou ~0.005: a segunda não cabe e nem é feita
+    assert second.status == 'not_processed' and second.reason == 'Budget cap reached'
+    assert len(system.session.payloads) == 1
+    assert tracker.spent_usd <= tracker.budget_usd
+
+
+def test_low_confidence_escalates_to_the_next_tier(monkeypatch):
+    monkeypatch.delenv('SEARCH_PROVIDERS', raising=False)
+    system = PriceDiscoverySystem(api_key='test', min_interval=0, escalation_confidence=0.7,
+                                  search_tiers=parse_search_tiers('sonar:150,sonar-pro:500'))
+
+    def answer(payload):
+        premium = payload['model'] == 'sonar-pro'
+        confident = premium or 'Consul' in payload['messages'][-1]['content']
+        return json.dumps({'price': 2100.0 if premium else 1900.0, 'store': 'Loja', 'url': 'https://loja/1',
+                           'confidence': 0.9 if confident else 0.3})
+    system.session = FakeSession(answer)
+
+    confident = system.process_item('Geladeira Consul 375 litros frost free')
+    unsure = system.process_item('Geladeira Brastemp 375 litros inox')
+
+    # Só a resposta de baixa confiança sobe para o modelo mais caro
+    sent = [(payload['model'], payload['max_tokens']) for payload in system.session.payloads]
+    assert sent == [('sonar', 150), ('sonar', 150), ('sonar-pro', 500)]
+    assert (confident.price, confident.tier) == (1900.0, 'sonar/150')
+    assert (unsure.price, unsure.confidence, unsure.tier) == (2100.0, 0.9, 'sonar-pro/500')
+
+
+@pytest.mark.parametrize('confidence, expected', [
+    (None, 0.8),
+    ('alta', 0.8),
+    ('0.9', 0.9),
+    ('0,6', 0.6),
+    ('85%', 0.85),
+    (95, 0.95),
+    (-1, 0.8),
+])
+def test_confidence_from_model_is_coerced(system, confidence, expected):
+    system.session = FakeSession(
+        json.dumps({'price': 2499.9, 'store': 'Loja', 'url': 'https://loja/1', 'confidence': confidence}))
+
+    result = system.process_item('Geladeira Consul 375 litros frost free')
+
+    assert result.status == 'price_found'
+    assert result.price == 2499.9
+    assert result.confidence == pytest.approx(expected)
+
+
+@pytest.mark.parametrize('answer', [
+    'Encontrei o produto por R$ 2499 em algumas lojas.',
+    '{"price": 2499, "store": "Loja",} por R$ 2499',  # JSON inválido: cai no preço do texto
+])
+def test_price_from_text_has_no_made_up_store_or_url(system, answer):
+    data = system._extract_price_data(answer)
+    assert data == {'price': 2499.0, 'store': None, 'url': None, 'confidence': 0.5}
+
+
+def test_tier_savings_are_per_item(monkeypatch):
+    monkeypatch.delenv('SEARCH_PROVIDERS', raising=False)
+    system = PriceDiscoverySystem(api_key='test', min_interval=0,
+                                  search_tiers=parse_search_tiers('sonar:150,sonar-pro:500'))
+
+    def answer(payload):
+        confident = payload['model'] == 'sonar-pro' or 'Consul' in payload['messages'][-1]['content']
+        return json.dumps({'price': 100.0, 'store': 'Loja', 'url': 'https://loja/1',
+                           'confidence': 0.9 if confident else 0.3})
+    system.session = FakeSession(answer, usage={'prompt_tokens': 100, 'completion_tokens': 50})
+
+    system.process_item('Geladeira Consul 375 litros frost free')   # resolvido no primeiro nível
+    system.process_item('Geladeira Brastemp 375 litros inox')       # escalou para o último
+
+    summary = system.tier_summary().set_index('Tier')
+    assert summary.loc['sonar/150', 'Calls'] == 2
+    assert summary.loc['sonar-pro/500', 'Calls'] == 1
+    assert summary.loc['sonar/150', 'Cost_Saved_USD'] > 0
+    # O item que escalou pagou as duas chamadas: economia negativa
+    assert summary.loc['sonar-pro/500', 'Cost_Saved_USD'] < 0
+
+
+def test_single_flight_coalesces_concurrent_identical_calls():
+    flight = SingleFlight()
+    started, release = threading.Event(), threading.Event()
+    calls = []
+
+    def search(item):
+        calls.append(item)
+        started.set()
+        release.wait(5)
+        return f"preço de {item}"
+
+    with ThreadPoolExecutor(max_workers=5) as executor:
+        leader = executor.submit(flight.do, 'notebook', search, 'notebook')
+        started.wait(5)
+        followers = [executor.submit(flight.do, 'notebook', search, 'notebook') for _ in range(4)]
+        other = executor.submit(flight.do, 'monitor', search, 'monitor')
+        while flight.stats()['coalesced'] < 4:
+            time.sleep(0.01)
+        release.set()
+
+        assert leader.result() == 'preço de notebook'
+        assert [future.result() for future in followers] == ['preço de notebook'] * 4
+        assert other.result() == 'preço de monitor'
+
+    assert sorted(calls) == ['monitor', 'notebook']
+    assert flight.stats() == {'calls': 2, 'coalesced': 4}
+    # Terminada a chamada, nada fica guardado: a próxima roda de novo
+    assert flight.do('notebook', search, 'notebook') == 'preço de notebook'
+    assert flight.stats()['calls'] == 3
+
+
+def test_single_flight_shares_the_exception_with_waiters():
+    flight = SingleFlight()
+    started, release = threading.Event(), threading.Event()
+
+    def failing():
+        started.set()
+        release.wait(5)
+        raise RuntimeError('fora do ar')
+
+    with ThreadPoolExecutor(max_workers=2) as executor:
+        leader = executor.submit(flight.do, 'notebook', failing)
+        started.wait(5)
+        follower = executor.submit(flight.do, 'notebook', failing)
+        while flight.stats()['coalesced'] < 1:
+            time.sleep(0.01)
+        release.set()
+        for future in (leader, follower):
+            with pytest.raises(RuntimeError):
+                future.result()
+
+
+def test_cost_tracker_stops_at_the_time_budget(monkeypatch):
+    now = [1000.0]
+    monkeypatch.setattr(time, 'monotonic', lambda: now[0])
+    tracker = CostTracker(time_budget_s=60)
+    assert tracker.can_spend(0.01)
+    now[0] += 60
+    assert not tracker.can_spend(0.0)
+    assert tracker.out_of_time and tracker.exhausted
+    assert tracker.summary()['time_stops'] == 1
+
+
+def test_estimated_value_is_quantity_times_price_times_specificity(system):
+    values = system._estimate_values(
+        [('Mouse Logitech sem fio', None), ('Monitor LG 24 polegadas', None), ('Notebook', 'Escritório'),
+         ('Caneta esferográfica azul', 'Escritório'), ('Caneta esferográfica azul', None)],
+        quantities=[10, 1, 1, 1, 1]
+    )
+    bonus = PriceDiscoverySystem.SPECIFICITY_BONUS
+    assert values[0] == pytest.approx(10 * 80 * (1 + 2 * bonus))        # produto + marca
+    assert values[1] == pytest.approx(1000 * (1 + 3 * bonus))           # produto + marca + especificação
+    assert values[2] == pytest.approx(4000 * (1 + bonus))
+    # Sem preço conhecido: mediana da categoria no arquivo, senão o valor padrão
+    assert values[3] == pytest.approx(4000)
+    assert values[4] == pytest.approx(PriceDiscoverySystem.DEFAULT_UNIT_PRICE)
+
+
+def test_history_prices_come_before_price_hints(system, history):
+    history.record('notebook dell inspiron', PriceResult(
+        item='Notebook Dell Inspiron', status='price_found', reason='', price=2500.0, confidence=0.9))
+    history.record('notebook acer aspire', PriceResult(
+        item='Notebook Acer Aspire', status='price_found', reason='', price=3500.0, confidence=0.9))
+    system.history = history
+
+    values = system._estimate_values([('Notebook Dell Inspiron', None), ('Notebook Positivo', None)])
+    bonus = PriceDiscoverySystem.SPECIFICITY_BONUS
+    # Preço do próprio item; senão a mediana do histórico do tipo de produto (não a dica de 4000)
+    assert values[0] == pytest.approx(2500 * (1 + 2 * bonus))
+    assert values[1] == pytest.approx(3000 * (1 + bonus))
+
+
+@pytest.mark.parametrize('budget', ['cost', 'time'])
+def test_budget_stop_leaves_the_lowest_value_items(monkeypatch, tmp_path, budget):
+    monkeypatch.delenv('SEARCH_PROVIDERS', raising=False)
+    now = [1000.0]
+    monkeypatch.setattr(time, 'monotonic', lambda: now[0])
+    # Cabem duas buscas: pelo custo (~0.005 cada) ou pelo tempo (30 s cada)
+    tracker = CostTracker(budget_usd=0.011) if budget == 'cost' else CostTracker(time_budget_s=60)
+    system = PriceDiscoverySystem(api_key='test', min_interval=0, cost_tracker=tracker,
+                                  search_tiers=parse_search_tiers('sonar:150'))
+
+    def answer(payload):
+        now[0] += 30
+        return FOUND
+    system.session = FakeSession(answer, usage={'prompt_tokens': 100, 'completion_tokens': 50})
+
+    input_file = tmp_path / 'lista.xlsx'
+    pd.DataFrame({'Item': ['Mouse Logitech M170 sem fio', 'Notebook Dell Inspiron 15', 'Teclado Logitech K120',
+                           'Monitor LG 24 polegadas'],
+                  'Quantidade': [1, 1, 1, 1]}).to_excel(input_file, index=False)
+    results = system.process_excel_file(str(input_file), str(tmp_path / 'resultado.xlsx'))
+
+    assert [result.status for result in results] == ['not_processed', 'price_found', 'not_processed',
+                                                     'price_found']
+    assert len(system.session.payloads) == 2
+
+
+def test_interrupted_spreadsheet_resumes_from_journal(system, tmp_path):
+    items = ['Geladeira Consul 375 litros frost free', 'Ar condicionado Daikin 12000 BTUs inverter',
+             'Notebook Dell Inspiron 15 polegadas 8GB', 'Monitor LG 24 polegadas full hd',
+             'Impressora HP laserjet modelo M1132']
+    input_file = tmp_path / 'lista.xlsx'
+    pd.DataFrame({'Item': items}).to_excel(input_file, index=False)
+    journal = ResultJournal(str(tmp_path / 'journal.jsonl'))
+
+    def interrupted(payload):
+        if len(system.session.payloads) > 3:
+            raise KeyboardInterrupt
+        return FOUND
+
+    system.session = FakeSession(interrupted)
+    with pytest.raises(KeyboardInterrupt):
+        system.process_excel_file(str(input_file), str(tmp_path / 'parcial.xlsx'), journal)
+    # Os itens precificados antes da interrupção já estão no journal
+    assert len(journal.read()) == 3
+
+    resumed = PriceDiscoverySystem(api_key='test', min_interval=0)
+    resumed.session = FakeSession('{"price": 299.9, "store": "Loja", "url": "https://loja/2", "confidence": 0.9}')
+    results = resumed.process_excel_file(str(input_file), str(tmp_path / 'completo.xlsx'), journal)
+
+    prices = sorted(result.price for result in results)
+    assert prices == [199.9] * 3 + [299.9] * 2
+    assert len(journal.read()) == len(items)
+
+
+class ConfirmingVerifier:
+    """ResultVerifier substituto: confirma todo preço na hora"""
+
+    def submit(self, result, checks):
+        if result.status != 'price_found' or result.verification:
+            return None
+        checks[(result.url, result.price)] = True
+        verified = Future()
+        verified.set_result(replace(result, verification='price_confirmed'))
+        return verified
+
+
+def test_search_entries_journals_verified_results_in_input_order(system, tmp_path):
+    entries = [('Notebook Dell Inspiron 15 polegadas 8GB', 'Escritório'), ('Serviços gerais de pintura', None),
+               ('Monitor LG 24 polegadas full hd', 'Escritório')]
+    system.verifier = ConfirmingVerifier()
+    journal = ResultJournal(str(tmp_path / 'journal.jsonl'))
+
+    results = system.search_entries(entries, [2, 1, 0], journal)
+    assert [result.item for result in results] == [item for item, _ in entries]
+    assert [result.verification for result in results] == ['price_confirmed', None, 'price_confirmed']
+    # A versão verificada substitui a primeira linha do item ao reler o journal
+    assert {result.item: result.verification for result in journal.read()} == {
+        entries[0][0]: 'price_confirmed', entries[1][0]: None, entries[2][0]: 'price_confirmed'}
+
+    # Retomada: nada é pesquisado nem verificado de novo
+    again = system.search_entries(entries, [0, 1, 2], ResultJournal(journal.path))
+    assert len(system.session.payloads) == 2
+    assert [result.verification for result in again] == ['price_confirmed', None, 'price_confirmed']
+
+
+def test_category_throughput_counts_only_searched_items(system, tmp_path):
+    input_file = tmp_path / 'lista.xlsx'
+    pd.DataFrame({'Produto': ['Geladeira Consul 375 litros frost free', 'Notebook Dell Inspiron 15 polegadas 8GB'],
+                  'Categoria': ['Cozinha', 'Escritório']}).to_excel(input_file, index=False)
+
+    results = system.process_excel_file(str(input_file), str(tmp_path / 'resultado.xlsx'))
+    assert [result.item for result in results] == ['Geladeira Consul 375 litros frost free',
+                                                   'Notebook Dell Inspiron 15 polegadas 8GB']
+
+    # Itens filtrados levam microssegundos e não entram na vazão da categoria
+    searched = [replace(result, elapsed=30.0) for result in results]
+    filtered = PriceResult(item='Cimento', status='filtered_out', reason='', category='Cozinha', elapsed=0.0001)
+    summary = system._category_summary(searched + [filtered] * 1000).set_index('Category')
+    assert summary.loc['Cozinha', 'Items'] == 1001
+    assert summary.loc['Cozinha', 'Searched'] == 1
+    assert summary.loc['Cozinha', 'Items_per_min'] == pytest.approx(2.0)
+
+
+def test_reused_results_do_not_inherit_call_metadata(monkeypatch):
+    monkeypatch.delenv('SEARCH_PROVIDERS', raising=False)
+    system = PriceDiscoverySystem(api_key='test', min_interval=0, similarity=SimilarityIndex(0.5))
+    system.session = FakeSession('{"price": 3299.0, "store": "Loja", "url": "https://loja/1", "confidence": 0.9}')
+
+    searched = system.process_item('Notebook Dell Inspiron 15 polegadas 8GB')
+    assert searched.tier and searched.provider and searched.prompt_version and searched.prompt_tokens is not None
+
+    cached = system.process_item('Notebook Dell Inspiron 15 polegadas 8GB')
+    similar = system.process_item('Notebook Dell Inspiron 15 polegadas 8GB preto')
+    assert cached.reason == 'Found in item cache'
+    assert similar.reason.startswith('Similar item')
+    assert similar.match_score is not None and cached.match_score is None
+    for reused in (cached, similar):
+        assert reused.price == 3299.0
+        assert (reused.tier, reused.provider, reused.prompt_version, reused.prompt_tokens) == (None,) * 4
+
+
+def test_search_payload_is_a_fixed_prefix_and_an_item_suffix(system):
+    system.process_item('Geladeira Consul 375 litros frost free')
+    system.process_item('Notebook Dell Inspiron 15 polegadas 8GB')
+
+    first, second = (payload['messages'] for payload in system.session.payloads)
+    # Prefixo idêntico byte a byte (cache de prompt do provedor), só o sufixo muda
+    assert first[0] == second[0] == {'role': 'system', 'content': SEARCH_SYSTEM_PROMPT}
+    assert [message['role'] for message in first] == ['system', 'user']
+    assert 'Geladeira Consul 375 litros' in first[1]['content']
+    assert 'Notebook Dell Inspiron' in second[1]['content']
+    assert 'Geladeira' not in second[1]['content']
+
+
+def test_call_tokens_reach_the_report_columns(system, tmp_path):
+    system.session = FakeSession(FOUND, usage={'prompt_tokens': 812, 'completion_tokens': 64,
+                                               'prompt_tokens_details': {'cached_tokens': 768}})
+    result = system.process_item('Monitor LG 24 polegadas full hd')
+    assert (result.prompt_tokens, result.completion_tokens, result.cached_tokens) == (812, 64, 768)
+
+    output_file = tmp_path / 'resultado.xlsx'
+    system._save_results([result, PriceResult(item='Cimento', status='filtered_out', reason='')], str(output_file))
+    df = pd.read_excel(output_file)
+    assert df.loc[0, ['Prompt_Tokens', 'Completion_Tokens', 'Cached_Tokens']].tolist() == [812, 64, 768]
+    assert df.loc[1, ['Prompt_Tokens', 'Completion_Tokens', 'Cached_Tokens']].isna().all()
@@ -0,0 +1,195 @@
+import json
+import os
+import sys
+
+import pandas as pd
+import pytest
+
+from busca_precos_basica import CostTracker, PriceDiscoverySystem
+from busca_precos_completa import IntelligentPriceDiscoverySystem
+
+
+ITEMS = [
+    'Geladeira Consul 375 litros frost free',
+    'Ar condicionado Daikin 12000 BTUs inverter',
+    'Notebook Dell Inspiron 15 polegadas 8GB',
+    'Monitor LG 24 polegadas full hd',
+    'Cadeira de escritório preta giratória',
+    'Impressora HP laserjet modelo M1132',
+]
+
+CATEGORIES = ['Cozinha', 'Climatização', 'Escritório', 'Escritório', 'Escritório', 'Escritório']
+
+
+def test_shard_assignment_is_stable_and_exclusive():
+    system = PriceDiscoverySystem('dummy')
+    # sha1 do item normalizado: o mesmo em toda execução, processo e máquina (sem PYTHONHASHSEED)
+    assert [system._shard_of(item, 3) for item in ITEMS] == [1, 2, 1, 2, 2, 0]
+    assert [PriceDiscoverySystem('outra')._shard_of(item, 3) for item in ITEMS] == [1, 2, 1, 2, 2, 0]
+    # Variações de caixa e espaços do mesmo item caem no mesmo shard
+    assert system._shard_of('  NOTEBOOK Dell Inspiron 15 polegadas 8GB ', 3) == system._shard_of(ITEMS[2], 3)
+
+    for num_shards in (1, 2, 5):
+        shards = [[item for item in ITEMS if system._shard_of(item, num_shards) == shard]
+                  for shard in range(num_shards)]
+        # Cada item em exatamente um shard
+        assert sorted(item for shard in shards for item in shard) == sorted(ITEMS)
+
+
+def test_merge_restores_input_order_and_category_summary(tmp_path, monkeypatch):
+    monkeypatch.setenv('OPENAI_API_KEY', 'test')
+    monkeypatch.setenv('PERPLEXITY_API_KEY', 'test')
+    input_file = tmp_path / 'lista.xlsx'
+    pd.DataFrame({'Item': ITEMS, 'Categoria': CATEGORIES}).to_excel(input_file, index=False)
+    system = IntelligentPriceDiscoverySystem(input_file=str(input_file), output_dir=str(tmp_path))
+
+    # Saída sintética de dois shards, cada um com as linhas fora da ordem de entrada
+    shard_dir = tmp_path / 'shards'
+    shard_dir.mkdir()
+    for shard, rows in enumerate([[4, 0, 2], [5, 3, 1]]):
+        paths = system._shard_paths(str(shard_dir), shard, 2)
+        shard_df = pd.DataFrame({'Item': [ITEMS[row] for row in rows],
+                                 'Categoria': [CATEGORIES[row] for row in rows]})
+        shard_df.to_excel(paths['input'], index=False)
+        shard_system = IntelligentPriceDiscoverySystem(input_file=paths['input'], output_dir=str(shard_dir))
+        with pd.ExcelWriter(shard_system.preprocessed_file) as writer:
+            shard_df.rename(columns={'Item': 'Item_Original'}).assign(Item_Otimizado=shard_df['Item']).to_excel(
+                writer, sheet_name='Resultados_Completos', index=False)
+        with open(paths['journal'], 'w', encoding='utf-8') as f:
+            for row in rows:
+                found = row != 1
+                f.write(json.dumps({'item': ITEMS[row], 'status': 'price_found' if found else 'not_found',
+                                    'reason': 'Found via AI search' if found else 'No match found',
+                                    'price': 100.0 + row if found else None, 'store': 'Loja',
+                                    'url': f'https://loja/{row}', 'confidence': 0.9}) + '\n')
+
+    assert system.merge_shards(2, str(shard_dir))
+
+    merged = pd.read_excel(system.preprocessed_file, sheet_name='Resultados_Completos')
+    assert merged['Item_Original'].tolist() == ITEMS
+    report = pd.read_excel(system.final_results_file, sheet_name='Complete_Results')
+    assert report['Item_Otimizado'].tolist() == ITEMS
+    assert report['Price'].tolist()[2:] == [102.0, 103.0, 104.0, 105.0]
+    summary = pd.read_excel(system.final_results_file, sheet_name='Category_Summary').set_index('Categoria')
+    assert summary['Items'].to_dict() == {'Cozinha': 1, 'Climatização': 1, 'Escritório': 4}
+    assert summary['Found'].to_dict() == {'Cozinha': 1, 'Climatização': 0, 'Escritório': 4}
+
+
+class FakeSearch:
+    """_post substituto: preço fixo por item, contando as chamadas"""
+
+    def __init__(self):
+        self.calls = 0
+
+    def __call__(self, provider, payload):
+        self.calls += 1
+        content = json.dumps({'price': 100.0 + self.calls, 'store': 'Loja', 'url': 'https://loja/1',
+                              'confidence': 0.9})
+        return {'choices': [{'message': {'content': content}}],
+                'usage': {'prompt_tokens': 100, 'completion_tokens': 50}}, 0.01
+
+
+def price_system(search, budget_usd=None):
+    system = PriceDiscoverySystem(api_key='test', min_interval=0, cost_tracker=CostTracker(budget_usd))
+    system._post = search
+    return system
+
+
+@pytest.fixture
+def workflow(tmp_path, monkeypatch):
+    """Lista de entrada e pré-processamento já feito, sem chaves de API"""
+    monkeypatch.delenv('SEARCH_PROVIDERS', raising=False)
+    input_file = tmp_path / 'lista.xlsx'
+    pd.DataFrame({'Item': ITEMS}).to_excel(input_file, index=False)
+
+    def build(system):
+        workflow = IntelligentPriceDiscoverySystem(input_file=str(input_file), output_dir=str(tmp_path),
+                                                   price_system=system, check_api_keys=False)
+        with pd.ExcelWriter(workflow.preprocessed_file) as writer:
+            pd.DataFrame({'Item': ITEMS}).to_excel(writer, sheet_name='Itens_Otimizados', index=False)
+        return workflow
+    return build
+
+
+def test_budget_stopped_run_resumes_from_journal(workflow):
+    first_search = FakeSearch()
+    one_call = CostTracker.cost('sonar', 100, 50)
+    first = workflow(price_system(first_search, budget_usd=2.5 * one_call))
+    assert first.run_price_discovery()
+    assert 0 < first_search.calls < len(ITEMS)
+    assert not os.path.exists(first.cached_price_file)
+    assert os.path.exists(first.journal_file)
+
+    second_search = FakeSearch()
+    second = workflow(price_system(second_search))
+    assert second.run_price_discovery()
+
+    # Só os itens que faltaram são pesquisados de novo
+    assert second_search.calls == len(ITEMS) - first_search.calls
+    results = pd.read_excel(second.cached_price_file)
+    assert (results['Status'] == 'price_found').all()
+    # O arquivo completo em cache substitui o journal
+    assert not os.path.exists(second.journal_file)
+
+
+def test_shared_price_system_reports_only_its_own_spend(workflow):
+    # Modo servidor: o mesmo sistema aquecido atende vários jobs
+    search = FakeSearch()
+    system = price_system(search)
+
+    first = workflow(system)
+    first.force_reprocess = True
+    assert first.run_price_discovery()
+    spend = first.cost_tracker.summary()
+    assert sum(spend['calls'].values()) == search.calls == len(ITEMS)
+    assert spend['spent_usd'] == pytest.approx(len(ITEMS) * CostTracker.cost('sonar', 100, 50), abs=1e-4)
+    assert first.tier_summary['Items_Resolved'].sum() == len(ITEMS)
+
+    # Tudo vem do cache de itens: nenhum gasto neste job, mesmo com o rastreador compartilhado acumulando
+    second = workflow(system)
+    second.force_reprocess = True
+    assert second.run_price_discovery()
+    assert search.calls == len(ITEMS)
+    assert second.cost_tracker.summary()['spent_usd'] == 0
+    assert system.cost_tracker.summary()['spent_usd'] > 0
+
+
+def test_plan_runs_without_crewai(tmp_path, monkeypatch):
+    monkeypatch.delenv('SEARCH_PROVIDERS', raising=False)
+    monkeypatch.setenv('CATALOG_INDEX', str(tmp_path / 'sem_catalogo'))
+    # Sem o CrewAI instalado, importar preprocessamento falha
+    monkeypatch.setitem(sys.modules, 'preprocessamento', None)
+    input_file = tmp_path / 'lista.xlsx'
+    pd.DataFrame({'Item': ITEMS, 'Categoria': CATEGORIES}).to_excel(input_file, index=False)
+    workflow = IntelligentPriceDiscoverySystem(input_file=str(input_file), output_dir=str(tmp_path),
+                                               check_api_keys=False)
+
+    plan = workflow.plan()
+    assert plan['llm_calls'] == plan['search_calls'] == len(ITEMS)
+    assert plan['llm_prompt_tokens'] > 0 and plan['llm_cost_usd'] > 0
+    assert plan['total_cost_usd'] > plan['search_cost_usd'] > 0
+
+
+@pytest.mark.parametrize('providers, tiers, shards, search_time', [
+    # Um worker busca um item por vez, espaçado pelo intervalo entre buscas
+    ('a|http://a', 'sonar:150:4', 1, 6 * 4.0),
+    # Quatro workers: 4 buscas em paralelo, limitadas pelo intervalo do único provedor
+    ('a|http://a', 'sonar:150:4', 4, 6 * 3.0),
+    # Concorrência 1 por camada em dois provedores: só 2 buscas em paralelo
+    ('a|http://a,b|http://b', 'sonar:150:1', 4, 6 * 4.0 / 2),
+    # Quatro em paralelo, mas os dois provedores juntos fazem uma busca a cada 1,5 s
+    ('a|http://a,b|http://b', 'sonar:150:4', 4, 6 * 3.0 / 2),
+])
+def test_plan_wall_time_follows_tier_concurrency_and_providers(tmp_path, monkeypatch, providers, tiers, shards,
+                                                               search_time):
+    monkeypatch.setenv('SEARCH_PROVIDERS', providers)
+    monkeypatch.setenv('RATE_LIMIT_DELAY', '3')
+    monkeypatch.setenv('CATALOG_INDEX', str(tmp_path / 'sem_catalogo'))
+    input_file = tmp_path / 'lista.xlsx'
+    pd.DataFrame({'Item': ITEMS}).to_excel(input_file, index=False)
+    workflow = IntelligentPriceDiscoverySystem(input_file=str(input_file), output_dir=str(tmp_path),
+                                               search_tiers=tiers, check_api_keys=False)
+
+    plan = workflow.plan(num_shards=shards)
+    llm_time = len(ITEMS) * workflow.LLM_LATENCY_S / shards
+    assert plan['wall_time_s'] == pytest.approx(llm_time + search_time, abs=0.1)
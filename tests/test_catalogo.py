@@ -0,0 +1,54 @@
+import pytest
+
+from busca_precos_basica import PriceDiscoverySystem
+from catalogo import CatalogIndex
+
+PRODUCTS = [
+    {'name': 'Geladeira Consul 375 litros', 'price': 2500.0, 'store': 'Loja A', 'url': 'http://a/1'},
+    {'name': 'Geladeira Brastemp Frost Free 375 litros', 'price': 3200.0, 'store': 'Loja A', 'url': 'http://a/2'},
+    {'name': 'Mouse Logitech M90', 'price': 40.0, 'store': 'Loja B', 'url': 'http://b/1'},
+    {'name': 'Teclado Logitech K120', 'price': 70.0, 'store': 'Loja B', 'url': 'http://b/2'},
+    {'name': 'Notebook Dell Inspiron 15', 'price': 4000.0, 'store': 'Loja C', 'url': 'http://c/1'},
+    {'name': 'Cadeira de escritório preta', 'price': 600.0, 'store': 'Loja C', 'url': 'http://c/2'},
+]
+
+
+@pytest.fixture
+def catalog(tmp_path):
+    index = CatalogIndex(str(tmp_path / 'catalog'), brands=PriceDiscoverySystem.BRAND_INDICATORS)
+    index.import_records(PRODUCTS)
+    return index
+
+
+def test_exact_product_scores_one(catalog):
+    hit = catalog.search('Geladeira Consul 375 litros')[0]
+    assert hit['name'] == 'Geladeira Consul 375 litros'
+    assert hit['score'] == 1.0
+
+
+@pytest.mark.parametrize('query', [
+    'Geladeira side by side tripla',
+    'Mouse gamer sem fio rgb',
+    'Geladeira duplex',
+])
+def test_query_terms_missing_from_catalog_lower_the_score(catalog, query):
+    hits = catalog.search(query)
+    assert not hits or hits[0]['score'] < 0.75
+
+
+def test_brand_filter(catalog):
+    hits = catalog.search('Geladeira Brastemp 375 litros', limit=5)
+    assert [hit['name'] for hit in hits] == ['Geladeira Brastemp Frost Free 375 litros']
+
+
+def test_newer_segment_replaces_product(catalog):
+    catalog.import_records([dict(PRODUCTS[2], price=35.0)])
+    hits = catalog.search('Mouse Logitech M90', limit=5)
+    assert [hit['price'] for hit in hits if hit['name'] == 'Mouse Logitech M90'] == [35.0]
+
+
+def test_compact_keeps_latest_versions(catalog):
+    catalog.import_records([dict(PRODUCTS[2], price=35.0)])
+    assert catalog.compact() == len(PRODUCTS)
+    assert len(catalog.segments) == 1
+    assert catalog.search('Mouse Logitech M90')[0]['price'] == 35.0
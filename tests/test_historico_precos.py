@@ -0,0 +1,76 @@
+from dataclasses import replace
+from datetime import timedelta
+
+import pytest
+
+import historico_precos
+from busca_precos_basica import PriceResult
+from historico_precos import PriceHistoryStore
+
+
+@pytest.fixture
+def clock(monkeypatch):
+    """Relógio do histórico controlado pelo teste"""
+    now = [historico_precos._utc_now()]
+    monkeypatch.setattr(historico_precos, '_utc_now', lambda: now[0])
+    return now
+
+
+@pytest.fixture
+def store(tmp_path):
+    store = PriceHistoryStore(str(tmp_path / 'history.db'))
+    yield store
+    store.close()
+
+
+def found(price, confidence=0.9):
+    return PriceResult(item='Notebook Dell', status='price_found', reason='', price=price, store='Loja',
+                       url='https://loja/1', confidence=confidence)
+
+
+def test_fresh_observation_respects_the_age_window(store, clock):
+    store.record('notebook dell', found(3299.0))
+
+    clock[0] += timedelta(days=29)
+    assert store.fresh_observation('notebook dell', max_age_days=30, min_confidence=0.7)['price'] == 3299.0
+    clock[0] += timedelta(days=2)
+    assert store.fresh_observation('notebook dell', max_age_days=30, min_confidence=0.7) is None
+    # Janela maior: a mesma observação volta a valer
+    assert store.fresh_observation('notebook dell', max_age_days=60, min_confidence=0.7) is not None
+
+
+def test_fresh_observation_requires_min_confidence(store, clock):
+    store.record('notebook dell', found(3299.0, confidence=0.6))
+
+    assert store.fresh_observation('notebook dell', max_age_days=30, min_confidence=0.7) is None
+    assert store.fresh_observation('notebook dell', max_age_days=30, min_confidence=0.5)['confidence'] == 0.6
+
+
+def test_only_the_latest_observation_counts(store, clock):
+    store.record('notebook dell', found(3299.0))
+    clock[0] += timedelta(hours=1)
+    store.record('notebook dell', PriceResult(item='Notebook Dell', status='not_found', reason=''))
+    # A última busca não achou preço: o preço antigo não é reaproveitado
+    assert store.fresh_observation('notebook dell', max_age_days=30, min_confidence=0.7) is None
+
+    clock[0] += timedelta(hours=1)
+    store.record('notebook dell', found(3199.0))
+    assert store.fresh_observation('notebook dell', max_age_days=30, min_confidence=0.7)['price'] == 3199.0
+    assert store.fresh_observation('dell notebook', max_age_days=30, min_confidence=0.7) is None
+    assert store.stats() == {'observations': 3, 'items': 1}
+
+
+def test_every_query_agrees_on_the_latest_observation(store, clock):
+    # Um shard grava depois uma observação feita antes (fora de ordem de inserção)
+    store.record('notebook dell', found(3199.0))
+    clock[0] -= timedelta(hours=1)
+    store.record('notebook dell', PriceResult(item='Notebook Dell', status='not_found', reason=''))
+    clock[0] += timedelta(hours=1)
+
+    assert store.latest('notebook dell')['price'] == 3199.0
+    assert store.fresh_observation('notebook dell', max_age_days=30, min_confidence=0.7)['price'] == 3199.0
+    assert list(store.found_item_keys()) == ['notebook dell']
+    assert store.latest_prices() == {'notebook dell': 3199.0}
+
+    store.record_verification('notebook dell', replace(found(3199.0), verification='price_confirmed'))
+    assert store.latest('notebook dell')['verification'] == 'price_confirmed'
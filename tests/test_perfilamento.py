@@ -0,0 +1,96 @@
+import os
+import threading
+import time
+
+from perfilamento import CATEGORIES, StageProfiler
+
+
+def busy(seconds):
+    """Laço de CPU para o amostrador encontrar na pilha"""
+    deadline = time.perf_counter() + seconds
+    total = 0
+    while time.perf_counter() < deadline:
+        total += 1
+    return total
+
+
+def read_folded(path):
+    with open(path, encoding='utf-8') as f:
+        return [line.rsplit(' ', 1) for line in f.read().splitlines()]
+
+
+def test_disabled_profiler_records_nothing():
+    profiler = StageProfiler()
+    with profiler.stage('search'):
+        busy(0.01)
+    assert profiler.summary() == {}
+    profiler.stop()
+
+
+def test_stages_nest_and_write_folded_stacks(tmp_path):
+    profiler = StageProfiler()
+    profiler.start(str(tmp_path), 'teste', interval_ms=1)
+    with profiler.stage('price_discovery'):
+        with profiler.stage('search'):
+            busy(0.1)
+        with profiler.stage('search'):
+            busy(0.1)
+        busy(0.05)
+    profiler.stop()
+
+    summary = profiler.summary()
+    assert set(summary) >= {'price_discovery', 'price_discovery/search'}
+    # O tempo da etapa inclui o das sub-etapas; as duas entradas em "search" se somam
+    assert summary['price_discovery/search']['wall_s'] >= 0.2
+    assert summary['price_discovery']['wall_s'] >= summary['price_discovery/search']['wall_s'] + 0.05
+
+    files = os.listdir(profiler.output_dir)
+    assert {'price_discovery.search.folded', 'flamegraph.folded', 'flamegraph.svg', 'summary.json'} <= set(files)
+
+    # Pilhas colapsadas: "etapa;categoria;quadro;...;quadro contagem", da raiz para a folha
+    lines = read_folded(os.path.join(profiler.output_dir, 'flamegraph.folded'))
+    assert lines and all(count.isdigit() for _, count in lines)
+    stacks = [stack.split(';') for stack, _ in lines]
+    assert all(stack[0] in summary and stack[1] in CATEGORIES for stack in stacks)
+    searching = [stack for stack in stacks if stack[0] == 'price_discovery/search']
+    assert any(stack[-1].startswith('busy (test_perfilamento.py') for stack in searching)
+
+    # O arquivo da etapa é o mesmo sem a coluna da etapa
+    stage_lines = read_folded(os.path.join(profiler.output_dir, 'price_discovery.search.folded'))
+    assert sum(int(count) for _, count in stage_lines) == sum(
+        int(count) for stack, count in lines if stack.startswith('price_discovery/search;'))
+
+
+def first_job(profiler, started):
+    with profiler.stage('job_a'):
+        started.wait()
+        busy(0.2)
+
+
+def second_job(profiler, started):
+    with profiler.stage('job_b'):
+        started.wait()
+        busy(0.2)
+
+
+def test_each_thread_samples_its_own_stage(tmp_path):
+    profiler = StageProfiler()
+    profiler.start(str(tmp_path), 'teste', interval_ms=1)
+    started = threading.Barrier(2)
+    threads = [threading.Thread(target=job, args=(profiler, started)) for job in (first_job, second_job)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    profiler.stop()
+
+    # Etapas de threads diferentes não se aninham nem trocam de amostras
+    summary = profiler.summary()
+    assert {'job_a', 'job_b'} <= set(summary) and not any('/' in stage for stage in summary)
+    assert summary['job_a']['wall_s'] >= 0.2 and summary['job_b']['wall_s'] >= 0.2
+    lines = read_folded(os.path.join(profiler.output_dir, 'flamegraph.folded'))
+    stacks = [stack.split(';') for stack, _ in lines]
+    for stage, own, other in (('job_a', 'first_job', 'second_job'), ('job_b', 'second_job', 'first_job')):
+        frames = [frame for stack in stacks if stack[0] == stage for frame in stack]
+        assert any(frame.startswith(own + ' (') for frame in frames)
+        assert not any(frame.startswith(other + ' (') for frame in frames)
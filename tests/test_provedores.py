@@ -0,0 +1,85 @@
+import threading
+import time
+from http.server import ThreadingHTTPServer
+
+import pytest
+import requests
+
+from provedor_local import StandInHandler, StandInState
+from provedores import Provider, ProviderError, ProviderRouter, parse_providers, share_providers
+
+
+def test_share_providers_splits_concurrency_between_workers():
+    spec = 'a|http://a/chat/completions|$KEY_A|8,b|http://b/chat/completions||3|modelo,c'
+    providers = parse_providers(share_providers(spec, 4))
+    assert [(provider.name, provider.concurrency) for provider in providers] == [('a', 2), ('b', 1), ('c', 1)]
+    assert providers[1].model == 'modelo'
+    assert providers[1].url == 'http://b/chat/completions'
+
+
+@pytest.fixture
+def local_provider():
+    """Sobe instâncias de provedor_local.py em threads (porta livre cada uma)"""
+    servers = []
+
+    def start(name, latency=0.01, error_rate=0.0):
+        handler = type('Handler', (StandInHandler,), {'state': StandInState(latency, 0.0, error_rate)})
+        server = ThreadingHTTPServer(('127.0.0.1', 0), handler)
+        threading.Thread(target=server.serve_forever, daemon=True).start()
+        servers.append(server)
+        return Provider(name, f"http://127.0.0.1:{server.server_port}/chat/completions", concurrency=2)
+
+    yield start
+    for server in servers:
+        server.shutdown()
+        server.server_close()
+
+
+def post(provider):
+    response = requests.post(provider.url, json={'messages': [{'role': 'user', 'content': 'Otimize: "mouse"'}]},
+                             timeout=5)
+    if response.status_code != 200:
+        raise ProviderError(f"API error {response.status_code}")
+    return response.json()
+
+
+def test_calls_move_to_the_healthy_provider(local_provider):
+    broken = local_provider('quebrado', error_rate=1.0)
+    healthy = local_provider('saudavel', latency=0.05)
+    router = ProviderRouter([broken, healthy], failure_threshold=3, cooldown_s=60)
+
+    answered = [router.call(post)[1].name for _ in range(10)]
+
+    assert answered == ['saudavel'] * 10
+    # Uma falha rápida não faz o provedor quebrado parecer mais rápido que o saudável
+    assert broken.failures == router.failovers == 1
+    assert router._score(broken) > router._score(healthy)
+
+
+def test_failing_provider_is_paused_until_cooldown(local_provider):
+    broken = local_provider('quebrado', error_rate=1.0)
+    router = ProviderRouter([broken, local_provider('saudavel')], failure_threshold=1, cooldown_s=0.3,
+                            probe_after_s=0.1)
+
+    assert router.call(post)[1].name == 'saudavel'
+    assert broken.failures == 1
+    assert router.stats()[0]['paused']
+
+    # Ocioso há mais que probe_after_s, mas ainda em pausa: não recebe chamadas
+    time.sleep(0.15)
+    assert router.call(post)[1].name == 'saudavel'
+    assert broken.failures == 1
+
+    # Depois da pausa, o único provedor ocioso recebe uma chamada de teste (que falha de novo)
+    time.sleep(0.2)
+    assert router.call(post)[1].name == 'saudavel'
+    assert broken.failures == 1
+    assert router.call(post)[1].name == 'saudavel'
+    assert broken.failures == 2
+
+
+def test_all_providers_failing_raises_last_error(local_provider):
+    router = ProviderRouter([local_provider('a', error_rate=1.0), local_provider('b', error_rate=1.0)])
+    with pytest.raises(ProviderError):
+        router.call(post)
+    assert router.failovers == 1
@@ -0,0 +1,112 @@
+import io
+import json
+import threading
+import time
+
+import pandas as pd
+import pytest
+import requests
+
+from fakes import FakePreprocessor, FakeSession
+from servidor import PriceDiscoveryService, create_server
+
+
+@pytest.fixture
+def service(tmp_path, monkeypatch):
+    monkeypatch.setenv('PERPLEXITY_API_KEY', 'test')
+    monkeypatch.setenv('OPENAI_API_KEY', 'test')
+    monkeypatch.delenv('SEARCH_PROVIDERS', raising=False)
+    monkeypatch.setenv('PRICE_HISTORY_DB', str(tmp_path / 'history.db'))
+    monkeypatch.setenv('CATALOG_INDEX', str(tmp_path / 'sem_catalogo'))
+    service = PriceDiscoveryService(str(tmp_path / 'jobs'), workers=1)
+    service.price_system.session = FakeSession(
+        '{"price": 2899.0, "store": "Loja", "url": "https://loja/1", "confidence": 0.9}')
+    service.preprocessor = FakePreprocessor()
+    yield service
+    service.executor.shutdown(wait=True)
+
+
+@pytest.fixture
+def base_url(service):
+    server = create_server(service, port=0)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    yield f"http://127.0.0.1:{server.server_port}"
+    server.shutdown()
+    server.server_close()
+
+
+def strict_json(response):
+    """JSON da resposta, recusando NaN/Infinity (inválidos fora do Python)"""
+    def reject(constant):
+        raise ValueError(f"{constant} is not valid JSON")
+    return json.loads(response.text, parse_constant=reject)
+
+
+def test_health_reports_the_shared_caches(base_url):
+    response = requests.get(f"{base_url}/health", timeout=10)
+    assert response.status_code == 200
+    health = strict_json(response)
+    assert health['status'] == 'ok'
+    assert health['jobs'] == {}
+    assert 'item_cache' in health
+    assert health['preprocessor'] is True
+
+
+def test_health_is_strict_json_after_searches(base_url):
+    requests.get(f"{base_url}/item", params={'q': 'Notebook Dell Inspiron 15 polegadas 8GB'}, timeout=10)
+    health = strict_json(requests.get(f"{base_url}/health", timeout=10))
+    tiers = {tier['Tier']: tier for tier in health['search_tiers']}
+    assert tiers['sonar/150']['Calls'] == 1 and tiers['sonar/150']['Avg_Latency_s'] >= 0
+    # Camada sem chamadas: médias ausentes viram null
+    assert tiers['sonar-pro/500']['Calls'] == 0 and tiers['sonar-pro/500']['Avg_Latency_s'] is None
+
+
+def test_items_share_the_warm_item_cache(base_url, service):
+    item = 'Geladeira Consul 375 litros frost free'
+    first = requests.get(f"{base_url}/item", params={'q': item, 'categoria': 'Cozinha'}, timeout=10).json()
+    assert first['status'] == 'price_found' and first['price'] == 2899.0
+    assert first['category'] == 'Cozinha'
+
+    # Outra requisição, mesmo item: vem do cache do sistema aquecido, sem nova busca
+    second = requests.post(f"{base_url}/item", json={'item': item}, timeout=10).json()
+    assert second['price'] == 2899.0 and second['reason'] == 'Found in item cache'
+    assert len(service.price_system.session.payloads) == 1
+
+
+def test_bad_requests_and_unknown_routes(base_url):
+    assert requests.get(f"{base_url}/item", timeout=10).status_code == 400
+    assert requests.post(f"{base_url}/item", data=b'{', timeout=10).status_code == 400
+    assert requests.post(f"{base_url}/item", json={'categoria': 'Cozinha'}, timeout=10).status_code == 400
+    assert requests.post(f"{base_url}/jobs", timeout=10).status_code == 400
+    assert requests.get(f"{base_url}/jobs/nenhum", timeout=10).status_code == 404
+    assert requests.get(f"{base_url}/jobs/nenhum/report", timeout=10).status_code == 404
+    assert requests.get(f"{base_url}/nada", timeout=10).status_code == 404
+
+
+def test_job_runs_the_workflow_and_serves_the_report(base_url, service):
+    items = ['Geladeira Consul 375 litros frost free', 'Monitor LG 24 polegadas full hd']
+    spreadsheet = io.BytesIO()
+    pd.DataFrame({'Item': items}).to_excel(spreadsheet, index=False)
+
+    response = requests.post(f"{base_url}/jobs", data=spreadsheet.getvalue(), timeout=10)
+    assert response.status_code == 202
+    job_id = response.json()['job_id']
+
+    deadline = time.monotonic() + 30
+    job = strict_json(requests.get(f"{base_url}/jobs/{job_id}", timeout=10))
+    while job['status'] in ('queued', 'running') and time.monotonic() < deadline:
+        time.sleep(0.1)
+        job = strict_json(requests.get(f"{base_url}/jobs/{job_id}", timeout=10))
+    assert job['status'] == 'done', job['error']
+    assert job['finished_at'] is not None
+    # O job usou o pré-processador compartilhado do serviço
+    assert len(service.preprocessor.files) == 1
+
+    report = requests.get(f"{base_url}/jobs/{job_id}/report", timeout=10)
+    assert report.status_code == 200
+    results = pd.read_excel(io.BytesIO(report.content), sheet_name='Complete_Results')
+    assert results['Item_Otimizado'].tolist() == items
+    assert results['Price'].tolist() == [2899.0, 2899.0]
+
+    health = strict_json(requests.get(f"{base_url}/health", timeout=10))
+    assert health['jobs'] == {'done': 1}
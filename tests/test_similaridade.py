@@ -0,0 +1,43 @@
+import pytest
+
+from similaridade import SimilarityIndex, TextNormalizer
+
+
+def test_normalizer_reads_units_and_brands():
+    normalizer = TextNormalizer(brands=['Brastemp', 'LG'])
+    normalized, units, brands = normalizer.normalize('Ar-condicionado LG 12.000 BTUs, geladeira Brastemp 375 litros')
+    assert '12000btu' in units and '375l' in units
+    assert brands == ['brastemp', 'lg']
+    assert normalized == normalizer.normalize('ar condicionado lg 12000 btus geladeira brastemp 375l')[0]
+
+
+@pytest.fixture(params=[50000, 2], ids=['pending', 'merged'])
+def index(request):
+    """Índice com as inserções ainda no buffer e com as bandas já reorganizadas"""
+    index = SimilarityIndex(0.5, brands=['Brastemp', 'Consul'], merge_every=request.param)
+    assert index.add('Geladeira Brastemp 375L inox', 'geladeira brastemp 375l')
+    assert index.add('Notebook Dell Inspiron 15 8GB', 'notebook dell')
+    assert index.add('Cadeira de escritório giratória', 'cadeira')
+    return index
+
+
+def test_differently_worded_items_match(index):
+    for text in ('geladeira brastemp 375 litros', 'Refrigerador Brastemp 375L'):
+        key, score = index.lookup(text)
+        assert key == 'geladeira brastemp 375l'
+        assert 0.5 <= score <= 1.0
+    assert index.lookup('Cadeira escritorio giratoria preta')[0] == 'cadeira'
+
+
+def test_units_and_brands_must_match(index):
+    assert index.lookup('Geladeira Brastemp 400L inox') is None
+    assert index.lookup('Geladeira Consul 375L inox') is None
+    assert index.lookup('Mesa de jantar 6 lugares') is None
+
+
+def test_keys_are_indexed_once(index):
+    assert not index.add('Geladeira Brastemp 375L inox', 'geladeira brastemp 375l')
+    assert len(index) == 3
+    # Texto curto demais para ter assinatura
+    assert not index.add('ab', 'ab')
+    assert index.lookup('ab') is None
@@ -0,0 +1,116 @@
+import threading
+from http.server import ThreadingHTTPServer
+
+import pytest
+
+from busca_precos_basica import PriceResult
+from historico_precos import PriceHistoryStore
+from provedor_local import StandInHandler, StandInState
+from verificacao import ResultVerifier
+
+
+class CountingHandler(StandInHandler):
+    """Páginas de produto do provedor local, contando os GETs recebidos"""
+
+    state = StandInState(0.0, 0.0, 0.0)
+    gets = []
+
+    def do_GET(self):
+        self.gets.append(self.path)
+        super().do_GET()
+
+
+@pytest.fixture
+def store_url():
+    """Base http://127.0.0.1:<porta> de uma "loja" local que serve /produto/<centavos>"""
+    CountingHandler.gets.clear()
+    server = ThreadingHTTPServer(('127.0.0.1', 0), CountingHandler)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    yield f"http://127.0.0.1:{server.server_port}"
+    server.shutdown()
+    server.server_close()
+
+
+@pytest.fixture
+def verifier():
+    verifier = ResultVerifier(workers=4, per_domain=2, timeout=5)
+    yield verifier
+    verifier.close()
+
+
+def found(url, price=1299.90, item='Notebook Dell'):
+    return PriceResult(item=item, status='price_found', reason='', price=price, store='Loja', url=url,
+                       confidence=0.8)
+
+
+@pytest.mark.parametrize('path, price, outcome, confidence', [
+    ('/produto/129990', 1299.90, 'price_confirmed', 0.95),
+    ('/produto/129990', 999.00, 'reachable', 0.8),
+    ('/nada', 1299.90, 'unreachable', 0.4),
+    ('/', 1299.90, 'placeholder', 0.5),
+])
+def test_verify_outcomes(store_url, verifier, path, price, outcome, confidence):
+    verified = verifier.submit(found(store_url + path, price)).result(timeout=10)
+    assert verified.verification == outcome
+    assert verified.confidence == pytest.approx(confidence)
+
+
+def test_same_url_is_fetched_once_per_run(store_url, verifier):
+    url = store_url + '/produto/129990'
+    checks = {}
+    futures = [verifier.submit(found(url, item=f"Notebook Dell {n}"), checks) for n in range(5)]
+    assert {future.result(timeout=10).verification for future in futures} == {'price_confirmed'}
+    assert [future.result().item for future in futures] == [f"Notebook Dell {n}" for n in range(5)]
+    assert CountingHandler.gets == ['/produto/129990']
+    assert len(checks) == 1
+
+    # Outra execução (ex.: outro job do servidor) confere a URL de novo, sem apagar as checagens da primeira
+    verifier.submit(found(url), {}).result(timeout=10)
+    assert len(CountingHandler.gets) == 2
+    verifier.submit(found(url, item='Notebook Dell 5'), checks).result(timeout=10)
+    assert len(CountingHandler.gets) == 2 and len(checks) == 1
+
+
+class BadCharsetHandler(CountingHandler):
+    """Página que declara um charset inexistente"""
+
+    def do_GET(self):
+        body = 'Por R$ 1.299,90'.encode('utf-8')
+        self.send_response(200)
+        self.send_header('Content-Type', 'text/html; charset=nao-existe')
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+
+def test_unknown_charset_is_unreachable(verifier):
+    server = ThreadingHTTPServer(('127.0.0.1', 0), BadCharsetHandler)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    try:
+        url = f"http://127.0.0.1:{server.server_port}/produto/129990"
+        assert verifier.verify(found(url)).verification == 'unreachable'
+    finally:
+        server.shutdown()
+        server.server_close()
+
+
+def test_verified_results_are_not_adjusted_again(store_url, verifier):
+    verified = verifier.submit(found(store_url + '/produto/129990')).result(timeout=10)
+    assert verifier.submit(verified) is None
+
+
+def test_verification_is_written_to_history(tmp_path, store_url, verifier):
+    history = PriceHistoryStore(str(tmp_path / 'history.db'))
+    result = found(store_url + '/nada')
+    history.record('notebook dell', result)
+
+    history.record_verification('notebook dell', verifier.submit(result).result(timeout=10))
+    observation = history.latest('notebook dell')
+    assert observation['verification'] == 'unreachable'
+    assert observation['confidence'] == pytest.approx(0.4)
+
+    # Observação mais nova com outra URL não é sobrescrita
+    history.record('notebook dell', found(store_url + '/produto/1'))
+    history.record_verification('notebook dell', verifier.verify(result))
+    assert history.latest('notebook dell')['verification'] is None
+    history.close()
@@ -0,0 +1,163 @@
+#!/usr/bin/env python3
+"""
+Verificação de Resultados
+Etapa opcional que roda em paralelo à busca: abre as URLs retornadas, confirma
+que respondem e, quando possível, que a página mostra o preço informado, e
+ajusta a confiança do resultado. Usa um pool de conexões HTTP com limite de
+conexões simultâneas por domínio e timeout, em threads de fundo, para não
+atrasar o pipeline principal.
+"""
+
+import os
+import re
+import logging
+import threading
+from dataclasses import replace
+from typing import Dict, Optional, Tuple
+from urllib.parse import urlparse
+from concurrent.futures import Future, ThreadPoolExecutor
+
+import requests
+from requests.adapters import HTTPAdapter
+
+logger = logging.getLogger(__name__)
+
+# Resultado da verificação -> ajuste de confiança
+CONFIDENCE_ADJUSTMENTS = {
+    'price_confirmed': 0.15,   # página responde e mostra o preço
+    'reachable': 0.0,          # página responde, preço não encontrado no HTML
+    'unreachable': -0.4,       # erro HTTP, timeout ou conexão recusada
+    'placeholder': -0.3,       # URL genérica (ex.: só o domínio da loja)
+}
+
+
+def _price_variants(price: float):
+    """Formas comuns de escrever o preço em uma página ("1.299,90", "1299,90", "1299.90")"""
+    brazilian = f"{price:,.2f}".replace(',', '_').replace('.', ',').replace('_', '.')
+    plain = f"{price:.2f}"
+    return {brazilian, brazilian.replace('.', ''), plain, plain.replace('.', ',')}
+
+
+class ResultVerifier:
+    """Verifica URLs e preços de PriceResults em segundo plano"""
+
+    def __init__(self, workers: int = 16, per_domain: int = 4, timeout: float = 10.0,
+                 max_bytes: int = 1_000_000):
+        """
+        Args:
+            workers: Verificações simultâneas no total
+            per_domain: Conexões simultâneas por domínio
+            timeout: Timeout (s) de conexão e leitura de cada página
+            max_bytes: Quanto de cada página é lido para procurar o preço
+        """
+        self.per_domain = per_domain
+        self.timeout = timeout
+        self.max_bytes = max_bytes
+
+        self.session = requests.Session()
+        adapter = HTTPAdapter(pool_connections=workers, pool_maxsize=workers)
+        self.session.mount("https://", adapter)
+        self.session.mount("http://", adapter)
+        self.session.headers['User-Agent'] = 'Mozilla/5.0 (price-discovery verification)'
+
+        self.executor = ThreadPoolExecutor(max_workers=workers, thread_name_prefix='verify')
+        self._domain_slots: Dict[str, threading.BoundedSemaphore] = {}
+        self._lock = threading.Lock()
+        self.counts: Dict[str, int] = {}
+
+    @classmethod
+    def from_env(cls) -> 'ResultVerifier':
+        """Verificador configurado por VERIFY_WORKERS, VERIFY_PER_DOMAIN e VERIFY_TIMEOUT"""
+        return cls(
+            workers=int(os.getenv('VERIFY_WORKERS', '16')),
+            per_domain=int(os.getenv('VERIFY_PER_DOMAIN', '4')),
+            timeout=float(os.getenv('VERIFY_TIMEOUT', '10'))
+        )
+
+    def _domain_slot(self, domain: str) -> threading.BoundedSemaphore:
+        with self._lock:
+            slot = self._domain_slots.get(domain)
+            if slot is None:
+                slot = self._domain_slots[domain] = threading.BoundedSemaphore(self.per_domain)
+            return slot
+
+    def submit(self, result, checks: Optional[Dict[Tuple[str, Optional[float]], Future]] = None) -> Optional[Future]:
+        """
+        Agenda a verificação de um resultado com preço e URL, ainda não verificado.
+        O Future devolve o PriceResult com `verification` e confiança ajustadas.
+
+        Args:
+            checks: Verificações já feitas nesta execução, (url, preço) -> Future.
+                Cada execução passa o seu: a mesma URL com o mesmo preço é baixada
+                uma única vez por execução, sem interferir em outras execuções
+                (jobs do servidor) que usam o mesmo verificador.
+        """
+        if result.status != 'price_found' or not result.url or result.verification:
+            return None
+
+        key = (result.url, result.price)
+        with self._lock:
+            check = checks.get(key) if checks is not None else None
+            if check is None:
+                check = self.executor.submit(self._check, result.url, result.price)
+                if checks is not None:
+                    checks[key] = check
+
+        verified = Future()
+
+        def adjust(done: Future):
+            try:
+                verified.set_result(self._adjusted(result, done.result()))
+            except Exception as e:
+                verified.set_exception(e)
+
+        check.add_done_callback(adjust)
+        return verified
+
+    def verify(self, result):
+        """Verifica um resultado (bloqueante) e devolve a versão ajustada"""
+        return self._adjusted(result, self._check(result.url, result.price))
+
+    def _adjusted(self, result, outcome: str):
+        """Resultado com o desfecho da verificação e a confiança ajustada"""
+        with self._lock:
+            self.counts[outcome] = self.counts.get(outcome, 0) + 1
+
+        confidence = result.confidence if result.confidence is not None else 0.8
+        confidence = min(1.0, max(0.0, confidence + CONFIDENCE_ADJUSTMENTS[outcome]))
+        return replace(result, verification=outcome, confidence=round(confidence, 3))
+
+    def _check(self, url: str, price: Optional[float]) -> str:
+        """Classifica uma URL: price_confirmed, reachable, unreachable ou placeholder"""
+        parsed = urlparse(url)
+        if parsed.scheme not in ('http', 'https') or not parsed.netloc:
+            return 'unreachable'
+        if parsed.path in ('', '/') and not parsed.query:
+            return 'placeholder'
+
+        try:
+            with self._domain_slot(parsed.netloc.lower()):
+                with self.session.get(url, timeout=self.timeout, stream=True, allow_redirects=True) as response:
+                    if response.status_code >= 400:
+                        return 'unreachable'
+                    content = b''
+                    for chunk in response.iter_content(chunk_size=65536):
+                        content += chunk
+                        if len(content) >= self.max_bytes:
+                            break
+            page = content.decode(response.encoding or 'utf-8', errors='ignore') if price else ''
+        # LookupError/UnicodeDecodeError: charset desconhecido ou inválido no cabeçalho
+        except (requests.RequestException, LookupError, UnicodeDecodeError) as e:
+            logger.debug(f"Verification failed for {url}: {e}")
+            return 'unreachable'
+
+        if price:
+            page = re.sub(r'[\s\xa0]+', ' ', page)
+            if any(variant in page for variant in _price_variants(price)):
+                return 'price_confirmed'
+        return 'reachable'
+
+    def close(self):
+        """Encerra o pool (aguarda as verificações pendentes)"""
+        self.executor.shutdown(wait=True)
+        self.session.close()